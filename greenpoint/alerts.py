@@ -0,0 +1,283 @@
+"""Alerts on instrument prices and portfolio weights.
+
+Rules are indexed by instrument and by the value they watch, sorted by
+threshold. When the live quote of an instrument changes, the rules fired
+are the ones whose threshold lies between the previous and the new value:
+checking a change costs a bisection, whatever the number of rules.
+
+The weight of a holding is checked when the quote of its instrument
+changes, not when other quotes change the value of the portfolio.
+"""
+import asyncio
+import bisect
+import datetime
+import math
+
+import aiohttp
+
+import attr
+
+import daiquiri
+
+from dateutil import tz
+
+from greenpoint import live
+from greenpoint import serialize
+from greenpoint import utils
+
+
+LOG = daiquiri.getLogger(__name__)
+
+KINDS = ("price", "move", "weight")
+DIRECTIONS = ("above", "below")
+
+
+@attr.s(slots=True)
+class Rule(object):
+    id = attr.ib()  # noqa
+    instrument_isin = attr.ib()
+    # `price` level, % `move` from `reference` or `weight` in % of the
+    # portfolios
+    kind = attr.ib()
+    direction = attr.ib()
+    value = attr.ib()
+    reference = attr.ib(default=None)
+
+    @property
+    def metric(self):
+        return "weight" if self.kind == "weight" else "price"
+
+    @property
+    def threshold(self):
+        if self.kind == "move":
+            return self.reference * (1 + self.value / 100)
+        return self.value
+
+    @classmethod
+    def from_record(cls, row):
+        return cls(**{a.name: row[a.name] for a in attr.fields(cls)})
+
+
+class ThresholdIndex(object):
+    """Rules watching one value of an instrument, sorted by threshold."""
+
+    def __init__(self):
+        self.rules = {direction: [] for direction in DIRECTIONS}
+
+    def __len__(self):
+        return sum(map(len, self.rules.values()))
+
+    def add(self, rule):
+        bisect.insort(self.rules[rule.direction], (rule.threshold, rule.id))
+
+    def remove(self, rule):
+        rules = self.rules[rule.direction]
+        i = bisect.bisect_left(rules, (rule.threshold, rule.id))
+        if i < len(rules) and rules[i][1] == rule.id:
+            del rules[i]
+
+    def crossed(self, old, new):
+        """Return the id of the rules crossed when going from old to new."""
+        if old is None or new is None or old == new:
+            return []
+        if new > old:
+            # old < threshold <= new
+            rules = self.rules["above"]
+            start = bisect.bisect_right(rules, (old, math.inf))
+            stop = bisect.bisect_right(rules, (new, math.inf))
+        else:
+            # new <= threshold < old
+            rules = self.rules["below"]
+            start = bisect.bisect_left(rules, (new, -math.inf))
+            stop = bisect.bisect_left(rules, (old, -math.inf))
+        return [rule_id for _, rule_id in rules[start:stop]]
+
+
+class AlertEngine(object):
+    """Fire alerts as live quotes change.
+
+    :param sinks: Where to send fired alerts, see `get_sinks`.
+    """
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.rules = {}
+        # ThresholdIndex and last value by (ISIN, metric)
+        self.indexes = {}
+        self.values = {}
+        self.portfolio = None
+
+    async def load(self):
+        """(Re)load the pending rules and the values they watch."""
+        pool = await utils.get_db()
+        rules = [Rule.from_record(row) for row in await pool.fetch(
+            "SELECT * FROM alerts WHERE fired_at IS NULL")]
+        self.rules = {rule.id: rule for rule in rules}
+        self.indexes = {}
+        for rule in rules:
+            key = rule.instrument_isin, rule.metric
+            self.indexes.setdefault(key, ThresholdIndex()).add(rule)
+        self.values = {}
+        for row in await pool.fetch(
+                "SELECT isin, latest_quote FROM instruments "
+                "WHERE latest_quote IS NOT NULL"):
+            self.values[row['isin'], "price"] = row['latest_quote']
+        if any(rule.metric == "weight" for rule in rules):
+            # Weights are revalued incrementally, as the live view does
+            self.portfolio = live.LiveQuotes()
+            await self.portfolio.load_status()
+            for isin, holding in self.portfolio.holdings.items():
+                if holding.market_value is not None and self.portfolio.total:
+                    self.values[isin, "weight"] = (
+                        100 * holding.market_value / self.portfolio.total)
+        else:
+            self.portfolio = None
+        LOG.info("Loaded %d alert rules", len(rules))
+
+    def _update(self, isin, metric, value):
+        old = self.values.get((isin, metric))
+        self.values[isin, metric] = value
+        index = self.indexes.get((isin, metric))
+        if index is None:
+            return []
+        return index.crossed(old, value)
+
+    async def check(self, isin, quote, time=None):
+        """Check the rules of an instrument after its quote changed.
+
+        :return: The alerts fired.
+        """
+        crossed = self._update(isin, "price", quote)
+        values = {"price": quote}
+        if self.portfolio is not None:
+            event = self.portfolio.update(isin, quote, time)
+            weight = event.get("weight")
+            if weight is not None:
+                values["weight"] = weight
+                crossed.extend(self._update(isin, "weight", weight))
+        if not crossed:
+            return []
+        return await self.fire(crossed, values, time)
+
+    async def fire(self, rule_ids, values, time=None):
+        if time is None:
+            time = datetime.datetime.now(tz.UTC)
+        pool = await utils.get_db()
+        # Another engine may have fired them already
+        rows = await pool.fetch(
+            "UPDATE alerts SET fired_at = $2 "
+            "WHERE id = any($1::int[]) AND fired_at IS NULL "
+            "RETURNING id",
+            rule_ids, time)
+        fired = []
+        for row in rows:
+            rule = self.rules.pop(row['id'])
+            self.indexes[rule.instrument_isin, rule.metric].remove(rule)
+            alert = attr.asdict(rule)
+            alert.update(threshold=rule.threshold, time=time,
+                         current=values[rule.metric])
+            fired.append(alert)
+        for alert in fired:
+            LOG.info("Alert %d fired: %s %s %s %s", alert['id'],
+                     alert['instrument_isin'], alert['kind'],
+                     alert['direction'], alert['value'])
+            for sink in self.sinks:
+                await sink.send(alert)
+        return fired
+
+
+async def add_rule(isin, kind, direction, value, reference=None):
+    """Store a new alert rule.
+
+    :param kind: `price`, `move` or `weight`.
+    :param direction: `above` or `below`.
+    :param reference: The price a `move` is relative to, the latest quote
+                      by default.
+    :return: The id of the rule.
+    """
+    if kind not in KINDS:
+        raise ValueError("Unknown alert kind %s" % kind)
+    if direction not in DIRECTIONS:
+        raise ValueError("Unknown alert direction %s" % direction)
+    pool = await utils.get_db()
+    if kind == "move" and reference is None:
+        reference = await pool.fetchval(
+            "SELECT latest_quote FROM instruments WHERE isin = $1", isin)
+        if reference is None:
+            raise ValueError("No live quote for %s" % isin)
+    rule_id = await pool.fetchval(
+        "INSERT INTO alerts "
+        "(instrument_isin, kind, direction, value, reference, created_at) "
+        "VALUES ($1, $2, $3, $4, $5, $6) RETURNING id",
+        isin, kind, direction, value, reference,
+        datetime.datetime.now(tz.UTC))
+    await utils.notify_change(pool, "alerts")
+    return rule_id
+
+
+async def list_rules():
+    pool = await utils.get_db()
+    return await pool.fetch(
+        "SELECT alerts.*, instruments.name FROM alerts "
+        "JOIN instruments ON instrument_isin = isin "
+        "ORDER BY fired_at IS NOT NULL, instrument_isin, id")
+
+
+async def remove_rule(rule_id):
+    """Delete an alert rule.
+
+    :return: Whether the rule existed.
+    """
+    pool = await utils.get_db()
+    status = await pool.execute("DELETE FROM alerts WHERE id = $1", rule_id)
+    await utils.notify_change(pool, "alerts")
+    return status != "DELETE 0"
+
+
+class FileSink(object):
+    """Append fired alerts to a file, one JSON document per line."""
+
+    def __init__(self, path):
+        self.path = path
+
+    async def send(self, alert):
+        with open(self.path, "ab") as f:
+            f.write(serialize.dumps(alert) + b"\n")
+
+
+class WebhookSink(object):
+    """POST fired alerts as JSON to a URL."""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def send(self, alert):
+        try:
+            async with aiohttp.ClientSession(timeout=self.timeout) as session:
+                async with session.post(
+                        self.url, data=serialize.dumps(alert),
+                        headers={"Content-Type": "application/json"}) as r:
+                    r.raise_for_status()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            LOG.warning("Unable to send alert %d to %s",
+                        alert['id'], self.url, exc_info=True)
+
+
+SINKS = {
+    "file": FileSink,
+    "webhook": WebhookSink,
+}
+
+
+def get_sinks():
+    """Build the sinks listed in the `alert_sinks` configuration option."""
+    sinks = []
+    for conf in utils.get_config().get('alert_sinks', ()):
+        conf = dict(conf)
+        type_name = conf.pop('type', None)
+        sink_type = SINKS.get(type_name)
+        if sink_type is None:
+            raise ValueError("Unknown alert sink type %s" % type_name)
+        sinks.append(sink_type(**conf))
+    return sinks
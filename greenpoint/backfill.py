@@ -0,0 +1,154 @@
+import asyncio
+import datetime
+
+import attr
+
+import daiquiri
+
+from greenpoint import instrument
+from greenpoint import market
+from greenpoint import planner
+from greenpoint import utils
+
+
+LOG = daiquiri.getLogger(__name__)
+
+ONE_DAY = datetime.timedelta(days=1)
+
+# Providers that only download the requested range
+RANGE_PROVIDERS = ("lesechos", "yahoo")
+
+# Gaps closer than that are fetched with one request
+MERGE_DISTANCE = datetime.timedelta(days=7)
+
+# Calendar used for instruments traded on an unknown exchange
+UNKNOWN_MARKET = ""
+
+
+@attr.s(slots=True, frozen=True)
+class Gap(object):
+    isin = attr.ib()
+    start = attr.ib()
+    stop = attr.ib()
+    # Number of missing trading days
+    days = attr.ib()
+
+
+def build_calendar(start, stop):
+    """Return the trading days of all known markets as two arrays.
+
+    Markets sharing the same holidays share the same days. Instruments of
+    unknown markets are expected to be quoted on week days.
+
+    :return: The MIC of each day and the days.
+    """
+    mics = []
+    days = []
+    by_holidays = {}
+    for mic, mkt in market.MARKETS.items():
+        if mkt.get_holidays not in by_holidays:
+            by_holidays[mkt.get_holidays] = mkt.trading_days(start, stop)
+        trading_days = by_holidays[mkt.get_holidays]
+        mics.extend([mic] * len(trading_days))
+        days.extend(trading_days)
+    day = start
+    while day <= stop:
+        if day.weekday() < 5:
+            mics.append(UNKNOWN_MARKET)
+            days.append(day)
+        day += ONE_DAY
+    return mics, days
+
+
+async def find_gaps(isins=None, since=None, until=None):
+    """Find the trading days missing from the stored quotes.
+
+    Only days between the first stored quote of an instrument and `until`
+    are considered. Consecutive missing trading days are returned as one
+    gap.
+
+    :param isins: ISIN of the instruments to check, all alive ones by
+                  default.
+    :param since: Date to start checking at, the oldest quote by default.
+    :param until: Date to stop checking at, yesterday by default.
+    :return: A list of `Gap`.
+    """
+    cur = await utils.get_db()
+    if until is None:
+        until = datetime.date.today() - ONE_DAY
+    if since is None:
+        since = await cur.fetchval("SELECT min(date) FROM quotes")
+        if since is None:
+            return []
+    mics, days = build_calendar(since, until)
+    rows = await cur.fetch(
+        "WITH calendar AS ("
+        "  SELECT mic, date, "
+        "  row_number() OVER (PARTITION BY mic ORDER BY date) AS n "
+        "  FROM unnest($1::text[], $2::date[]) AS c(mic, date)"
+        "), watched AS ("
+        "  SELECT isin, CASE WHEN exchange_mic = ANY($5::text[]) "
+        "  THEN exchange_mic ELSE $3 END AS mic "
+        "  FROM instruments "
+        "  WHERE is_alive AND ($4::text[] IS NULL OR isin = ANY($4))"
+        "), first_quotes AS ("
+        "  SELECT instrument_isin, min(date) AS date FROM quotes "
+        "  WHERE instrument_isin IN (SELECT isin FROM watched) "
+        "  GROUP BY instrument_isin"
+        "), missing AS ("
+        "  SELECT w.isin, c.date, "
+        "  c.n - row_number() OVER (PARTITION BY w.isin ORDER BY c.date) "
+        "  AS island "
+        "  FROM watched w "
+        "  JOIN first_quotes f ON f.instrument_isin = w.isin "
+        "  JOIN calendar c ON c.mic = w.mic AND c.date > f.date "
+        "  WHERE NOT EXISTS (SELECT 1 FROM quotes q "
+        "  WHERE q.instrument_isin = w.isin AND q.date = c.date)"
+        ") "
+        "SELECT isin, min(date) AS start, max(date) AS stop, count(*) AS days "
+        "FROM missing GROUP BY isin, island ORDER BY isin, start",
+        mics, days, UNKNOWN_MARKET, isins, list(market.MARKETS))
+    return [Gap(**row) for row in rows]
+
+
+def merge_gaps(gaps, distance=MERGE_DISTANCE):
+    """Merge gaps of the same instrument that are close to each other."""
+    merged = []
+    for gap in gaps:
+        if (merged and merged[-1].isin == gap.isin and
+           gap.start - merged[-1].stop <= distance):
+            last = merged.pop()
+            gap = Gap(gap.isin, last.start, gap.stop, last.days + gap.days)
+        merged.append(gap)
+    return merged
+
+
+def get_providers(inst):
+    """Return the providers to fetch a range of quotes with."""
+    providers = tuple(name for name, (supports, _) in
+                      planner.PROVIDERS.items() if supports(inst))
+    in_range = tuple(name for name in providers if name in RANGE_PROVIDERS)
+    return in_range or providers
+
+
+async def backfill(gaps, concurrency=10):
+    """Fetch the quotes missing in each gap.
+
+    :return: The number of quotes found.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    instruments = {}
+
+    async def fill(gap):
+        if gap.isin not in instruments:
+            instruments[gap.isin] = await instrument.Instrument.load(
+                isin=gap.isin)
+        inst = instruments[gap.isin]
+        async with semaphore:
+            found = await inst.refresh_quotes(gap.start, gap.stop,
+                                              get_providers(inst))
+        LOG.debug("Found %d quotes for %d missing days of %s",
+                  found, gap.days, inst)
+        return found
+
+    return sum(await asyncio.gather(*map(fill, gaps)))
@@ -0,0 +1,211 @@
+"""Time the portfolio queries and record their plans.
+
+Each query is run several times, then explained with
+`EXPLAIN (ANALYZE, BUFFERS)`. Results are appended to a JSON lines file and
+compared with the previous run on the same data set, so that the effect of
+a schema or query change can be measured. Use `synthetic` to generate the
+data set first.
+
+Usage::
+
+  python -m greenpoint.benchmarks.portfolio --repeat 5
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import statistics
+import subprocess
+import time
+
+from greenpoint import portfolio
+from greenpoint import utils
+from greenpoint.benchmarks import synthetic
+
+
+DEFAULT_OUTPUT = "benchmark-results.jsonl"
+
+
+class RecordingPool(object):
+    """Forward queries to a pool and record them."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.queries = []
+
+    def _record(self, query, args):
+        if (query, args) not in self.queries:
+            self.queries.append((query, args))
+
+    async def fetch(self, query, *args):
+        self._record(query, args)
+        return await self.pool.fetch(query, *args)
+
+    async def fetchrow(self, query, *args):
+        self._record(query, args)
+        return await self.pool.fetchrow(query, *args)
+
+    async def fetchval(self, query, *args):
+        self._record(query, args)
+        return await self.pool.fetchval(query, *args)
+
+
+async def portfolios_at(date):
+    pool = await utils.get_db()
+    return await pool.fetch("SELECT * FROM portfolios_at($1)", date)
+
+
+def get_benchmarks(date):
+    return {
+        "get_status_for_all": portfolio.get_status_for_all,
+        "get_status_for_broker": lambda: portfolio.get_status_for_broker(
+            synthetic.portfolio_name(0)),
+        "get_status_filtered": lambda: portfolio.get_status(
+            portfolio_name=synthetic.portfolio_name(0),
+            instrument_type="stock", currency="EUR"),
+        "portfolios_at": lambda: portfolios_at(date),
+    }
+
+
+def _buffers(plan):
+    return {k: plan.get(k, 0) for k in ("Shared Hit Blocks",
+                                        "Shared Read Blocks",
+                                        "Temp Read Blocks",
+                                        "Temp Written Blocks")}
+
+
+async def explain(query, args):
+    pool = await utils.get_db()
+    result = json.loads(await pool.fetchval(
+        "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, *args))[0]
+    return {
+        "query": query,
+        "planning_time": result["Planning Time"],
+        "execution_time": result["Execution Time"],
+        "buffers": _buffers(result["Plan"]),
+        "plan": result["Plan"],
+    }
+
+
+async def run_benchmark(func, repeat):
+    """Time a query function and explain the queries it runs."""
+    recorder = RecordingPool(await utils.get_db())
+    get_db = utils.get_db
+
+    async def recording_get_db(loop=None, max_size=None):
+        return recorder
+
+    utils.get_db = recording_get_db
+    try:
+        # The first run warms up the caches and records the queries
+        rows = len(await func())
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await func()
+            durations.append(time.perf_counter() - started)
+    finally:
+        utils.get_db = get_db
+
+    return {
+        "rows": rows,
+        "durations": durations,
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "plans": [await explain(query, args)
+                  for query, args in recorder.queries],
+    }
+
+
+async def describe_dataset():
+    pool = await utils.get_db()
+    return {
+        table: await pool.fetchval("SELECT count(*) FROM " + table)
+        for table in ("instruments", "quotes", "operations")
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return
+
+
+def load_results(path):
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def find_previous(results, name, dataset):
+    for result in reversed(results):
+        if result["name"] == name and result["dataset"] == dataset:
+            return result
+
+
+def format_result(result, previous):
+    line = "%-22s %8d rows  min %9.1f ms  median %9.1f ms" % (
+        result["name"], result["rows"],
+        result["min"] * 1000, result["median"] * 1000)
+    for plan in result["plans"]:
+        line += "  [exec %.1f ms, %d hit, %d read]" % (
+            plan["execution_time"],
+            plan["buffers"]["Shared Hit Blocks"],
+            plan["buffers"]["Shared Read Blocks"])
+    if previous is not None:
+        line += "  %+.0f%% vs %s" % (
+            100 * (result["median"] / previous["median"] - 1),
+            previous["commit"] or previous["time"])
+    return line
+
+
+async def run(repeat, output, date=None, names=None):
+    if date is None:
+        date = datetime.date.today()
+    previous_results = load_results(output)
+    dataset = await describe_dataset()
+    commit = get_commit()
+    results = []
+    for name, func in get_benchmarks(date).items():
+        if names and name not in names:
+            continue
+        result = await run_benchmark(func, repeat)
+        result.update(name=name, dataset=dataset, commit=commit,
+                      time=datetime.datetime.now().isoformat())
+        print(format_result(
+            result, find_previous(previous_results, name, dataset)))
+        results.append(result)
+
+    with open(output, "a") as f:
+        for result in results:
+            f.write(json.dumps(result, default=str) + "\n")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT,
+                        help="File to append the results to")
+    parser.add_argument("--date", type=datetime.date.fromisoformat,
+                        default=None, help="Date passed to portfolios_at")
+    parser.add_argument("names", nargs="*",
+                        help="Benchmarks to run, all by default")
+    args = parser.parse_args()
+
+    async def _run():
+        try:
+            await run(args.repeat, args.output, args.date, args.names)
+        finally:
+            await utils.close_db()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Local stand-in for the quote providers.
+
+The server answers in the format of each provider with synthetic quotes,
+or with recorded responses, so that refreshes can be tested and measured
+without network access.
+"""
+import asyncio
+import calendar
+import collections
+import datetime
+import functools
+import hashlib
+import json
+import random
+
+from aiohttp import web
+
+from lxml import etree
+
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+@functools.lru_cache(maxsize=4096)
+def _synthetic_history(key, start, stop):
+    seed = int.from_bytes(hashlib.blake2b(key.encode(),
+                                          digest_size=8).digest(), "big")
+    rng = random.Random(seed)
+    price = rng.uniform(5, 500)
+    history = []
+    day = start
+    while day <= stop:
+        if day.weekday() < 5:
+            open_ = price
+            price = max(0.01, price * (1 + rng.gauss(0, 0.02)))
+            history.append((
+                day,
+                round(open_, 2),
+                round(price, 2),
+                round(max(open_, price) * (1 + rng.uniform(0, 0.01)), 2),
+                round(min(open_, price) * (1 - rng.uniform(0, 0.01)), 2),
+                rng.randint(100, 100000),
+            ))
+        day += ONE_DAY
+    return tuple(history)
+
+
+def synthetic_quotes(key, start=None, stop=None, history_start=None,
+                     history_stop=None):
+    """Return deterministic daily quotes of an instrument.
+
+    :return: A list of (date, open, close, high, low, volume) tuples.
+    """
+    history = _synthetic_history(key, history_start, history_stop)
+    return [q for q in history
+            if (start is None or q[0] >= start) and
+            (stop is None or q[0] <= stop)]
+
+
+class ProviderServer(object):
+    """An aiohttp server standing in for all the quote providers.
+
+    :param latency: Seconds to wait before answering each request.
+    :param error_rate: Fraction of requests answered with an error 503.
+    :param history_days: Number of days of synthetic history.
+    :param unknown: Identifiers for which no quote is returned.
+    :param currencies: Currency of the live quotes by Yahoo symbol, EUR by
+                       default.
+    :param recorded: Responses to return as they are, as a dict of
+                     `path: (content_type, body)`.
+    :param seed: Seed of the error injection.
+    """
+
+    def __init__(self, latency=0, error_rate=0, history_days=365,
+                 unknown=(), currencies=None, recorded=None, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.history_stop = datetime.date.today()
+        self.history_start = self.history_stop - datetime.timedelta(
+            days=history_days)
+        self.unknown = set(unknown)
+        self.currencies = currencies or {}
+        self.recorded = recorded or {}
+        self.random = random.Random(seed)
+        self.requests = collections.Counter()
+        self.runner = None
+        self.url = None
+
+    def quotes(self, key, start=None, stop=None):
+        if key in self.unknown:
+            return []
+        return synthetic_quotes(key, start, stop,
+                                self.history_start, self.history_stop)
+
+    def urls(self):
+        """Return the provider URL attributes of `Instrument` to set."""
+        return {
+            "BOURSORAMA_URL": self.url,
+            "LESECHOS_URL": self.url,
+            "GOOGLE_URL": self.url,
+            "YAHOO_URL": self.url,
+        }
+
+    def make_app(self):
+        app = web.Application(middlewares=[self.inject])
+        app.add_routes([
+            web.get("/recherche/index.phtml", self.boursorama_search),
+            web.get("/cours.phtml", self.boursorama_page),
+            web.get("/graphiques/quotes.phtml", self.boursorama_quotes),
+            web.get("/FDS/history.xml", self.lesechos_history),
+            web.get("/finance/historical", self.google_historical),
+            web.get("/v8/finance/chart/{symbol}", self.yahoo_chart),
+            web.get("/v7/finance/quote", self.yahoo_quote),
+        ])
+        return app
+
+    @web.middleware
+    async def inject(self, request, handler):
+        self.requests[request.path] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            return web.Response(status=503, text="Service Unavailable")
+        if request.path in self.recorded:
+            content_type, body = self.recorded[request.path]
+            return web.Response(body=body, content_type=content_type)
+        return await handler(request)
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.runner = web.AppRunner(self.make_app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = "http://%s:%d" % (host, port)
+        return self.url
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+
+    async def boursorama_search(self, request):
+        raise web.HTTPFound("/cours.phtml?symbole=1rP" + request.query["q"])
+
+    async def boursorama_page(self, request):
+        return web.Response(text="<html></html>", content_type="text/html")
+
+    async def boursorama_quotes(self, request):
+        isin = request.query["s[0]"][3:]
+        points = [{
+            "d": date.strftime("%d/%m/%Y") + " 00:00",
+            "o": o, "c": c, "h": h, "l": low, "v": v,
+        } for date, o, c, h, low, v in self.quotes(isin)]
+        # Like the real one, this is JSON served as HTML
+        return web.Response(
+            text=json.dumps({"dataSets": [{"dataProvider": points}]}),
+            content_type="text/html")
+
+    async def lesechos_history(self, request):
+        start = datetime.datetime.strptime(
+            request.query["beginDate"], "%Y%m%d").date()
+        stop = datetime.datetime.strptime(
+            request.query["endDate"], "%Y%m%d").date()
+        root = etree.Element("historyResponse")
+        history = etree.SubElement(root, "history")
+        for date, o, c, h, low, v in self.quotes(request.query["code"],
+                                                 start, stop):
+            etree.SubElement(history, "historyDt", {
+                "dt": date.strftime("%Y%m%d"),
+                "openPx": str(o),
+                "closePx": str(c),
+                "highPx": str(h),
+                "lowPx": str(low),
+                "qty": str(v),
+            })
+        return web.Response(body=etree.tostring(root),
+                            content_type="text/xml")
+
+    async def google_historical(self, request):
+        index = int(request.query["start"])
+        num = int(request.query["num"])
+        # Google returns the most recent quotes first
+        quotes = self.quotes(request.query["q"])[::-1][index:index + num]
+        lines = ["<table>"]
+        for date, o, c, h, low, v in quotes:
+            lines.extend((
+                '<td class="lm">%s' % date.strftime("%b %d, %Y"),
+                '<td class="rgt">%.2f' % o,
+                '<td class="rgt">%.2f' % h,
+                '<td class="rgt">%.2f' % low,
+                '<td class="rgt">%.2f' % c,
+                '<td class="rgt rm">{:,}'.format(v),
+            ))
+        lines.append("</table>")
+        return web.Response(text="\n".join(lines), content_type="text/html")
+
+    async def yahoo_chart(self, request):
+        start = datetime.datetime.utcfromtimestamp(
+            int(request.query["period1"])).date()
+        stop = datetime.datetime.utcfromtimestamp(
+            int(request.query["period2"])).date() - ONE_DAY
+        quotes = self.quotes(request.match_info["symbol"], start, stop)
+        if not quotes:
+            return web.json_response({"chart": {"result": None}})
+        return web.json_response({"chart": {"result": [{
+            "meta": {"gmtoffset": 0},
+            "timestamp": [calendar.timegm(q[0].timetuple())
+                          for q in quotes],
+            "indicators": {"quote": [{
+                "open": [q[1] for q in quotes],
+                "close": [q[2] for q in quotes],
+                "high": [q[3] for q in quotes],
+                "low": [q[4] for q in quotes],
+                "volume": [q[5] for q in quotes],
+            }]},
+        }]}})
+
+    async def yahoo_quote(self, request):
+        results = []
+        for symbol in request.query["symbols"].split(","):
+            quotes = self.quotes(symbol)
+            if not quotes:
+                continue
+            date, o, c, h, low, v = quotes[-1]
+            results.append({
+                "symbol": symbol,
+                "currency": self.currencies.get(symbol, "EUR"),
+                "regularMarketOpen": o,
+                "regularMarketPrice": c,
+                "regularMarketDayHigh": h,
+                "regularMarketDayLow": low,
+                "regularMarketVolume": v,
+                "regularMarketTime": calendar.timegm(date.timetuple()) +
+                17 * 3600,
+            })
+        return web.json_response({"quoteResponse": {"result": results}})
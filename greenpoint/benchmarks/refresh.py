@@ -0,0 +1,213 @@
+"""Measure the throughput of quote refreshes.
+
+Providers are replaced by the local stand-in server, so results only depend
+on this code and on the database. Benchmark instruments are stored in the
+database of `config.yaml` and removed afterwards; only they are refreshed,
+the other instruments of the database are left untouched.
+
+Usage::
+
+  python -m greenpoint.benchmarks.refresh --sizes 10,100,1000
+"""
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+import attr
+
+import numpy
+
+from greenpoint import instrument
+from greenpoint import parsing
+from greenpoint import planner
+from greenpoint import utils
+from greenpoint.benchmarks import providers
+
+
+# ISIN prefix of the benchmark instruments, not assigned to any country
+ISIN_PREFIX = "ZZ"
+PORTFOLIO = "benchmark"
+
+
+@attr.s
+class Result(object):
+    name = attr.ib()
+    instruments = attr.ib()
+    elapsed = attr.ib()
+    latencies = attr.ib()
+    rows = attr.ib()
+    errors = attr.ib(default=0)
+
+    @property
+    def instruments_per_second(self):
+        return self.instruments / self.elapsed
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed
+
+    def percentile(self, p):
+        if not self.latencies:
+            return float("nan")
+        return numpy.percentile(self.latencies, p)
+
+    def format(self):  # noqa
+        return ("%-20s %6d instruments %8.1f inst/s "
+                "p50 %7.1f ms p99 %7.1f ms %10.0f rows/s %5d errors" % (
+                    self.name, self.instruments,
+                    self.instruments_per_second,
+                    self.percentile(50) * 1000, self.percentile(99) * 1000,
+                    self.rows_per_second, self.errors))
+
+
+def make_instruments(count):
+    return [instrument.Instrument(
+        isin="%s%010d" % (ISIN_PREFIX, i),
+        type=instrument.InstrumentType.STOCK,
+        name="Benchmark %d" % i,
+        symbol="B%05d" % i,
+        currency="EUR",
+        exchange_mic="XPAR",
+        pea=None, pea_pme=None, ttf=None) for i in range(count)]
+
+
+async def setup(instruments):
+    """Store the instruments, held in a portfolio so they get updated."""
+    cur = await utils.get_db()
+    for inst in instruments:
+        await inst.save()
+    await cur.executemany(
+        "INSERT INTO operations (portfolio_name, instrument_isin, type, "
+        "date, quantity, price, fees, taxes, currency) "
+        "VALUES ($1, $2, 'trade', current_date, 1, 1, 0, 0, 'EUR')",
+        [(PORTFOLIO, inst.isin) for inst in instruments])
+
+
+async def clear_quotes():
+    cur = await utils.get_db()
+    await cur.execute("DELETE FROM quotes WHERE instrument_isin LIKE $1",
+                      ISIN_PREFIX + "%")
+    await cur.execute("DELETE FROM quote_ticks WHERE instrument_isin LIKE $1",
+                      ISIN_PREFIX + "%")
+    instrument.invalidate_quotes()
+
+
+async def cleanup():
+    cur = await utils.get_db()
+    await clear_quotes()
+    await cur.execute("DELETE FROM operations WHERE portfolio_name = $1",
+                      PORTFOLIO)
+    await cur.execute("DELETE FROM instruments WHERE isin LIKE $1",
+                      ISIN_PREFIX + "%")
+
+
+async def count_rows():
+    cur = await utils.get_db()
+    return await cur.fetchval(
+        "SELECT count(*) FROM quotes WHERE instrument_isin LIKE $1",
+        ISIN_PREFIX + "%")
+
+
+# Errors raised by providers answering with an injected error
+PROVIDER_ERRORS = (aiohttp.ClientError, KeyError, ValueError, SyntaxError)
+
+
+def timed(func, latencies, errors):
+    """Record the duration of each call, and count provider errors."""
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except PROVIDER_ERRORS:
+            errors.append(None)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    return wrapper
+
+
+async def bench_refresh_quotes(instruments):
+    await clear_quotes()
+    latencies = []
+    errors = []
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(inst.refresh_quotes, latencies, errors)()
+                           for inst in instruments))
+    elapsed = time.perf_counter() - started
+    return Result("refresh_quotes", len(instruments), elapsed, latencies,
+                  await count_rows(), len(errors))
+
+
+async def bench_execute_plan(instruments):
+    """Time the planned update of the benchmark instruments.
+
+    The whole database is planned as by `instrument update`, but only the
+    plans of the benchmark instruments are executed.
+    """
+    await clear_quotes()
+    isins = {inst.isin for inst in instruments}
+    latencies = []
+    errors = []
+    dead_after = planner.get_dead_after()
+    execute_plan = timed(planner.execute_plan, latencies, errors)
+    started = time.perf_counter()
+    plans = [plan for plan in await planner.make_plan()
+             if plan.instrument.isin in isins and not plan.skip]
+    await asyncio.gather(*(execute_plan(plan, dead_after) for plan in plans))
+    elapsed = time.perf_counter() - started
+    return Result("execute_plan", len(plans), elapsed, latencies,
+                  await count_rows(), len(errors))
+
+
+async def run(sizes, **server_options):
+    results = []
+    async with providers.ProviderServer(**server_options) as server:
+        urls = {name: getattr(instrument.Instrument, name)
+                for name in server.urls()}
+        for name, url in server.urls().items():
+            setattr(instrument.Instrument, name, url)
+        try:
+            for size in sizes:
+                instruments = make_instruments(size)
+                await cleanup()
+                await setup(instruments)
+                try:
+                    for bench in (bench_refresh_quotes,
+                                  bench_execute_plan):
+                        result = await bench(instruments)
+                        print(result.format())
+                        results.append(result)
+                finally:
+                    await cleanup()
+        finally:
+            for name, url in urls.items():
+                setattr(instrument.Instrument, name, url)
+            await utils.close_db()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default="10,100,1000",
+                        help="Numbers of instruments to refresh")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Seconds taken by providers to answer")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="Fraction of provider requests failing")
+    parser.add_argument("--history-days", type=int, default=365,
+                        help="Number of days of quote history")
+    parser.add_argument("--parse-threads", type=int, default=None,
+                        help="Number of parsing threads")
+    parser.add_argument("--parse-processes", type=int, default=None,
+                        help="Number of parsing processes")
+    args = parser.parse_args()
+    parsing.configure(args.parse_threads, args.parse_processes)
+    asyncio.run(run([int(size) for size in args.sizes.split(",")],
+                    latency=args.latency,
+                    error_rate=args.error_rate,
+                    history_days=args.history_days))
+
+
+if __name__ == "__main__":
+    main()
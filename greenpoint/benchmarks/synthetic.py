@@ -0,0 +1,196 @@
+r"""Fill the database with synthetic portfolios.
+
+Quotes follow a random walk on week days, and trades are spread over the
+portfolios and instruments at the requested daily rate, never selling more
+than what is held. Rows are loaded with COPY, so tens of millions of rows
+can be generated.
+
+Usage::
+
+  python -m greenpoint.benchmarks.synthetic --portfolios 10 \
+      --instruments 1000 --years 10 --trades-per-day 20
+"""
+import argparse
+import asyncio
+import datetime
+import time
+
+import numpy
+
+from greenpoint import utils
+
+
+# ISIN prefix of the synthetic instruments, not assigned to any country
+ISIN_PREFIX = "ZY"
+PORTFOLIO_PREFIX = "synthetic"
+
+# Probability that a trade sells, and that a sale closes the position
+SELL_PROBABILITY = 0.4
+CLOSE_PROBABILITY = 0.2
+
+
+def isin(index):
+    return "%s%010d" % (ISIN_PREFIX, index)
+
+
+def portfolio_name(index):
+    return "%s %d" % (PORTFOLIO_PREFIX, index)
+
+
+def week_days(years, end=None):
+    if end is None:
+        end = datetime.date.today()
+    days = numpy.arange(
+        numpy.datetime64(end - datetime.timedelta(days=int(365.25 * years))),
+        numpy.datetime64(end) + 1)
+    return days[numpy.is_busday(days)]
+
+
+def _rng(seed, *keys):
+    return numpy.random.default_rng((seed,) + keys)
+
+
+def random_walk(seed, instrument, size):
+    """Return the daily open, close, high, low and volume of an instrument.
+
+    The walk only depends on the seed and the instrument, so it can be
+    generated again instead of being kept in memory.
+    """
+    rng = _rng(seed, instrument)
+    close = rng.uniform(5, 500) * numpy.cumprod(
+        1 + rng.normal(0.0002, 0.02, size))
+    open_ = numpy.concatenate(([close[0]], close[:-1]))
+    high = numpy.maximum(open_, close) * (1 + rng.uniform(0, 0.01, size))
+    low = numpy.minimum(open_, close) * (1 - rng.uniform(0, 0.01, size))
+    volume = rng.integers(100, 1000000, size)
+    return (numpy.round(open_, 4), numpy.round(close, 4),
+            numpy.round(high, 4), numpy.round(low, 4), volume)
+
+
+def generate_quotes(seed, instruments, days):
+    dates = days.astype(object)
+    for i in range(instruments):
+        open_, close, high, low, volume = random_walk(seed, i, len(days))
+        yield from zip([isin(i)] * len(days), dates,
+                       open_.tolist(), close.tolist(), high.tolist(),
+                       low.tolist(), volume.tolist())
+
+
+def generate_operations(seed, portfolios, instruments, days, trades_per_day):
+    dates = days.astype(object)
+    # Trades of a portfolio are spread evenly over the instruments
+    rate = trades_per_day / instruments
+    for i in range(instruments):
+        close = random_walk(seed, i, len(days))[1]
+        for p in range(portfolios):
+            rng = _rng(seed, i, p)
+            trade_days = numpy.repeat(numpy.arange(len(days)),
+                                      rng.poisson(rate, len(days)))
+            position = 0
+            for day, sell, close_position, size in zip(
+                    trade_days.tolist(),
+                    (rng.random(len(trade_days)) <
+                     SELL_PROBABILITY).tolist(),
+                    (rng.random(len(trade_days)) <
+                     CLOSE_PROBABILITY).tolist(),
+                    rng.integers(1, 100, len(trade_days)).tolist()):
+                if sell and position:
+                    quantity = -(position if close_position
+                                 else min(size, position))
+                else:
+                    quantity = size
+                position += quantity
+                price = round(float(close[day]), 4)
+                yield (portfolio_name(p), isin(i), "trade", dates[day],
+                       float(quantity), price,
+                       round(abs(quantity) * price * 0.001, 2),
+                       0.0, "EUR")
+
+
+async def clear():
+    """Delete all synthetic rows."""
+    pool = await utils.get_db()
+    async with pool.acquire() as con:
+        async with con.transaction():
+            await con.execute(
+                "DELETE FROM operations WHERE portfolio_name LIKE $1",
+                PORTFOLIO_PREFIX + " %")
+            await con.execute(
+                "DELETE FROM quotes WHERE instrument_isin LIKE $1",
+                ISIN_PREFIX + "%")
+            await con.execute(
+                "DELETE FROM instruments WHERE isin LIKE $1",
+                ISIN_PREFIX + "%")
+
+
+async def generate(portfolios, instruments, years, trades_per_day, seed=0):
+    """Replace the synthetic rows with new ones.
+
+    :return: The number of quotes and operations inserted.
+    """
+    days = week_days(years)
+    await clear()
+    pool = await utils.get_db()
+    async with pool.acquire() as con:
+        await con.executemany(
+            "INSERT INTO instruments "
+            "(isin, name, type, symbol, currency, exchange_mic, "
+            "latest_quote) "
+            "VALUES ($1, $2, 'stock', $3, 'EUR', 'XPAR', $4)",
+            [(isin(i), "Synthetic %d" % i, "S%05d" % i,
+              float(random_walk(seed, i, len(days))[1][-1]))
+             for i in range(instruments)])
+        await con.copy_records_to_table(
+            "quotes",
+            records=generate_quotes(seed, instruments, days),
+            columns=("instrument_isin", "date", "open", "close", "high",
+                     "low", "volume"))
+        await con.copy_records_to_table(
+            "operations",
+            records=generate_operations(seed, portfolios, instruments, days,
+                                        trades_per_day),
+            columns=("portfolio_name", "instrument_isin", "type", "date",
+                     "quantity", "price", "fees", "taxes", "currency"))
+        await con.execute("ANALYZE instruments, quotes, operations")
+        return (
+            await con.fetchval(
+                "SELECT count(*) FROM quotes WHERE instrument_isin LIKE $1",
+                ISIN_PREFIX + "%"),
+            await con.fetchval(
+                "SELECT count(*) FROM operations "
+                "WHERE portfolio_name LIKE $1",
+                PORTFOLIO_PREFIX + " %"),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--portfolios", type=int, default=5)
+    parser.add_argument("--instruments", type=int, default=100)
+    parser.add_argument("--years", type=float, default=5)
+    parser.add_argument("--trades-per-day", type=float, default=2,
+                        help="Trades per day in each portfolio")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--clear", action="store_true",
+                        help="Only delete the synthetic rows")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            if args.clear:
+                await clear()
+                return
+            started = time.perf_counter()
+            quotes, operations = await generate(
+                args.portfolios, args.instruments, args.years,
+                args.trades_per_day, args.seed)
+            print("Inserted %d quotes and %d operations in %.1fs" % (
+                quotes, operations, time.perf_counter() - started))
+        finally:
+            await utils.close_db()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
+import asyncio
 import datetime
+import functools
 import os.path
 
 import cachetools
@@ -12,7 +14,10 @@ import requests
 import yaml
 
 from greenpoint import instrument
+from greenpoint import metrics
+from greenpoint import parsing
 from greenpoint import portfolio
+from greenpoint import tracing
 from greenpoint import utils
 
 
@@ -22,6 +27,24 @@ LOG = daiquiri.getLogger(__name__)
 ONE_YEAR = datetime.timedelta(days=365)
 
 
+def _parse_cash(content):
+    tree = html.fromstring(content)
+    return tree.xpath(
+        "//*[@id=\"valorisation_compte\"]/table/tr[3]/td[2]/text()")[0]
+
+
+def _parse_history(content):
+    tree = html.fromstring(content)
+    return tree.xpath(
+        '//table[@id="tabHistoriqueOperations"]/tbody/tr/td/text()')
+
+
+async def _run(func, *args, **kwargs):
+    """Run a blocking `requests` call without blocking the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(func, *args, **kwargs))
+
+
 class Fortuneo(object):
 
     ACCESS_PAGE = "https://mabanque.fortuneo.fr/checkacces"
@@ -34,15 +57,24 @@ class Fortuneo(object):
                  "/situation/portefeuille-temps-reel.jsp?ca=%s")
     INSTRUMENT_SEARCH_PAGE = "https://www.fortuneo.fr/recherche?term=%s"
 
-    with open(os.path.join(os.path.dirname(__file__),
-                           "data", "fortuneo.yaml"), "r") as f:
-        PRELOAD = yaml.load(f.read())
+    # Prices of foreign currency operations are computed from the net amount
+    # debited or credited on the account, so they are in this currency.
+    SETTLEMENT_CURRENCY = "EUR"
+
+    PRELOAD_FILE = os.path.join(os.path.dirname(__file__),
+                                "data", "fortuneo.yaml")
+    _PRELOAD = None
 
     CACHE = cachetools.TTLCache(maxsize=4096, ttl=3600 * 24)
 
     def __init__(self, name, conf):
         self.name = name
         self.session = requests.Session()
+        self.session.hooks['response'].append(
+            metrics.requests_hook("fortuneo"))
+        if tracing.enabled():
+            self.session.hooks['response'].append(
+                tracing.requests_hook("fortuneo"))
         login = self.session.post(self.ACCESS_PAGE,
                                   data={"login": conf['login'],
                                         "passwd": conf['password']})
@@ -97,17 +129,26 @@ class Fortuneo(object):
         "euronext amsterdam": "XAMS",
     }
 
+    @classmethod
+    def get_preload(cls):
+        if cls._PRELOAD is None:
+            with open(cls.PRELOAD_FILE, "r") as f:
+                cls._PRELOAD = yaml.safe_load(f.read())
+        return cls._PRELOAD
+
     @classmethod
     async def _get_instrument_info(cls, session, name):
         # Use a decorator
         # https://github.com/tkem/cachetools/issues/92
 
-        if name in cls.CACHE:
+        cached = name in cls.CACHE
+        metrics.cache_lookup("fortuneo", cached)
+        if cached:
             return cls.CACHE[name]
 
         LOG.debug("Fetching instrument %s", name)
 
-        info = cls.PRELOAD.get('instruments', {}).get(name)
+        info = cls.get_preload().get('instruments', {}).get(name)
         if info:
             LOG.debug("Instrument %s pre-configured", name)
             # If it's not a string, return the override
@@ -120,8 +161,10 @@ class Fortuneo(object):
         else:
             url = cls.INSTRUMENT_SEARCH_PAGE % name
 
-        page = session.get(url)
-        tree = html.fromstring(page.content)
+        page = await _run(session.get, url)
+        with tracing.span("parse", "parse", provider="fortuneo",
+                          instrument=name):
+            tree = await parsing.run(html.fromstring, page.content)
 
         instrument_kwargs = {"name": name}
 
@@ -220,28 +263,39 @@ class Fortuneo(object):
             end = start - datetime.timedelta(days=1)
             start = end - step
 
-    async def list_transactions(self):
+    async def iter_transactions(self):
+        """Fetch the transactions of the account, one year at a time.
+
+        Pages are fetched in the default executor, so that the transactions
+        of a year can be saved while the next one is being fetched.
+
+        :return: An async generator of `(start, stop, operations)`, from the
+                 most recent year to the oldest, as expected by
+                 `Operation.save_windows`.
+        """
         LOG.debug("Getting cash info")
-        page = self.session.get(self.cash_page)
-        tree = html.fromstring(page.content)
-        cash = self._to_float(tree.xpath(
-            "//*[@id=\"valorisation_compte\"]/table/tr[3]/td[2]/text()"
-        )[0])
+        page = await _run(self.session.get, self.cash_page)
+        with tracing.span("parse", "parse", provider="fortuneo"):
+            cash = self._to_float(
+                await parsing.run(_parse_cash, page.content))
 
         today = datetime.datetime.utcnow().date()
         txs = [portfolio.Operation(
-            instrument_isin="EUR",
+            instrument_isin=self.SETTLEMENT_CURRENCY,
             type=portfolio.OperationType.TRADE,
             date=today,
             quantity=cash,
             price=1.0,
             fees=0.0,
             taxes=0.0,
-            currency="EUR",
+            currency=self.SETTLEMENT_CURRENCY,
         )]
+        # The first window includes the cash, dated today
+        stop = None
 
         for start, end in self._iter_on_time():
-            page = self.session.post(
+            page = await _run(
+                self.session.post,
                 self.history_page,
                 data={
                     "offset": 0,
@@ -251,11 +305,13 @@ class Fortuneo(object):
                 },
                 cookies=self.cookies)
 
-            tree = html.fromstring(page.content)
-            history = tree.xpath(
-                '//table[@id="tabHistoriqueOperations"]/tbody/tr/td/text()')
+            with tracing.span("parse", "parse", provider="fortuneo",
+                              start=start.date(), end=end.date()):
+                history = await parsing.run(_parse_history, page.content)
 
             if len(history) == 0:
+                if txs:
+                    yield start.date(), stop, txs
                 break
 
             for inst, op, xchange, date, qty, ppu, raw, fees, net, currency in map(  # noqa
@@ -277,7 +333,7 @@ class Fortuneo(object):
                 final_fees = 0.0
 
                 if op == portfolio.OperationType.DIVIDEND:
-                    if currency == "EUR":
+                    if currency == self.SETTLEMENT_CURRENCY:
                         # Fees are taxes actually
                         taxes = self._to_float(fees)
                         ppu = abs(self._to_float(raw)) / qty
@@ -290,7 +346,7 @@ class Fortuneo(object):
                     taxes = self._to_float(fees)
                     ppu = 0.0
                 else:
-                    if currency != "EUR":
+                    if currency != self.SETTLEMENT_CURRENCY:
                         # Fees is change + fees… ignore
                         ppu = abs(self._to_float(net)) / qty
                     else:
@@ -306,17 +362,21 @@ class Fortuneo(object):
                 txs.append(portfolio.Operation(
                     instrument_isin=inst.isin,
                     type=op,
-                    date=datetime.datetime.strptime(
-                        date, "%d/%m/%Y").date(),
+                    date=utils.strpdate(date, "%d/%m/%Y"),
                     quantity=qty,
                     price=ppu,
                     fees=final_fees,
                     taxes=taxes,
-                    # Currency is always EUR anyway
-                    currency="EUR",
+                    currency=self.SETTLEMENT_CURRENCY,
                 ))
 
-        return txs
+            yield start.date(), stop, txs
+            txs = []
+            stop = start.date() - datetime.timedelta(days=1)
+
+    async def list_transactions(self):
+        return [op async for _, _, ops in self.iter_transactions()
+                for op in ops]
 
 
 REGISTRY = {
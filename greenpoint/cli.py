@@ -1,37 +1,77 @@
-import asyncio
 import logging
 
-import attr
-
 import click
 
-import colorama
-
 import daiquiri
 
-import tabulate
-
-import termcolor
-
-from greenpoint import broker
-from greenpoint import instrument
-from greenpoint import portfolio as gportfolio
-from greenpoint import utils
-from greenpoint import web as gweb
+# Commands import what they need themselves: the CLI is run often from
+# scripts and most commands need only a few of the dependencies.
 
 LOG = daiquiri.getLogger(__name__)
 
 
 @click.group()
 @click.option('--debug', is_flag=True)
-def main(debug=False):
+@click.option('--metrics-file', type=click.Path(dir_okay=False),
+              help="Write metrics to that file when the command ends")
+@click.option('--trace', type=click.Path(dir_okay=False),
+              help="Write a Chrome trace of the command to that file")
+@click.option('--profile', type=click.Path(dir_okay=False),
+              help="Write cProfile statistics of the command to that file")
+@click.pass_context
+def main(ctx, debug=False, metrics_file=None, trace=None, profile=None):
+    import colorama
+
     colorama.init()
     daiquiri.setup(level=logging.DEBUG if debug else logging.WARNING)
 
+    if metrics_file is not None:
+        from greenpoint import metrics
+
+        ctx.call_on_close(lambda: metrics.REGISTRY.write(metrics_file))
+
+    if trace is not None:
+        from greenpoint import tracing
+
+        tracer = tracing.start()
+        ctx.call_on_close(lambda: tracer.write(trace))
 
-@main.command(name="web")
-def web():
-    return gweb.app.run(debug=True)
+    if profile is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+        def dump_profile():
+            profiler.disable()
+            profiler.dump_stats(profile)
+
+        ctx.call_on_close(dump_profile)
+        profiler.enable()
+
+
+@main.command(name="web", help="Run the Web server")
+@click.option('--host', default=None,
+              help="Address to listen on, all interfaces by default")
+@click.option('--port', default=5000, show_default=True)
+@click.option('--workers', default=1, show_default=True,
+              help="Number of server processes")
+@click.option('--pool-size', type=int, default=None,
+              help="Maximum number of database connections per worker")
+def web(host, port, workers, pool_size):
+    import multiprocessing
+
+    from greenpoint import web as gweb
+
+    if workers <= 1:
+        return gweb.serve(host, port, pool_size)
+    # Each worker is one event loop with one pool, all sharing the port
+    workers = [multiprocessing.Process(target=gweb.serve,
+                                       args=(host, port, pool_size, True))
+               for _ in range(workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
 
 
 @main.group(name="broker")
@@ -42,6 +82,8 @@ def broker_():
 @broker_.command(name="list",
                  help="List configured brokers")
 def broker_list():
+    from greenpoint import utils
+
     conf = utils.get_config()
     for b in conf['brokers'].keys():
         click.echo(b)
@@ -52,6 +94,12 @@ def broker_list():
                  "Import all brokers by default.")
 @click.argument('broker_name', required=False, default=None)
 def broker_import(broker_name=None):
+    import asyncio
+
+    from greenpoint import broker
+    from greenpoint import portfolio as gportfolio
+    from greenpoint import utils
+
     conf = utils.get_config()
     if broker_name is not None:
         brokers = [broker_name]
@@ -74,14 +122,15 @@ def broker_import(broker_name=None):
             b = broker_type(broker_name, broker_config)
 
             async def _import_operations():
-                await gportfolio.Operation.drop_save_all(
-                    broker_name,
-                    await b.list_transactions())
+                await gportfolio.Operation.save_windows(
+                    broker_name, b.iter_transactions())
 
             loop.run_until_complete(_import_operations())
 
 
 def color_value(v, suffix=""):
+    import termcolor
+
     if v is None:
         return
     if v < 0:
@@ -98,19 +147,30 @@ def portfolio_group():
 
 @portfolio_group.command(name="show")
 @click.argument('broker_name', required=False, default=None)
-def portfolio_show(broker_name=None):
-    loop = asyncio.get_event_loop()
-    if broker_name:
-        f = gportfolio.get_status_for_broker(broker_name)
-    else:
-        f = gportfolio.get_status_for_all()
+@click.option('--type', 'instrument_type', default=None,
+              type=click.Choice(["etf", "stock", "fund"]),
+              help="Only show instruments of this type.")
+@click.option('--currency', default=None,
+              help="Only show instruments quoted in this currency.")
+@click.option('--pea/--no-pea', default=None,
+              help="Only show instruments (not) eligible to the PEA.")
+def portfolio_show(broker_name=None, instrument_type=None, currency=None,
+                   pea=None):
+    import asyncio
+
+    import tabulate
 
-    status = loop.run_until_complete(f)
+    from greenpoint import portfolio as gportfolio
+
+    loop = asyncio.get_event_loop()
+    status = loop.run_until_complete(gportfolio.get_status(
+        portfolio_name=broker_name, instrument_type=instrument_type,
+        currency=currency, pea=pea))
 
     headers = {
         "instrument_isin": "ISIN",
         "name": "Name",
-        "date": "Latest trade",
+        "latest_trade": "Latest trade",
         "position": "Position",
         "ppu": "PPU",
         "latest_quote": "Quote",
@@ -148,6 +208,69 @@ def portfolio_show(broker_name=None):
         ))
 
 
+@portfolio_group.command(
+    name="income",
+    help="Show dividends, fees and taxes by year, of all brokers by default")
+@click.argument('broker_name', required=False, default=None)
+@click.option('--year', type=int, default=None,
+              help="Only show that year")
+@click.option('--monthly', is_flag=True, help="Show them by month")
+def portfolio_income(broker_name=None, year=None, monthly=False):
+    import asyncio
+
+    import tabulate
+
+    from greenpoint import portfolio as gportfolio
+
+    loop = asyncio.get_event_loop()
+    income = loop.run_until_complete(
+        gportfolio.get_income(broker_name, year, monthly))
+    period = ("year", "month") if monthly else ("year",)
+    click.echo(tabulate.tabulate(
+        [[row['portfolio_name']] + [row[k] for k in period] +
+         [row['instrument_isin'], row['name'][:30], row['currency'],
+          row['dividends'], row['fees'], row['taxes']]
+         for row in income],
+        headers=(("Portfolio",) + tuple(k.capitalize() for k in period) +
+                 ("ISIN", "Name", "Currency", "Dividends", "Fees", "Taxes")),
+        tablefmt='fancy_grid', floatfmt=".2f",
+    ))
+
+
+@portfolio_group.command(
+    name="risk",
+    help="Show the volatility of the portfolios and the risk contribution "
+    "of each holding")
+@click.option('--window', default=250, show_default=True,
+              help="Number of daily returns to use")
+@click.option('--correlation', is_flag=True,
+              help="Also show the correlation matrix")
+def portfolio_risk(window, correlation):
+    import asyncio
+
+    import tabulate
+
+    from greenpoint import risk
+
+    loop = asyncio.get_event_loop()
+    result = loop.run_until_complete(risk.get_risk(window))
+    click.echo(tabulate.tabulate(
+        [(isin, name[:30], 100 * weight, 100 * volatility,
+          100 * contribution)
+         for isin, name, weight, volatility, contribution in zip(
+             result.isins, result.names, result.weights,
+             result.volatilities, result.contributions)],
+        headers=("ISIN", "Name", "Weight %", "Volatility %", "Risk %"),
+        tablefmt='fancy_grid', floatfmt=".2f",
+    ))
+    click.echo("Volatility: %.2f%% from %s to %s" % (
+        100 * result.volatility, result.start, result.stop))
+    if correlation:
+        click.echo(tabulate.tabulate(
+            result.correlation, headers=result.isins,
+            showindex=result.isins, floatfmt=".2f"))
+
+
 @main.group(name="instrument")
 def instrument_group():
     pass
@@ -155,6 +278,14 @@ def instrument_group():
 
 @instrument_group.command(name="list")
 def instrument_list():
+    import asyncio
+
+    import attr
+
+    import tabulate
+
+    from greenpoint import instrument
+
     loop = asyncio.get_event_loop()
     instruments = []
 
@@ -162,6 +293,7 @@ def instrument_list():
             instrument.Instrument.list_instruments()):
         headers = list(map(str.capitalize, attr.asdict(inst).keys()))
         headers.remove("Is_alive")
+        headers.remove("Empty_refreshes")
         values = []
         for k, v in attr.asdict(inst).items():
             if k == "exchange":
@@ -180,7 +312,7 @@ def instrument_list():
                     values.append("X")
                 else:
                     values.append("")
-            elif k == "is_alive":
+            elif k in ("is_alive", "empty_refreshes", "empty_session"):
                 continue
             else:
                 values.append(v)
@@ -193,38 +325,251 @@ def instrument_list():
     ))
 
 
-async def _update_instrument(name):
-    if name is None:
-        instruments = await instrument.Instrument.list_instruments()
-        click.echo("Updating %d instruments" % len(instruments))
-    else:
-        try:
-            instruments = [await instrument.Instrument.load(name=name)]
-        except TypeError:
-            raise click.ClickException("Unknown instrument %s" % name)
-        click.echo("Updating %s" % instruments[0])
+def _print_plan(plans):
+    import datetime
+
+    import tabulate
+
+    today = datetime.date.today()
+    lines = []
+    for plan in plans:
+        lines.append((
+            str(plan.instrument)[:40],
+            plan.reason,
+            "X" if plan.history else "",
+            plan.start or "",
+            "X" if plan.live else "",
+            ", ".join(plan.providers),
+            plan.estimate_requests(today),
+        ))
+    click.echo(tabulate.tabulate(
+        lines,
+        headers=("Instrument", "Reason", "History", "Since", "Live",
+                 "Providers", "Requests"),
+        tablefmt='fancy_grid',
+    ))
+    click.echo("%d instruments to update out of %d, ~%d requests" % (
+        sum(1 for plan in plans if not plan.skip), len(plans),
+        sum(plan.estimate_requests(today) for plan in plans)))
+
+
+async def _update_instrument(name, dry_run=False):
+    import asyncio
+
+    from greenpoint import fx
+    from greenpoint import planner
+
+    if name is None and not dry_run:
+        await fx.ensure_pairs(fx.get_reporting_currency())
 
+    plans = await planner.make_plan(name)
+    if name is not None and not plans:
+        raise click.ClickException("Unknown instrument %s" % name)
+
+    if dry_run:
+        _print_plan(plans)
+        return
+
+    plans = [plan for plan in plans if not plan.skip]
+    click.echo("Updating %d instruments" % len(plans))
+    dead_after = planner.get_dead_after()
     futures = []
-    with click.progressbar(instruments,
-                           label='Scheduling quote updates') as insts:
-        for inst in insts:
-            futures.append(asyncio.ensure_future(inst.refresh_quotes()))
-            futures.append(asyncio.ensure_future(inst.refresh_live_quote()))
+    with click.progressbar(plans,
+                           label='Scheduling quote updates') as plans:
+        for plan in plans:
+            futures.append(asyncio.ensure_future(
+                planner.execute_plan(plan, dead_after)))
     with click.progressbar(futures,
                            label='Waiting for quote updates') as futs:
         for fut in futs:
             await fut
 
+    await fx.refresh_rates()
+
 
 @instrument_group.command(name="update")
 @click.argument('name', required=False)
-def instrument_update(name=None):
+@click.option('--dry-run', is_flag=True,
+              help="Print what would be fetched and exit")
+def instrument_update(name=None, dry_run=False):
+    import asyncio
+
     loop = asyncio.get_event_loop()
 
-    loop.run_until_complete(_update_instrument(name))
+    loop.run_until_complete(_update_instrument(name, dry_run))
     loop.close()
 
 
+async def _backfill_instrument(name, since, dry_run):
+    import tabulate
+
+    from greenpoint import backfill
+    from greenpoint import instrument
+
+    if name is None:
+        isins = None
+    else:
+        try:
+            isins = [(await instrument.Instrument.load(name=name)).isin]
+        except TypeError:
+            raise click.ClickException("Unknown instrument %s" % name)
+
+    gaps = backfill.merge_gaps(await backfill.find_gaps(isins, since))
+    if dry_run:
+        click.echo(tabulate.tabulate(
+            [(gap.isin, gap.start, gap.stop, gap.days) for gap in gaps],
+            headers=("ISIN", "Start", "Stop", "Missing days"),
+            tablefmt='fancy_grid',
+        ))
+        return
+
+    click.echo("Backfilling %d missing days in %d requests" % (
+        sum(gap.days for gap in gaps), len(gaps)))
+    found = await backfill.backfill(gaps)
+    click.echo("Found %d quotes" % found)
+
+
+@instrument_group.command(name="backfill",
+                          help="Fetch quotes missing from the history")
+@click.argument('name', required=False)
+@click.option('--since', type=click.DateTime(formats=["%Y-%m-%d"]),
+              default=None, help="Only check quotes since that date")
+@click.option('--dry-run', is_flag=True,
+              help="Print the missing quotes and exit")
+def instrument_backfill(name=None, since=None, dry_run=False):
+    import asyncio
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(_backfill_instrument(
+        name, since.date() if since else None, dry_run))
+
+
+@instrument_group.command(
+    name="watch",
+    help="Keep refreshing live quotes while markets are open")
+@click.option('--min-interval', default=60, show_default=True,
+              help="Seconds between refreshes of a quote that changes")
+@click.option('--max-interval', default=900, show_default=True,
+              help="Maximum seconds between refreshes of a quote")
+@click.option('--concurrency', default=10, show_default=True,
+              help="Maximum number of concurrent requests")
+def instrument_watch(min_interval, max_interval, concurrency):
+    import asyncio
+
+    from greenpoint import watch
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(
+        watch.watch(min_interval, max_interval, concurrency))
+
+
+@instrument_group.command(
+    name="compact",
+    help="Roll intraday ticks of past days into daily quotes")
+@click.option('--retention-days', type=int, default=None,
+              help="Days of ticks to keep, from the configuration by default")
+def instrument_compact(retention_days):
+    import asyncio
+
+    from greenpoint import ticks
+
+    loop = asyncio.get_event_loop()
+    added, deleted = loop.run_until_complete(
+        ticks.compact(retention_days=retention_days))
+    click.echo("%d daily quotes added, %d ticks deleted" % (added, deleted))
+
+
+@main.group(name="alert")
+def alert_group():
+    pass
+
+
+@alert_group.command(
+    name="add",
+    help="Alert when the price, the move in % since now or the weight in "
+    "the portfolios of an instrument goes above or below a value. "
+    "Alerts are fired by `greenpoint instrument watch`.")
+@click.argument('name')
+@click.argument('kind', type=click.Choice(("price", "move", "weight")))
+@click.argument('direction', type=click.Choice(("above", "below")))
+@click.argument('value', type=float)
+def alert_add(name, kind, direction, value):
+    import asyncio
+
+    from greenpoint import alerts
+    from greenpoint import instrument
+
+    async def _add():
+        try:
+            inst = await instrument.Instrument.load(name=name)
+        except TypeError:
+            raise click.ClickException("Unknown instrument %s" % name)
+        try:
+            return await alerts.add_rule(inst.isin, kind, direction, value)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    loop = asyncio.get_event_loop()
+    click.echo("Alert %d added" % loop.run_until_complete(_add()))
+
+
+@alert_group.command(name="list")
+def alert_list():
+    import asyncio
+
+    import tabulate
+
+    from greenpoint import alerts
+
+    loop = asyncio.get_event_loop()
+    rules = loop.run_until_complete(alerts.list_rules())
+    click.echo(tabulate.tabulate(
+        [(rule['id'], rule['instrument_isin'], rule['name'][:30],
+          rule['kind'], rule['direction'], rule['value'],
+          rule['reference'], rule['fired_at']) for rule in rules],
+        headers=("Id", "ISIN", "Name", "Kind", "Direction", "Value",
+                 "Reference", "Fired"),
+        tablefmt='fancy_grid',
+    ))
+
+
+@alert_group.command(name="remove")
+@click.argument('rule_id', type=int)
+def alert_remove(rule_id):
+    import asyncio
+
+    from greenpoint import alerts
+
+    loop = asyncio.get_event_loop()
+    if not loop.run_until_complete(alerts.remove_rule(rule_id)):
+        raise click.ClickException("Unknown alert %d" % rule_id)
+
+
+@main.command(name="export",
+              help="Export quotes and operations to columnar files")
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--format', 'format_', type=click.Choice(("arrow", "parquet")),
+              default="arrow", show_default=True,
+              help="Arrow files can be memory-mapped by the loaders")
+@click.option('--table', 'tables', multiple=True,
+              type=click.Choice(("quotes", "operations")),
+              help="Table to export, all by default")
+def export(directory, format_, tables):
+    import asyncio
+
+    from greenpoint import export as gexport
+
+    if gexport.pyarrow is None:
+        raise click.ClickException(
+            "pyarrow is required, install greenpoint[export]")
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(
+        gexport.export(directory, format_, tables or None))
+    for table, (written, removed) in results.items():
+        click.echo("%s: %d partitions written, %d removed" % (
+            table, written, removed))
+
+
 if __name__ == '__main__':
     import sys
     sys.exit(main())
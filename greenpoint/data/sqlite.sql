@@ -0,0 +1,190 @@
+-- SQLite version of sql/tables.sql, applied when the pool is created.
+--
+-- Numbers are REAL rather than NUMERIC, which SQLite would store as integers
+-- when they have no fractional part. Materialized views and functions do
+-- not exist: `fx_rates` is a plain view, and `pg_notify` is provided by
+-- greenpoint.sqlite to the connections of the pool.
+
+CREATE TABLE IF NOT EXISTS instruments (
+       isin text CHECK (upper(isin) = isin) PRIMARY KEY,
+       name text NOT NULL,
+       type text CHECK (type IN ('stock', 'etf', 'fund', 'currency')) NOT NULL,
+       symbol text,
+       pea boolean,
+       pea_pme boolean,
+       ttf boolean,
+       exchange_mic text,
+       currency text CHECK (upper(currency) = currency) NOT NULL,
+       is_alive boolean DEFAULT true NOT NULL,
+       empty_refreshes integer DEFAULT 0 NOT NULL,
+       empty_session date,
+       latest_quote real,
+       latest_quote_time timestamp
+);
+
+INSERT OR IGNORE INTO instruments(isin, name, type, currency, latest_quote)
+       VALUES ('EUR', 'Euro', 'currency', 'EUR', 1.0);
+
+CREATE TABLE IF NOT EXISTS quotes (
+       instrument_isin text REFERENCES instruments(isin) NOT NULL,
+       date date NOT NULL,
+       open real,
+       close real,
+       high real,
+       low real,
+       volume integer,
+       UNIQUE (instrument_isin, date)
+);
+
+-- Intraday quotes from live refreshes, compacted into `quotes` once the
+-- day is over
+CREATE TABLE IF NOT EXISTS quote_ticks (
+       instrument_isin text REFERENCES instruments(isin) NOT NULL,
+       time timestamp NOT NULL,
+       date date NOT NULL,
+       price real NOT NULL,
+       open real,
+       high real,
+       low real,
+       volume bigint,
+       UNIQUE (instrument_isin, time)
+);
+
+CREATE INDEX IF NOT EXISTS quote_ticks_date_idx ON quote_ticks (date);
+
+CREATE TABLE IF NOT EXISTS operations (
+       portfolio_name text NOT NULL,
+       instrument_isin text REFERENCES instruments(isin) NOT NULL,
+       type text CHECK (type IN ('trade', 'dividend', 'tax')) NOT NULL,
+       date date NOT NULL,
+       quantity real NOT NULL,
+       price real NOT NULL,
+       fees real NOT NULL,
+       taxes real NOT NULL,
+       currency text NOT NULL
+);
+
+-- Dividends, fees and taxes by month of the operations, kept up to date when
+-- operations are saved
+CREATE TABLE IF NOT EXISTS operations_rollup (
+       portfolio_name text NOT NULL,
+       instrument_isin text REFERENCES instruments(isin) NOT NULL,
+       year integer NOT NULL,
+       month integer NOT NULL,
+       currency text NOT NULL,
+       dividends real NOT NULL,
+       fees real NOT NULL,
+       taxes real NOT NULL,
+       operations integer NOT NULL,
+       UNIQUE (portfolio_name, year, month, instrument_isin, currency)
+);
+
+-- Alert rules, fired once by `greenpoint instrument watch`
+CREATE TABLE IF NOT EXISTS alerts (
+       id integer PRIMARY KEY,
+       instrument_isin text REFERENCES instruments(isin) NOT NULL,
+       kind text CHECK (kind IN ('price', 'move', 'weight')) NOT NULL,
+       direction text CHECK (direction IN ('above', 'below')) NOT NULL,
+       value real NOT NULL,
+       reference real,
+       created_at timestamp NOT NULL,
+       fired_at timestamp
+);
+
+CREATE INDEX IF NOT EXISTS operations_portfolio_name_idx
+       ON operations (portfolio_name, instrument_isin);
+
+CREATE VIEW IF NOT EXISTS portfolios_history AS
+select portfolio_name,
+       instrument_isin,
+       date,
+       position,
+       case when total_bought = 0 then null else round(total_spent / total_bought, 2) end as ppu,
+       currency,
+       ownership_partition
+from (
+    select *,
+           sum(max(0, quantity)) over w as total_bought,
+           sum(max(0, (quantity * price) - fees - taxes)) over w as total_spent
+    from (
+        select *,
+               sum(case when position = 0 then 1 else 0 end) over w as ownership_partition
+        from (
+                select instrument_isin, date, quantity, price, currency, fees, taxes, portfolio_name,
+                sum(quantity) over w as position
+                from operations
+                where type = 'trade'
+                window w as (partition by portfolio_name, instrument_isin order by date, quantity desc)
+        ) as summed
+        window w as (partition by portfolio_name, instrument_isin order by date, quantity desc)
+    ) as sum_partitioned
+    window w as (partition by portfolio_name, instrument_isin, ownership_partition order by date)
+) as partition_total
+order by portfolio_name, instrument_isin, ownership_partition desc, date desc;
+
+
+CREATE VIEW IF NOT EXISTS portfolios AS
+select portfolio_name, instrument_isin, date, position, ppu, currency,
+       ownership_partition
+from (
+    select *,
+           row_number() over (partition by portfolio_name, instrument_isin
+                              order by ownership_partition desc, date desc) as rn
+    from portfolios_history
+) as ranked
+where rn = 1
+order by portfolio_name, instrument_isin;
+
+
+CREATE VIEW IF NOT EXISTS fx_rates AS
+with pairs as (
+    select substr(isin, 1, 3) as base, instruments.currency as quote, date, close as rate
+    from quotes
+    join instruments on instrument_isin = isin
+    where type = 'currency'
+          and length(isin) = 6
+          and substr(isin, 4) = instruments.currency
+          and close is not null
+          and close != 0
+), both_ways as (
+    select base, quote, date, rate from pairs
+    union all
+    select quote, base, date, 1 / rate from pairs
+), with_pence as (
+    select base, quote, date, rate from both_ways
+    union all
+    -- GBX is a hundredth of GBP
+    select 'GBX', quote, date, rate / 100 from both_ways where base = 'GBP'
+    union all
+    select base, 'GBX', date, rate * 100 from both_ways where quote = 'GBP'
+)
+select base, quote, date, rate
+from (
+    select *,
+           row_number() over (partition by base, quote, date) as rn
+    from with_pence
+) as ranked
+where rn = 1;
+
+
+CREATE VIEW IF NOT EXISTS fx_latest_rates AS
+select base, quote, date, rate
+from (
+    select *,
+           row_number() over (partition by base, quote order by date desc) as rn
+    from fx_rates
+) as ranked
+where rn = 1;
+
+
+CREATE TRIGGER IF NOT EXISTS instruments_latest_quote_notify
+       AFTER UPDATE OF latest_quote ON instruments
+       FOR EACH ROW
+       WHEN OLD.latest_quote IS NOT NEW.latest_quote
+BEGIN
+    SELECT pg_notify('greenpoint_live_quotes', json_object(
+      'isin', NEW.isin,
+      'latest_quote', NEW.latest_quote,
+      'latest_quote_time', NEW.latest_quote_time
+    ));
+END;
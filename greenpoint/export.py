@@ -0,0 +1,369 @@
+"""Export quotes and operations to columnar files.
+
+Tables are streamed out of PostgreSQL with COPY and written as one file per
+instrument and year, in a Hive-style layout that `pyarrow.dataset` and most
+analytics tools can read directly::
+
+  <root>/quotes/instrument_isin=FR0000120271/year=2019/data.arrow
+
+Each table directory keeps the checksum of every partition it holds, so an
+export only rewrites the partitions that changed since the last one, e.g.
+the current year or a year where missing quotes were backfilled.
+
+Arrow IPC files are written uncompressed so that `load_quotes` can memory-map
+them: values are then read without being copied. Parquet files are smaller
+but must be decoded.
+
+This needs pyarrow, which is an optional dependency.
+"""
+import io
+import json
+import os
+
+import numpy
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from greenpoint import instrument
+from greenpoint import utils
+
+
+FORMATS = ("arrow", "parquet")
+STATE_FILE = "_state.json"
+
+# Number of partitions fetched by one COPY, to bound memory usage
+PARTITIONS_PER_COPY = 500
+
+
+# Columns of each exported table, the first two being the partition keys
+TABLES = {
+    "quotes": (
+        ("instrument_isin", "text"),
+        ("date", "date"),
+        ("open", "float8"),
+        ("close", "float8"),
+        ("high", "float8"),
+        ("low", "float8"),
+        ("volume", "float8"),
+    ),
+    "operations": (
+        ("instrument_isin", "text"),
+        ("date", "date"),
+        ("portfolio_name", "text"),
+        ("type", "text"),
+        ("quantity", "float8"),
+        ("price", "float8"),
+        ("fees", "float8"),
+        ("taxes", "float8"),
+        ("currency", "text"),
+    ),
+}
+
+# Rows are sorted within a partition by these columns
+ORDER_BY = {
+    "quotes": "date",
+    "operations": "date, portfolio_name, quantity DESC",
+}
+
+
+def _check_pyarrow():
+    if pyarrow is None:
+        raise RuntimeError(
+            "pyarrow is required to export and load columnar files, "
+            "install greenpoint[export]")
+
+
+def _arrow_type(sql_type):
+    return {
+        "text": pyarrow.string(),
+        "date": pyarrow.date32(),
+        "float8": pyarrow.float64(),
+    }[sql_type]
+
+
+def _select(table):
+    return ", ".join("%s::%s" % (name, sql_type)
+                     for name, sql_type in TABLES[table])
+
+
+def partition_path(root, table, isin, year, format="arrow"):  # noqa
+    return os.path.join(root, table, "instrument_isin=%s" % isin,
+                        "year=%d" % year, "data." + format)
+
+
+def _load_state(root, table):
+    try:
+        with open(os.path.join(root, table, STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(root, table, state):
+    path = os.path.join(root, table, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _state_key(isin, year):
+    return "%s/%d" % (isin, year)
+
+
+async def get_partitions(table, isins=None):
+    """Return the checksum of each partition of a table.
+
+    :return: A dict of checksums indexed by (ISIN, year).
+    """
+    cur = await utils.get_db()
+    rows = await cur.fetch(
+        "SELECT instrument_isin, "
+        "extract(year FROM date)::int AS year, "
+        "md5(string_agg((%s)::text, ',' ORDER BY %s)) AS checksum "
+        "FROM %s AS t "
+        "WHERE $1::text[] IS NULL OR instrument_isin = any($1::text[]) "
+        "GROUP BY 1, 2" % (
+            "ROW(%s)" % _select(table), ORDER_BY[table], table),
+        isins)
+    return {(row['instrument_isin'], row['year']): row['checksum']
+            for row in rows}
+
+
+async def _copy_partitions(table, partitions):
+    """Fetch the rows of some partitions with COPY, as an Arrow table."""
+    buf = io.BytesIO()
+
+    async def write(data):
+        buf.write(data)
+
+    cur = await utils.get_db()
+    async with cur.acquire() as con:
+        await con.copy_from_query(
+            "SELECT %s FROM %s "
+            "WHERE (instrument_isin, extract(year FROM date)::int) IN "
+            "(SELECT * FROM unnest($1::text[], $2::int[])) "
+            "ORDER BY instrument_isin, %s" % (
+                _select(table), table, ORDER_BY[table]),
+            [isin for isin, _ in partitions],
+            [year for _, year in partitions],
+            output=write, format="csv")
+
+    columns = TABLES[table]
+    buf.seek(0)
+    return pyarrow.csv.read_csv(
+        buf,
+        read_options=pyarrow.csv.ReadOptions(
+            column_names=[name for name, _ in columns]),
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types={name: _arrow_type(sql_type)
+                          for name, sql_type in columns},
+            # COPY writes NULL unquoted and empty strings quoted
+            null_values=[""], quoted_strings_can_be_null=False))
+
+
+def _split(data):
+    """Split a table sorted by ISIN and date into partitions."""
+    if not len(data):
+        return
+    isins = data.column("instrument_isin").to_numpy(zero_copy_only=False)
+    years = data.column("date").to_numpy().astype("datetime64[Y]")
+    bounds = numpy.concatenate((
+        [0],
+        numpy.flatnonzero((isins[1:] != isins[:-1]) |
+                          (years[1:] != years[:-1])) + 1,
+        [len(data)]))
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        yield ((isins[begin], int(years[begin].astype(int)) + 1970),
+               data.slice(begin, end - begin))
+
+
+def _prepare(table, data):
+    data = data.drop_columns(["instrument_isin"]).combine_chunks()
+    if table == "quotes":
+        # NaN instead of nulls, so the columns have no validity bitmap and
+        # can be read without copy
+        data = pyarrow.table({
+            name: (column if name == "date" else column.fill_null(numpy.nan))
+            for name, column in zip(data.column_names, data.columns)})
+    return data
+
+
+def _write(path, data, format):  # noqa
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    if format == "parquet":
+        pyarrow.parquet.write_table(data, tmp)
+    else:
+        with pyarrow.OSFile(tmp, "wb") as sink:
+            with pyarrow.ipc.new_file(sink, data.schema) as writer:
+                writer.write_table(data)
+    os.replace(tmp, path)
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+        os.rmdir(os.path.dirname(path))
+    except FileNotFoundError:
+        pass
+
+
+async def export_table(root, table, format="arrow", isins=None):  # noqa
+    """Export the partitions of a table that changed since the last export.
+
+    :param root: Directory to export to.
+    :param table: Name of the table, one of `TABLES`.
+    :param format: Format of the files, one of `FORMATS`.
+    :param isins: Only export these instruments, all by default.
+    :return: The number of partitions written and removed.
+    """
+    _check_pyarrow()
+    state = _load_state(root, table)
+    if state.get("format", format) != format:
+        # Start over rather than mixing formats in the same directory
+        for key in state["partitions"]:
+            isin, year = key.rsplit("/", 1)
+            _remove(partition_path(root, table, isin, int(year),
+                                   state["format"]))
+        state = {}
+    partitions = state.setdefault("partitions", {})
+    state["format"] = format
+
+    current = await get_partitions(table, isins)
+    changed = sorted(
+        key for key, checksum in current.items()
+        if partitions.get(_state_key(*key)) != checksum)
+
+    os.makedirs(os.path.join(root, table), exist_ok=True)
+    for chunk in utils.grouper(changed, PARTITIONS_PER_COPY):
+        data = await _copy_partitions(table, chunk)
+        for (isin, year), part in _split(data):
+            _write(partition_path(root, table, isin, year, format),
+                   _prepare(table, part), format)
+            partitions[_state_key(isin, year)] = current[(isin, year)]
+        _save_state(root, table, state)
+
+    removed = 0
+    for key in list(partitions):
+        isin, year = key.rsplit("/", 1)
+        if ((isins is None or isin in isins) and
+                (isin, int(year)) not in current):
+            _remove(partition_path(root, table, isin, int(year), format))
+            del partitions[key]
+            removed += 1
+    _save_state(root, table, state)
+    return len(changed), removed
+
+
+async def export(root, format="arrow", tables=None, isins=None):  # noqa
+    """Export tables to columnar files.
+
+    :return: A dict of (written, removed) partition counts by table.
+    """
+    return {table: await export_table(root, table, format, isins)
+            for table in (tables or TABLES)}
+
+
+def _read(path):
+    if path.endswith(".parquet"):
+        return pyarrow.parquet.read_table(path, memory_map=True)
+    # Buffers of the table point into the mapped file
+    return pyarrow.ipc.open_file(pyarrow.memory_map(path)).read_all()
+
+
+def _partition_files(root, table, isin):
+    directory = os.path.join(root, table, "instrument_isin=%s" % isin)
+    try:
+        years = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    files = []
+    for year in years:
+        for format in FORMATS:  # noqa
+            path = os.path.join(directory, year, "data." + format)
+            if os.path.exists(path):
+                files.append((int(year.split("=")[1]), path))
+                break
+    return files
+
+
+def _to_numpy(column):
+    if column.num_chunks == 1:
+        return column.chunk(0).to_numpy(zero_copy_only=False)
+    return column.to_numpy()
+
+
+def load_quotes(root, isin, start=None, stop=None):
+    """Load the exported quotes of an instrument.
+
+    Values of an Arrow export are views on the memory-mapped files when
+    the range spans a single year.
+
+    :param root: Directory of the export.
+    :param start: Date to start at (included)
+    :param stop: Date to stop at (included)
+    :rtype: instrument.QuoteColumns
+    """
+    _check_pyarrow()
+    parts = []
+    for year, path in _partition_files(root, "quotes", isin):
+        if ((start is None or year >= start.year) and
+                (stop is None or year <= stop.year)):
+            data = _read(path)
+            parts.append(instrument.QuoteColumns(
+                date=_to_numpy(data.column("date")),
+                **{k: _to_numpy(data.column(k))
+                   for k in instrument.QuoteColumns.VALUES}))
+
+    if not parts:
+        return instrument.QuoteColumns.empty()
+    if len(parts) == 1:
+        quotes = parts[0]
+    else:
+        quotes = instrument.QuoteColumns(
+            date=numpy.concatenate([part.date for part in parts]),
+            **{k: numpy.concatenate([getattr(part, k) for part in parts])
+               for k in instrument.QuoteColumns.VALUES})
+    return quotes.slice(start, stop)
+
+
+def load_quotes_bulk(root, isins, start=None, stop=None):
+    """Load exported quotes like `Instrument.get_quotes_bulk`.
+
+    :return: A dict of `QuoteColumns` indexed by ISIN.
+    """
+    return {isin: load_quotes(root, isin, start, stop) for isin in isins}
+
+
+def load_operations(root, isins=None):
+    """Load exported operations as one Arrow table.
+
+    :param isins: Only load these instruments, all by default.
+    """
+    _check_pyarrow()
+    if isins is None:
+        try:
+            isins = sorted(
+                name.split("=", 1)[1]
+                for name in os.listdir(os.path.join(root, "operations"))
+                if name.startswith("instrument_isin="))
+        except FileNotFoundError:
+            isins = []
+    tables = []
+    for isin in isins:
+        for _, path in _partition_files(root, "operations", isin):
+            data = _read(path)
+            tables.append(data.add_column(
+                0, "instrument_isin",
+                pyarrow.array([isin] * len(data), pyarrow.string())))
+    if not tables:
+        return pyarrow.table({
+            name: pyarrow.array([], _arrow_type(sql_type))
+            for name, sql_type in TABLES["operations"]})
+    return pyarrow.concat_tables(tables)
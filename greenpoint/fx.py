@@ -0,0 +1,163 @@
+import cachetools
+
+import daiquiri
+
+import numpy
+
+from greenpoint import instrument
+from greenpoint import utils
+
+
+LOG = daiquiri.getLogger(__name__)
+
+DEFAULT_REPORTING_CURRENCY = "EUR"
+
+# Quoted in hundredths of their parent currency
+SUBUNITS = {
+    "GBX": "GBP",
+}
+
+
+def get_reporting_currency():
+    return utils.get_config().get(
+        'reporting_currency', DEFAULT_REPORTING_CURRENCY).upper()
+
+
+def pair_isin(base, quote):
+    return base + quote
+
+
+async def ensure_pairs(currency):
+    """Create the FX pair instruments needed to value everything in currency.
+
+    The pairs are regular instruments, so their quotes are fetched by the
+    usual provider pipeline.
+
+    :param currency: The reporting currency.
+    :type currency: str
+    """
+    pool = await utils.get_db()
+    rows = await pool.fetch(
+        "SELECT currency FROM instruments "
+        "WHERE type != 'currency' "
+        "UNION "
+        "SELECT currency FROM operations")
+    pairs = []
+    for base in sorted({SUBUNITS.get(row['currency'], row['currency'])
+                        for row in rows}):
+        if base == currency:
+            continue
+        inst = instrument.Instrument(
+            isin=pair_isin(base, currency),
+            type=instrument.InstrumentType.CURRENCY,
+            name="%s/%s" % (base, currency),
+            symbol=pair_isin(base, currency),
+            pea=False, pea_pme=False, ttf=False,
+            exchange_mic=None,
+            currency=currency)
+        LOG.debug("Ensuring FX pair %s exists", inst)
+        await inst.save()
+        pairs.append(inst)
+    return pairs
+
+
+RATE_TABLES = cachetools.TTLCache(maxsize=16, ttl=3600)
+
+
+async def refresh_rates():
+    """Rebuild the `fx_rates` table from the FX pairs quotes."""
+    pool = await utils.get_db()
+    await pool.execute("REFRESH MATERIALIZED VIEW fx_rates")
+    RATE_TABLES.clear()
+    await utils.notify_change(pool, "fx")
+
+
+class RateTable(object):
+    """Daily rates to a reporting currency, indexed for as-of lookups.
+
+    Rates are stored per currency as two sorted columns so that converting
+    many amounts costs one `searchsorted` per currency, not one lookup per
+    amount.
+    """
+
+    def __init__(self, currency, rates):
+        self.currency = currency
+        self.rates = rates
+
+    @classmethod
+    async def load(cls, currency):
+        pool = await utils.get_db()
+        rows = await pool.fetch(
+            "SELECT base, date, rate::float8 AS rate FROM fx_rates "
+            "WHERE quote = $1 ORDER BY base, date",
+            currency)
+        return cls.from_rows(currency, rows)
+
+    @classmethod
+    def from_rows(cls, currency, rows):
+        columns = {}
+        for row in rows:
+            dates, rates = columns.setdefault(row['base'], ([], []))
+            dates.append(row['date'])
+            rates.append(row['rate'])
+        return cls(currency, {
+            base: (numpy.array(dates, dtype="datetime64[D]"),
+                   numpy.array(rates, dtype=numpy.float64))
+            for base, (dates, rates) in columns.items()
+        })
+
+    def latest(self, base):
+        if base == self.currency:
+            return 1.0
+        try:
+            return float(self.rates[base][1][-1])
+        except (KeyError, IndexError):
+            return None
+
+    def convert(self, amounts, currencies, dates=None):
+        """Convert amounts to the reporting currency.
+
+        Each amount is converted with the latest rate known at its date
+        (as-of join), or with the latest rate if no dates are given.
+        Amounts in a currency without any known rate convert to NaN.
+
+        :param amounts: The amounts to convert.
+        :param currencies: The currency of each amount.
+        :param dates: The date of each amount.
+        :return: A float64 array.
+        """
+        amounts = numpy.asarray(amounts, dtype=numpy.float64)
+        currencies = numpy.asarray(currencies)
+        if dates is not None:
+            dates = numpy.asarray(dates, dtype="datetime64[D]")
+        factors = numpy.full(len(amounts), numpy.nan)
+        for base in numpy.unique(currencies):
+            mask = currencies == base
+            if base == self.currency:
+                factors[mask] = 1.0
+                continue
+            try:
+                rate_dates, rates = self.rates[base]
+            except KeyError:
+                continue
+            if dates is None:
+                factors[mask] = rates[-1]
+                continue
+            idx = numpy.searchsorted(rate_dates, dates[mask], side="right")
+            found = idx > 0
+            sub = numpy.full(len(idx), numpy.nan)
+            sub[found] = rates[idx[found] - 1]
+            factors[mask] = sub
+        return amounts * factors
+
+
+async def get_rate_table(currency=None):
+    if currency is None:
+        currency = get_reporting_currency()
+    try:
+        return RATE_TABLES[currency]
+    except KeyError:
+        pass
+    table = await RateTable.load(currency)
+    RATE_TABLES[currency] = table
+    return table
@@ -1,4 +1,5 @@
 import asyncio
+import calendar
 import datetime
 import itertools
 import json
@@ -8,6 +9,8 @@ import aiohttp
 
 import attr
 
+import cachetools
+
 import enum
 
 import daiquiri
@@ -16,6 +19,12 @@ import iso8601
 
 from lxml import etree
 
+import numpy
+
+from greenpoint import metrics
+from greenpoint import parsing
+from greenpoint import ticks
+from greenpoint import tracing
 from greenpoint import utils
 
 
@@ -39,6 +48,225 @@ class Quote(object):
         attr.validators.instance_of(int)), hash=False)
 
 
+# Parsers of the provider payloads are functions, so that they can run in a
+# process of the parsing pool.
+
+def parse_boursorama_quotes(content, start=None, stop=None):
+    """Parse the JSON quote history of Boursorama.
+
+    :return: A set of `Quote`.
+    """
+    quotes = set()
+    json_content = json.loads(content)
+    points = json_content['dataSets'][0]['dataProvider']
+    dates = utils.strpdates([point['d'][:-6] for point in points],
+                            "%d/%m/%Y").tolist()
+    for point, d in zip(points, dates):
+        if start is not None and d < start:
+            continue
+        if stop is not None and d > stop:
+            continue
+        quotes.add(Quote(
+            date=d,
+            open=float(point['o']),
+            close=float(point['c']),
+            high=float(point['h']),
+            low=float(point['l']),
+            volume=point['v']
+        ))
+    return quotes
+
+
+def parse_lesechos_quotes(content):
+    """Parse the XML quote history of Les Echos.
+
+    :return: A set of `Quote`.
+    """
+    quotes = set()
+    xml = etree.fromstring(content)
+    histories = xml.xpath("//historyResponse/history/historyDt")
+    dates = utils.strpdates([history.get("dt") for history in histories],
+                            "%Y%m%d").tolist()
+    for history, date in zip(histories, dates):
+        kwargs = {"date": date}
+        for (k, kwarg) in (("openPx", "open"),
+                           ("closePx", "close"),
+                           ("highPx", "high"),
+                           ("lowPx", "low"),
+                           ("qty", "volume")):
+            v = history.get(k)
+            if v is None:
+                break
+            v = float(v)
+            if kwarg == "volume":
+                v = int(v)
+            kwargs[kwarg] = v
+        else:
+            quotes.add(Quote(**kwargs))
+    return quotes
+
+
+# <td class="lm">Apr 21, 2017
+# <td class="rgt">58.40
+# <td class="rgt">59.90
+# <td class="rgt">58.40
+# <td class="rgt">59.90
+# <td class="rgt rm">2,918
+
+_GOOGLE_FINANCE_RE = re.compile("<td class=\"lm\">(.+ \d+, \d+)\n"
+                                "<td class=\"rgt\">(.+)\n"
+                                "<td class=\"rgt\">(.+)\n"
+                                "<td class=\"rgt\">(.+)\n"
+                                "<td class=\"rgt\">(.+)\n"
+                                "<td class=\"rgt rm\">(.+)\n")
+
+
+def parse_google_quotes(text, start=None, stop=None):
+    """Parse a page of the Google Finance quote history.
+
+    :return: A set of `Quote`, and whether the page had any quote.
+    """
+    quotes = set()
+    results = list(_GOOGLE_FINANCE_RE.finditer(text))
+    for found in results:
+        date = utils.strpdate(found.group(1), "%b %d, %Y")
+        if start is not None and date < start:
+            # Results are ordered descending
+            # As soon as a date is before the start, we can stop
+            break
+        if stop is not None and date > stop:
+            continue
+        values = []
+        for idx in range(2, 7):
+            v = found.group(idx)
+            if v == "-":
+                break
+            v = float(v.replace(",", ""))
+            values.append(v)
+        else:
+            quotes.add(
+                Quote(
+                    date=date,
+                    open=values[0],
+                    high=values[1],
+                    low=values[2],
+                    close=values[3],
+                    volume=int(values[4]),
+                )
+            )
+    return quotes, bool(results)
+
+
+def parse_yahoo_quotes(content, start, stop):
+    """Parse the JSON chart of Yahoo Finance.
+
+    :return: A set of `Quote`.
+    """
+    quotes = set()
+    result = json.loads(content)['chart']['result']
+    if not result:
+        return quotes
+    result = result[0]
+    gmtoffset = result['meta'].get('gmtoffset', 0)
+    values = result['indicators']['quote'][0]
+    for i, ts in enumerate(result.get('timestamp', ())):
+        d = datetime.datetime.utcfromtimestamp(ts + gmtoffset).date()
+        if d < start or d > stop:
+            continue
+        point = [values[k][i]
+                 for k in ("open", "close", "high", "low", "volume")]
+        if None in point:
+            continue
+        quotes.add(Quote(
+            date=d,
+            open=float(point[0]),
+            close=float(point[1]),
+            high=float(point[2]),
+            low=float(point[3]),
+            volume=int(point[4]),
+        ))
+    return quotes
+
+
+@attr.s(slots=True, frozen=True)
+class QuoteColumns(object):
+    """Quotes of an instrument stored as columns sorted by date.
+
+    Dates are `datetime64[D]` and values are `float64`, with NaN where a
+    value is unknown.
+    """
+
+    date = attr.ib()
+    open = attr.ib()  # noqa
+    close = attr.ib()
+    high = attr.ib()
+    low = attr.ib()
+    volume = attr.ib()
+
+    VALUES = ("open", "close", "high", "low", "volume")
+
+    @classmethod
+    def from_lists(cls, date, **values):
+        date = numpy.array(date, dtype="datetime64[D]")
+        return cls(
+            date=date,
+            **{k: (numpy.array(values[k], dtype=numpy.float64)
+                   if k in values else numpy.full(len(date), numpy.nan))
+               for k in cls.VALUES})
+
+    @classmethod
+    def empty(cls):
+        return cls.from_lists(())
+
+    def __len__(self):
+        return len(self.date)
+
+    @property
+    def nbytes(self):
+        return self.date.nbytes + sum(getattr(self, k).nbytes
+                                      for k in self.VALUES)
+
+    def slice(self, start=None, stop=None):  # noqa
+        """Return the quotes between start and stop (included).
+
+        The returned columns are views on this object's arrays.
+        """
+        begin = 0 if start is None else numpy.searchsorted(
+            self.date, numpy.datetime64(start, "D"), side="left")
+        end = len(self) if stop is None else numpy.searchsorted(
+            self.date, numpy.datetime64(stop, "D"), side="right")
+        if begin == 0 and end == len(self):
+            return self
+        return self.__class__(
+            date=self.date[begin:end],
+            **{k: getattr(self, k)[begin:end] for k in self.VALUES})
+
+
+# Full quote histories by ISIN, evicted by size in bytes
+QUOTES_CACHE = cachetools.LRUCache(maxsize=64 * 1024 * 1024,
+                                   getsizeof=lambda cols: cols.nbytes)
+# Bumped on each invalidation so that in-flight reads do not cache stale data
+_QUOTES_CACHE_EPOCH = 0
+
+
+def invalidate_quotes(isin=None):
+    """Drop cached quotes of an instrument, or of all of them."""
+    global _QUOTES_CACHE_EPOCH
+    _QUOTES_CACHE_EPOCH += 1
+    if isin is None:
+        QUOTES_CACHE.clear()
+    else:
+        QUOTES_CACHE.pop(isin, None)
+
+
+def client_session():
+    """Return an HTTP session recording provider metrics and traces."""
+    trace_configs = [metrics.trace_config()]
+    if tracing.enabled():
+        trace_configs.append(tracing.trace_config())
+    return aiohttp.ClientSession(trace_configs=trace_configs)
+
+
 class InstrumentType(enum.Enum):
     ETF = "etf"
     STOCK = "stock"
@@ -115,6 +343,21 @@ class Instrument(object):
     is_alive = attr.ib(
         validator=attr.validators.instance_of(bool),
         default=True)
+    # Number of sessions in a row whose history refreshes returned nothing
+    empty_refreshes = attr.ib(
+        validator=attr.validators.instance_of(int),
+        default=0, cmp=False)
+    # Latest session counted in `empty_refreshes`
+    empty_session = attr.ib(
+        validator=attr.validators.optional(
+            attr.validators.instance_of(datetime.date)),
+        default=None, cmp=False)
+
+    # Base URL of each provider, which can be pointed to a stand-in server
+    BOURSORAMA_URL = "http://www.boursorama.com"
+    LESECHOS_URL = "https://lesechos-bourse-fo-cdn.wlb.aw.atos.net"
+    GOOGLE_URL = "https://finance.google.com"
+    YAHOO_URL = "https://query1.finance.yahoo.com"
 
     def __str__(self):
         if self.symbol:
@@ -126,6 +369,14 @@ class Instrument(object):
         else:
             return "<%s (%s)>" % (self.name, self.type.name)
 
+    @property
+    def fx_pair(self):
+        """Return the (base, quote) currencies if this is a FX pair."""
+        if self.type != InstrumentType.CURRENCY or len(self.isin) != 6:
+            return
+        if self.isin[3:] == self.currency:
+            return self.isin[:3], self.isin[3:]
+
     @property
     def google_symbol(self):
         if self.exchange_mic is None:
@@ -137,6 +388,10 @@ class Instrument(object):
 
     @property
     def yahoo_symbol(self):
+        if self.type == InstrumentType.CURRENCY:
+            if self.fx_pair is None:
+                return
+            return self.isin + "=X"
         if self.exchange_mic is None:
             if self.type == InstrumentType.FUND:
                 # NOTE This is probably wrong, but currently we only support
@@ -156,7 +411,7 @@ class Instrument(object):
             "(isin, name, type, symbol, pea, pea_pme, ttf, "
             "exchange_mic, currency, latest_quote) "
             "VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)"
-            "ON CONFLICT ON CONSTRAINT instruments_pkey "
+            "ON CONFLICT (isin) "
             "DO NOTHING",
             self.isin, self.name, self.type.name.lower(),
             self.symbol, self.pea, self.pea_pme, self.ttf, self.exchange_mic,
@@ -188,7 +443,7 @@ class Instrument(object):
                                            start=None, stop=None):
         quotes = set()
         async with session.get(
-                "http://www.boursorama.com/recherche/index.phtml?q=" +
+                self.BOURSORAMA_URL + "/recherche/index.phtml?q=" +
                 self.isin) as r:
             try:
                 symbol = str(r.url).split("symbole=")[1]
@@ -196,7 +451,7 @@ class Instrument(object):
                 return quotes
 
         async with session.get(
-                "http://www.boursorama.com/graphiques/quotes.phtml?s%5B0%5D=" +
+                self.BOURSORAMA_URL + "/graphiques/quotes.phtml?s%5B0%5D=" +
                 symbol +
                 "&c=eJxNUEFuwyAQzFv22BPYbRqWYw9RpapNZTV"
                 "SThaxabwqDhHgWlHkvxdsXCKVE7Mz"
@@ -210,24 +465,11 @@ class Instrument(object):
         ) as r:
             # NOTE Content-Type is wrong, so cannot use r.json() here
             content = await r.read()
-            json_content = json.loads(content)
-            for point in json_content['dataSets'][0]['dataProvider']:
-                d = datetime.datetime.strptime(
-                    point['d'][:-6], "%d/%m/%Y").date()
-                if start is not None and d < start:
-                    continue
-                if stop is not None and d > stop:
-                    continue
-                quotes.add(Quote(
-                    date=d,
-                    open=float(point['o']),
-                    close=float(point['c']),
-                    high=float(point['h']),
-                    low=float(point['l']),
-                    volume=point['v']
-                ))
 
-        return quotes
+        with tracing.span("parse", "parse", provider="boursorama",
+                          isin=self.isin):
+            return await parsing.run(parse_boursorama_quotes,
+                                     content, start, stop, cpu=True)
 
     async def fetch_quotes_from_lesechos(self, session, start=None, stop=None):
         quotes = set()
@@ -247,7 +489,7 @@ class Instrument(object):
         stop = stop.strftime("%Y%m%d")
 
         async with session.get(
-                "https://lesechos-bourse-fo-cdn.wlb.aw.atos.net" +
+                self.LESECHOS_URL +
                 "/FDS/history.xml?entity=echos&view=ALL" +
                 "&code=" + self.isin +
                 "&codification=ISIN&adjusted=true&base100=false" +
@@ -258,41 +500,9 @@ class Instrument(object):
                 "&computeVar=true") as r:
             content = await r.read()
 
-        xml = etree.fromstring(content)
-        for history in xml.xpath("//historyResponse/history/historyDt"):
-            kwargs = {
-                "date": datetime.datetime.strptime(
-                    history.get("dt"), "%Y%m%d").date(),
-            }
-            for (k, kwarg) in (("openPx", "open"),
-                               ("closePx", "close"),
-                               ("highPx", "high"),
-                               ("lowPx", "low"),
-                               ("qty", "volume")):
-                v = history.get(k)
-                if v is None:
-                    break
-                v = float(v)
-                if kwarg == "volume":
-                    v = int(v)
-                kwargs[kwarg] = v
-            else:
-                quotes.add(Quote(**kwargs))
-        return quotes
-
-    # <td class="lm">Apr 21, 2017
-    # <td class="rgt">58.40
-    # <td class="rgt">59.90
-    # <td class="rgt">58.40
-    # <td class="rgt">59.90
-    # <td class="rgt rm">2,918
-
-    _GOOGLE_FINANCE_RE = re.compile("<td class=\"lm\">(.+ \d+, \d+)\n"
-                                    "<td class=\"rgt\">(.+)\n"
-                                    "<td class=\"rgt\">(.+)\n"
-                                    "<td class=\"rgt\">(.+)\n"
-                                    "<td class=\"rgt\">(.+)\n"
-                                    "<td class=\"rgt rm\">(.+)\n")
+        with tracing.span("parse", "parse", provider="lesechos",
+                          isin=self.isin):
+            return await parsing.run(parse_lesechos_quotes, content)
 
     async def fetch_quotes_from_google(self, session, start=None, stop=None):
         quotes = set()
@@ -303,69 +513,87 @@ class Instrument(object):
 
         for index in itertools.count(0, 200):
             async with session.get(
-                    "https://finance.google.com/finance/historical"
+                    self.GOOGLE_URL + "/finance/historical"
                     "?q=%s&num=200&start=%d"
                     % (google_symbol, index)) as r:
                 text = await r.text()
 
-            results = list(self._GOOGLE_FINANCE_RE.finditer(text))
-            if not len(results):
+            with tracing.span("parse", "parse", provider="google",
+                              isin=self.isin):
+                found, has_results = await parsing.run(
+                    parse_google_quotes, text, start, stop, cpu=True)
+            if not has_results:
                 return quotes
-
-            for found in results:
-                date = datetime.datetime.strptime(
-                    found.group(1), "%b %d, %Y").date()
-                if start is not None and date < start:
-                    # Results are ordered descending
-                    # As soon as a date is before the start, we can stop
-                    break
-                if stop is not None and date > stop:
-                    continue
-                values = []
-                for idx in range(2, 7):
-                    v = found.group(idx)
-                    if v == "-":
-                        break
-                    v = float(v.replace(",", ""))
-                    values.append(v)
-                else:
-                    quotes.add(
-                        Quote(
-                            date=date,
-                            open=values[0],
-                            high=values[1],
-                            low=values[2],
-                            close=values[3],
-                            volume=int(values[4]),
-                        )
-                    )
+            quotes.update(found)
 
         return quotes
 
+    async def fetch_quotes_from_yahoo(self, session, start=None, stop=None):
+        quotes = set()
+        yahoo_symbol = self.yahoo_symbol
+        if yahoo_symbol is None:
+            return quotes
+
+        if start is None:
+            start = datetime.date(2000, 1, 1)
+        if stop is None:
+            stop = datetime.datetime.now().date()
+
+        async with session.get(
+                self.YAHOO_URL + "/v8/finance/chart/%s"
+                "?interval=1d&period1=%d&period2=%d"
+                % (yahoo_symbol,
+                   calendar.timegm(start.timetuple()),
+                   calendar.timegm((stop + ONE_DAY).timetuple()))) as r:
+            if r.status != 200:
+                return quotes
+            content = await r.read()
+
+        with tracing.span("parse", "parse", provider="yahoo",
+                          isin=self.isin):
+            return await parsing.run(parse_yahoo_quotes,
+                                     content, start, stop, cpu=True)
+
     QUOTES_PROVIDERS = {
         "boursorama": fetch_quotes_from_boursorama,
         "lesechos": fetch_quotes_from_lesechos,
         "google": fetch_quotes_from_google,
+        "yahoo": fetch_quotes_from_yahoo,
     }
 
-    async def refresh_quotes(self, start=None, stop=None):
+    async def _fetch_quotes(self, provider, session, start, stop):
+        # Runs in its own task, so the provider is only set for its requests
+        metrics.PROVIDER.set(provider)
+        with tracing.span("provider", "provider",
+                          provider=provider, isin=self.isin), \
+                metrics.PROVIDER_CALL_DURATION.time(
+                    errors=metrics.PROVIDER_CALL_ERRORS, provider=provider):
+            return await self.QUOTES_PROVIDERS[provider](
+                self, session, start, stop)
+
+    async def refresh_quotes(self, start=None, stop=None, providers=None):
         """Get quotes from all available providers and merge them.
 
         :param start: Timestamp to start at (included)
         :param stop: Timestamp to stop at (included)
+        :param providers: Names of the providers to use, all by default.
+        :return: The number of quotes found.
         """
+        if providers is None:
+            providers = self.QUOTES_PROVIDERS.keys()
         cur = await utils.get_db()
         new_quotes = set()
-        async with aiohttp.ClientSession() as session:
-            futs = [asyncio.ensure_future(func(self, session, start, stop))
-                    for func in self.QUOTES_PROVIDERS.values()]
+        async with client_session() as session:
+            futs = [asyncio.ensure_future(
+                self._fetch_quotes(provider, session, start, stop))
+                for provider in providers]
             for fut in futs:
                 new_quotes.update(await asyncio.wait_for(fut, None))
         await cur.executemany(
             "INSERT INTO quotes "
             "(instrument_isin, date, open, close, high, low, volume) "
             "VALUES($1, $2, $3, $4, $5, $6, $7) "
-            "ON CONFLICT ON CONSTRAINT quotes_instrument_isin_date_key "
+            "ON CONFLICT (instrument_isin, date) "
             "DO UPDATE SET "
             "open = COALESCE(quotes.open, excluded.open), "
             "close = COALESCE(quotes.close, excluded.close), "
@@ -376,21 +604,150 @@ class Instrument(object):
               quote.high, quote.low, quote.volume)
              for quote in new_quotes),
         )
+        metrics.ROWS_UPSERTED.inc(len(new_quotes), table="quotes")
+        invalidate_quotes(self.isin)
+        if new_quotes:
+            await utils.notify_change(cur, "quotes", self.isin)
+        return len(new_quotes)
+
+    async def record_refresh(self, found, dead_after, session, held=False):
+        """Record the result of a history refresh.
+
+        Empty refreshes are counted once per expected session, so that
+        running updates several times before a provider publishes a
+        session does not count more than once. The instrument is marked
+        dead after `dead_after` sessions in a row without quotes, unless it
+        is held. A refresh finding quotes brings it back to life.
+
+        :param found: Whether the refresh found quotes.
+        :param dead_after: Number of empty sessions before marking dead.
+        :param session: Date of the latest session expected to be quoted.
+        :param held: Whether the instrument is held.
+        """
+        cur = await utils.get_db()
+        row = await cur.fetchrow(
+            "UPDATE instruments SET "
+            "empty_refreshes = CASE WHEN $2 THEN 0 ELSE {empty} END, "
+            "empty_session = CASE WHEN $2 THEN NULL "
+            "  ELSE greatest(empty_session, $4) END, "
+            "is_alive = $2 OR $5 OR (is_alive AND {empty} < $3) "
+            "WHERE isin = $1 "
+            "RETURNING is_alive, empty_refreshes, empty_session".format(
+                empty="CASE WHEN empty_session >= $4 THEN empty_refreshes "
+                      "ELSE empty_refreshes + 1 END"),
+            self.isin, found, dead_after, session, held)
+        if row is None:
+            return
+        self.empty_refreshes = row['empty_refreshes']
+        self.empty_session = row['empty_session']
+        if self.is_alive and not row['is_alive']:
+            LOG.warning("No quotes found for %s after %d sessions, "
+                        "marking it dead", self, self.empty_refreshes)
+        self.is_alive = row['is_alive']
+
+    async def get_quotes(self, start=None, stop=None):
+        """Get quotes stored for this instrument.
+
+        :param start: Date to start at (included)
+        :param stop: Date to stop at (included)
+        :rtype: QuoteColumns
+        """
+        quotes = await self.get_quotes_bulk([self.isin], start, stop)
+        return quotes[self.isin]
+
+    @staticmethod
+    async def get_quotes_bulk(isins, start=None, stop=None):
+        """Get quotes stored for several instruments at once.
 
-    async def refresh_live_quote(self):
-        async with aiohttp.ClientSession() as session:
-            ret = await self.fetch_live_quote_from_yahoo(session)
+        Histories missing from the cache are loaded with one query, already
+        aggregated as arrays, and cached whole so any range can be served
+        from them.
+
+        :param isins: ISIN of the instruments
+        :param start: Date to start at (included)
+        :param stop: Date to stop at (included)
+        :return: A dict of `QuoteColumns` indexed by ISIN.
+        """
+        result = {}
+        missing = []
+        for isin in isins:
             try:
-                ts, quote = ret
-            except TypeError:
-                LOG.info("Unable to find live quote for %s", self)
-                return
-            conn = await utils.get_db()
-            await conn.execute(
-                "UPDATE instruments "
-                "SET latest_quote = $1, latest_quote_time = $2 "
-                "WHERE isin = $3",
-                quote, ts, self.isin)
+                result[isin] = QUOTES_CACHE[isin].slice(start, stop)
+            except KeyError:
+                missing.append(isin)
+
+        if not missing:
+            return result
+
+        epoch = _QUOTES_CACHE_EPOCH
+        cur = await utils.get_db()
+        rows = await cur.fetch(
+            "SELECT instrument_isin, "
+            "array_agg(date ORDER BY date) AS date, "
+            "array_agg(open::float8 ORDER BY date) AS open, "
+            "array_agg(close::float8 ORDER BY date) AS close, "
+            "array_agg(high::float8 ORDER BY date) AS high, "
+            "array_agg(low::float8 ORDER BY date) AS low, "
+            "array_agg(volume::float8 ORDER BY date) AS volume "
+            "FROM quotes WHERE instrument_isin = any($1::text[]) "
+            "GROUP BY instrument_isin",
+            missing)
+        loaded = {row['instrument_isin']: QuoteColumns.from_lists(
+            **{k: row[k] for k in ("date",) + QuoteColumns.VALUES})
+            for row in rows}
+
+        for isin in missing:
+            quotes = loaded.get(isin) or QuoteColumns.empty()
+            if epoch == _QUOTES_CACHE_EPOCH:
+                try:
+                    QUOTES_CACHE[isin] = quotes
+                except ValueError:
+                    LOG.debug("Quotes of %s are too large to be cached",
+                              isin)
+            result[isin] = quotes.slice(start, stop)
+
+        return result
+
+    async def refresh_live_quote(self, session=None, writer=None):
+        """Get the live quote of the instrument and store it.
+
+        The quote is also recorded as an intraday tick.
+
+        :param session: The HTTP session to use, a new one by default.
+        :param writer: A `ticks.TickWriter` batching the ticks, otherwise
+                       the tick is stored right away.
+        :return: The quote time and value, or None if none was found.
+        """
+        if session is None:
+            async with client_session() as session:
+                return await self.refresh_live_quote(session, writer)
+
+        token = metrics.PROVIDER.set("yahoo_live")
+        try:
+            with tracing.span("provider", "provider",
+                              provider="yahoo_live", isin=self.isin), \
+                    metrics.PROVIDER_CALL_DURATION.time(
+                        errors=metrics.PROVIDER_CALL_ERRORS,
+                        provider="yahoo_live"):
+                tick = await self.fetch_live_quote_from_yahoo(session)
+        finally:
+            metrics.PROVIDER.reset(token)
+        if tick is None:
+            LOG.info("Unable to find live quote for %s", self)
+            return
+        conn = await utils.get_db()
+        await conn.execute(
+            "UPDATE instruments "
+            "SET latest_quote = $1, latest_quote_time = $2 "
+            "WHERE isin = $3",
+            tick.price, tick.time, self.isin)
+        metrics.ROWS_UPSERTED.inc(table="instruments")
+        await utils.notify_change(conn, "live_quote", self.isin)
+        if writer is None:
+            await ticks.save([tick])
+        else:
+            await writer.add(tick)
+        return tick.time, tick.price
 
     async def fetch_live_quote_from_yahoo(self, session):
         yahoo_symbol = self.yahoo_symbol
@@ -399,7 +756,7 @@ class Instrument(object):
             return
 
         async with session.get(
-                "https://query1.finance.yahoo.com/v7/finance/quote?"
+                self.YAHOO_URL + "/v7/finance/quote?"
                 "lang=en-US&region=US&corsDomain=finance.yahoo.com"
                 "&fields=currency,"
                 "regularMarketDayHigh,"
@@ -428,20 +785,20 @@ class Instrument(object):
             )
         # Safe guard
         if 'regularMarketOpen' in result:
-            return (datetime.datetime.utcfromtimestamp(
-                result['regularMarketTime']).replace(tzinfo=iso8601.UTC),
-                    result['regularMarketPrice'])
-
-        # Not used anymore because Quote wants a date and we use datetime
-        # return Quote(
-        #     date=datetime.datetime.utcfromtimestamp(
-        #         result['regularMarketTime']).date(),
-        #     open=result['regularMarketOpen'],
-        #     close=result['regularMarketPrice'],
-        #     low=result['regularMarketDayLow'],
-        #     high=result['regularMarketDayHigh'],
-        #     volume=result['regularMarketVolume'],
-        # )
+            timestamp = result['regularMarketTime']
+            offset = result.get('gmtOffSetMilliseconds', 0) // 1000
+            return ticks.Tick(
+                instrument_isin=self.isin,
+                time=datetime.datetime.utcfromtimestamp(
+                    timestamp).replace(tzinfo=iso8601.UTC),
+                date=datetime.datetime.utcfromtimestamp(
+                    timestamp + offset).date(),
+                price=result['regularMarketPrice'],
+                open=result['regularMarketOpen'],
+                high=result.get('regularMarketDayHigh'),
+                low=result.get('regularMarketDayLow'),
+                volume=result.get('regularMarketVolume'),
+            )
 
     @classmethod
     async def list_instruments(cls):
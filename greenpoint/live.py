@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import daiquiri
+
+from greenpoint import portfolio
+
+
+LOG = daiquiri.getLogger(__name__)
+
+
+def _to_float(value):
+    if value is None:
+        return
+    return float(value)
+
+
+class Holding(object):
+    """What is needed to revalue one line of the portfolio status."""
+
+    __slots__ = ("position", "ppu", "fx_rate", "market_value")
+
+    def __init__(self, position, ppu, fx_rate, market_value):
+        self.position = position
+        self.ppu = ppu
+        self.fx_rate = fx_rate
+        self.market_value = market_value
+
+    @classmethod
+    def from_status(cls, row):
+        return cls(_to_float(row['position']),
+                   _to_float(row['ppu']),
+                   _to_float(row['fx_rate']),
+                   _to_float(row['market_value']))
+
+
+class Subscriber(object):
+    def __init__(self, maxsize):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.lagging = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Do not let a slow client buffer an unbounded list of events
+            self.lagging = True
+
+
+class LiveQuotes(object):
+    """Push changed quotes and portfolio deltas to subscribers.
+
+    The portfolio status is computed once and then revalued line by line
+    as quote changes are notified, so the cost of an update does not
+    depend on the size of the portfolio nor on the number of clients.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.holdings = None
+        self.total = None
+        # Process notifications in order, even while the status loads
+        self.lock = asyncio.Lock()
+
+    def subscribe(self):
+        subscriber = Subscriber(self.queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def invalidate(self):
+        """Forget the portfolio status, e.g. after an import."""
+        self.holdings = None
+
+    def set_status(self, status):
+        self.holdings = {row['instrument_isin']: Holding.from_status(row)
+                         for row in status}
+        self.total = sum(h.market_value for h in self.holdings.values()
+                         if h.market_value is not None)
+
+    async def load_status(self):
+        self.set_status(await portfolio.get_status())
+
+    def update(self, isin, latest_quote, latest_quote_time):
+        """Revalue the holding of an instrument after a quote change.
+
+        :return: The event to send to subscribers.
+        """
+        event = {
+            "isin": isin,
+            "latest_quote": latest_quote,
+            "latest_quote_time": latest_quote_time,
+        }
+        holding = (self.holdings or {}).get(isin)
+        if (holding is None or latest_quote is None or
+           holding.fx_rate is None):
+            return event
+
+        market_value = holding.position * latest_quote * holding.fx_rate
+        if holding.market_value is not None:
+            self.total += market_value - holding.market_value
+        else:
+            self.total += market_value
+        holding.market_value = market_value
+        event["market_value"] = market_value
+        if holding.ppu is not None:
+            quote = latest_quote * holding.fx_rate
+            event["potential_gain"] = round(
+                (quote - holding.ppu) * holding.position, 2)
+            if holding.ppu:
+                event["potential_gain_pct"] = round(
+                    100 * (quote - holding.ppu) / holding.ppu, 2)
+        event["portfolio_market_value"] = self.total
+        if self.total:
+            event["weight"] = 100 * market_value / self.total
+        return event
+
+    async def on_notification(self, payload):
+        if not self.subscribers:
+            # Nobody to tell, and the status will be reloaded when needed
+            self.holdings = None
+            return
+        quote = json.loads(payload)
+        async with self.lock:
+            if self.holdings is None:
+                await self.load_status()
+            event = self.update(quote['isin'], quote['latest_quote'],
+                                quote['latest_quote_time'])
+        LOG.debug("Pushing %s to %d subscribers",
+                  event, len(self.subscribers))
+        for subscriber in self.subscribers:
+            subscriber.put(event)
@@ -0,0 +1,211 @@
+import datetime
+import functools
+
+import attr
+
+from dateutil import easter
+from dateutil import relativedelta
+from dateutil import tz
+
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def _nth_weekday(year, month, weekday, n):
+    """Return the nth weekday of a month, counting from the end if n < 0."""
+    if n > 0:
+        return datetime.date(year, month, 1) + relativedelta.relativedelta(
+            weekday=weekday(n))
+    return datetime.date(year, month, 1) + relativedelta.relativedelta(
+        day=31, weekday=weekday(n))
+
+
+def _observed_us(day):
+    if day.weekday() == 5:
+        return day - ONE_DAY
+    if day.weekday() == 6:
+        return day + ONE_DAY
+    return day
+
+
+def _euronext_holidays(year):
+    e = easter.easter(year)
+    return {
+        datetime.date(year, 1, 1),
+        e - 2 * ONE_DAY,  # Good Friday
+        e + ONE_DAY,  # Easter Monday
+        datetime.date(year, 5, 1),
+        datetime.date(year, 12, 25),
+        datetime.date(year, 12, 26),
+    }
+
+
+def _lse_holidays(year):
+    e = easter.easter(year)
+    holidays = {
+        e - 2 * ONE_DAY,
+        e + ONE_DAY,
+        _nth_weekday(year, 5, relativedelta.MO, 1),
+        _nth_weekday(year, 5, relativedelta.MO, -1),
+        _nth_weekday(year, 8, relativedelta.MO, -1),
+    }
+    new_year = datetime.date(year, 1, 1)
+    while new_year.weekday() >= 5:
+        new_year += ONE_DAY
+    holidays.add(new_year)
+    # Christmas and Boxing Day are moved to the next working days
+    christmas = datetime.date(year, 12, 25)
+    boxing_day = datetime.date(year, 12, 26)
+    if christmas.weekday() >= 5:
+        christmas += 2 * ONE_DAY
+    if boxing_day.weekday() >= 5:
+        boxing_day += 2 * ONE_DAY
+    holidays.update((christmas, boxing_day))
+    return holidays
+
+
+def _nyse_holidays(year):
+    holidays = {
+        _observed_us(datetime.date(year, 1, 1)),
+        _nth_weekday(year, 1, relativedelta.MO, 3),
+        _nth_weekday(year, 2, relativedelta.MO, 3),
+        easter.easter(year) - 2 * ONE_DAY,
+        _nth_weekday(year, 5, relativedelta.MO, -1),
+        _observed_us(datetime.date(year, 7, 4)),
+        _nth_weekday(year, 9, relativedelta.MO, 1),
+        _nth_weekday(year, 11, relativedelta.TH, 4),
+        _observed_us(datetime.date(year, 12, 25)),
+    }
+    if year >= 2022:
+        holidays.add(_observed_us(datetime.date(year, 6, 19)))
+    return holidays
+
+
+def _tsx_holidays(year):
+    e = easter.easter(year)
+    return {
+        _observed_us(datetime.date(year, 1, 1)),
+        _nth_weekday(year, 2, relativedelta.MO, 3),
+        e - 2 * ONE_DAY,
+        # Victoria Day, the Monday preceding May 25
+        datetime.date(year, 5, 24) + relativedelta.relativedelta(
+            weekday=relativedelta.MO(-1)),
+        _observed_us(datetime.date(year, 7, 1)),
+        _nth_weekday(year, 8, relativedelta.MO, 1),
+        _nth_weekday(year, 9, relativedelta.MO, 1),
+        _nth_weekday(year, 10, relativedelta.MO, 2),
+        _observed_us(datetime.date(year, 12, 25)),
+        _observed_us(datetime.date(year, 12, 26)),
+    }
+
+
+@attr.s(frozen=True)
+class Market(object):
+    """Trading calendar of an exchange.
+
+    Only regular sessions are known: early closes are considered full days.
+    """
+
+    mic = attr.ib()
+    timezone = attr.ib()
+    open = attr.ib()  # noqa
+    close = attr.ib()
+    get_holidays = attr.ib(repr=False)
+
+    @property
+    def tzinfo(self):
+        return tz.gettz(self.timezone)
+
+    def holidays(self, year):
+        return _cached_holidays(self.get_holidays, year)
+
+    def is_trading_day(self, day):
+        return day.weekday() < 5 and day not in self.holidays(day.year)
+
+    def trading_days(self, start, stop):
+        """Return the trading days between start and stop (included)."""
+        days = []
+        day = start
+        while day <= stop:
+            if self.is_trading_day(day):
+                days.append(day)
+            day += ONE_DAY
+        return days
+
+    def previous_trading_day(self, day):
+        """Return the last trading day before day (excluded)."""
+        day -= ONE_DAY
+        while not self.is_trading_day(day):
+            day -= ONE_DAY
+        return day
+
+    def _session(self, day):
+        tzinfo = self.tzinfo
+        return (datetime.datetime.combine(day, self.open, tzinfo),
+                datetime.datetime.combine(day, self.close, tzinfo))
+
+    def is_open(self, when):
+        """Tell whether the market is open at an aware datetime."""
+        local = when.astimezone(self.tzinfo)
+        if not self.is_trading_day(local.date()):
+            return False
+        start, end = self._session(local.date())
+        return start <= when < end
+
+    def session_end(self, when):
+        """Return the end of the session open at `when`."""
+        return self._session(when.astimezone(self.tzinfo).date())[1]
+
+    def last_close(self, when):
+        """Return the end of the last session closed at `when`."""
+        day = when.astimezone(self.tzinfo).date()
+        while True:
+            if self.is_trading_day(day):
+                _, end = self._session(day)
+                if end <= when:
+                    return end
+            day -= ONE_DAY
+
+    def next_open(self, when):
+        """Return the start of the next session, or `when` if it is open."""
+        if self.is_open(when):
+            return when
+        day = when.astimezone(self.tzinfo).date()
+        while True:
+            if self.is_trading_day(day):
+                start, _ = self._session(day)
+                if start >= when:
+                    return start
+            day += ONE_DAY
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_holidays(get_holidays, year):
+    return frozenset(get_holidays(year))
+
+
+def _market(mic, timezone, open_, close, get_holidays):
+    return Market(mic, timezone,
+                  datetime.time(*open_), datetime.time(*close),
+                  get_holidays)
+
+
+MARKETS = {m.mic: m for m in (
+    _market("XPAR", "Europe/Paris", (9, 0), (17, 30), _euronext_holidays),
+    _market("XBRU", "Europe/Brussels", (9, 0), (17, 30), _euronext_holidays),
+    _market("XAMS", "Europe/Amsterdam", (9, 0), (17, 30),
+            _euronext_holidays),
+    _market("XLON", "Europe/London", (8, 0), (16, 30), _lse_holidays),
+    _market("XNYS", "America/New_York", (9, 30), (16, 0), _nyse_holidays),
+    _market("XNAS", "America/New_York", (9, 30), (16, 0), _nyse_holidays),
+    _market("ARCX", "America/New_York", (9, 30), (16, 0), _nyse_holidays),
+    _market("XASE", "America/New_York", (9, 30), (16, 0), _nyse_holidays),
+    _market("XTSE", "America/Toronto", (9, 30), (16, 0), _tsx_holidays),
+)}
+
+
+def get_market(mic):
+    """Return the trading calendar of an exchange, if it is known."""
+    if mic is None:
+        return
+    return MARKETS.get(mic)
@@ -0,0 +1,302 @@
+"""Process metrics in the Prometheus text exposition format."""
+import bisect
+import contextvars
+import time
+
+
+# Provider the HTTP requests of the current task are made for
+PROVIDER = contextvars.ContextVar("provider", default="unknown")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\")
+            .replace("\n", "\\n").replace('"', '\\"'))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, _escape(value))
+                             for name, value in pairs)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(object):
+    type = None  # noqa
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("%s expects labels %s, got %s" % (
+                self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def get(self, **labels):  # noqa
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name, key, (), value
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s %s" % (self.name, self.type)]
+        for name, key, extra, value in self.samples():
+            lines.append("%s%s %s" % (
+                name, _format_labels(self.labelnames, key, extra),
+                _format_value(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"  # noqa
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down.
+
+    The value can also be computed at exposition time by a function
+    returning a dict of values indexed by label values.
+    """
+
+    type = "gauge"  # noqa
+
+    def __init__(self, name, documentation, labelnames=()):
+        super(Gauge, self).__init__(name, documentation, labelnames)
+        self.function = None
+
+    def set(self, value, **labels):  # noqa
+        self.values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            self.values = dict(self.function())
+        return super(Gauge, self).samples()
+
+
+class Timer(object):
+    """Observe the duration of a block.
+
+    The block is also counted in `errors` if it raises.
+    """
+
+    __slots__ = ("histogram", "labels", "errors", "started")
+
+    def __init__(self, histogram, labels, errors=None):
+        self.histogram = histogram
+        self.labels = labels
+        self.errors = errors
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.started,
+                               **self.labels)
+        if exc_type is not None and self.errors is not None:
+            self.errors.inc(**self.labels)
+
+
+class Histogram(Metric):
+    type = "histogram"  # noqa
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        if key not in self.values:
+            self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts, _, _ = state = self.values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def time(self, errors=None, **labels):  # noqa
+        """Observe the duration of a `with` block.
+
+        :param errors: A counter to increment if the block raises.
+        """
+        return Timer(self, labels, errors)
+
+    def get(self, **labels):  # noqa
+        """Return the number of observations."""
+        state = self.values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield (self.name + "_bucket", key,
+                       (("le", _format_value(bound)),), cumulative)
+            yield self.name + "_sum", key, (), total
+            yield self.name + "_count", key, (), count
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("Metric %s is already registered" % metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self._register(
+            Histogram(name, documentation, labelnames, buckets))
+
+    def expose(self):
+        """Return all metrics in the Prometheus text format."""
+        return "".join(metric.expose() + "\n"
+                       for _, metric in sorted(self.metrics.items()))
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.write(self.expose())
+
+
+REGISTRY = Registry()
+
+PROVIDER_REQUESTS = REGISTRY.counter(
+    "greenpoint_provider_requests_total",
+    "HTTP requests made to quote and broker providers.",
+    ("provider",))
+PROVIDER_REQUEST_DURATION = REGISTRY.histogram(
+    "greenpoint_provider_request_duration_seconds",
+    "Duration of HTTP requests made to providers.",
+    ("provider",))
+PROVIDER_ERRORS = REGISTRY.counter(
+    "greenpoint_provider_errors_total",
+    "Provider requests that failed or returned an error status.",
+    ("provider",))
+PROVIDER_BYTES = REGISTRY.counter(
+    "greenpoint_provider_received_bytes_total",
+    "Bytes received from providers.",
+    ("provider",))
+PROVIDER_CALL_DURATION = REGISTRY.histogram(
+    "greenpoint_provider_call_duration_seconds",
+    "Duration of a provider fetch for one instrument, all pages included.",
+    ("provider",))
+PROVIDER_CALL_ERRORS = REGISTRY.counter(
+    "greenpoint_provider_call_errors_total",
+    "Provider fetches that raised an error.",
+    ("provider",))
+
+DB_POOL_ACQUIRE_WAIT = REGISTRY.histogram(
+    "greenpoint_db_pool_acquire_wait_seconds",
+    "Time spent waiting for a database connection.",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+DB_POOL_CONNECTIONS = REGISTRY.gauge(
+    "greenpoint_db_pool_connections",
+    "Database connections of the pool, by state.",
+    ("state",))
+
+ROWS_UPSERTED = REGISTRY.counter(
+    "greenpoint_rows_upserted_total",
+    "Rows inserted or updated in the database.",
+    ("table",))
+
+CACHE_REQUESTS = REGISTRY.counter(
+    "greenpoint_cache_requests_total",
+    "Cache lookups, by result.",
+    ("cache", "result"))
+CACHE_HIT_RATIO = REGISTRY.gauge(
+    "greenpoint_cache_hit_ratio",
+    "Ratio of cache lookups that were hits.",
+    ("cache",))
+
+
+def _cache_hit_ratios():
+    caches = {key[0] for key in CACHE_REQUESTS.values}
+    for cache in caches:
+        hits = CACHE_REQUESTS.get(cache=cache, result="hit")
+        misses = CACHE_REQUESTS.get(cache=cache, result="miss")
+        yield (cache,), hits / (hits + misses)
+
+
+CACHE_HIT_RATIO.set_function(_cache_hit_ratios)
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def trace_config():
+    """Return an aiohttp client trace config recording provider metrics.
+
+    Requests are attributed to the provider set in `PROVIDER`.
+    """
+    import aiohttp
+
+    async def on_request_start(session, ctx, params):
+        ctx.provider = PROVIDER.get()
+        ctx.started = time.perf_counter()
+
+    async def on_request_end(session, ctx, params):
+        PROVIDER_REQUESTS.inc(provider=ctx.provider)
+        PROVIDER_REQUEST_DURATION.observe(time.perf_counter() - ctx.started,
+                                          provider=ctx.provider)
+        if params.response.status >= 400:
+            PROVIDER_ERRORS.inc(provider=ctx.provider)
+
+    async def on_request_exception(session, ctx, params):
+        PROVIDER_REQUESTS.inc(provider=ctx.provider)
+        PROVIDER_ERRORS.inc(provider=ctx.provider)
+
+    async def on_response_chunk_received(session, ctx, params):
+        PROVIDER_BYTES.inc(len(params.chunk), provider=ctx.provider)
+
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(on_request_start)
+    config.on_request_end.append(on_request_end)
+    config.on_request_exception.append(on_request_exception)
+    config.on_response_chunk_received.append(on_response_chunk_received)
+    return config
+
+
+def requests_hook(provider):
+    """Return a `requests` response hook recording provider metrics."""
+    def hook(response, *args, **kwargs):
+        PROVIDER_REQUESTS.inc(provider=provider)
+        PROVIDER_REQUEST_DURATION.observe(response.elapsed.total_seconds(),
+                                          provider=provider)
+        PROVIDER_BYTES.inc(len(response.content), provider=provider)
+        if response.status_code >= 400:
+            PROVIDER_ERRORS.inc(provider=provider)
+    return hook
@@ -0,0 +1,84 @@
+"""Run provider and broker parsing off the event loop.
+
+Parsing a long quote history takes long enough to stall the requests of
+every other instrument when done on the event loop. lxml releases the GIL
+while it parses, so it runs in a pool of threads. Regular expressions and
+JSON decoding hold the GIL; they can run in a pool of processes instead,
+which pays off when payloads are large and CPUs are idle.
+
+Pools are sized with the `parse_threads` and `parse_processes` options of
+the configuration file. No process pool is used by default.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import os
+
+from greenpoint import utils
+
+
+DEFAULT_THREADS = min(4, os.cpu_count() or 1)
+DEFAULT_PROCESSES = 0
+
+_THREADS = None
+_PROCESSES = None
+_SIZES = None
+
+
+def _get_sizes():
+    global _SIZES
+    if _SIZES is None:
+        try:
+            config = utils.get_config()
+        except FileNotFoundError:
+            # Providers are also used without configuration, e.g. in tests
+            config = {}
+        _SIZES = (config.get('parse_threads', DEFAULT_THREADS),
+                  config.get('parse_processes', DEFAULT_PROCESSES))
+    return _SIZES
+
+
+def configure(threads=None, processes=None):
+    """Set the size of the pools, replacing the configured ones.
+
+    :param threads: Number of parsing threads.
+    :param processes: Number of parsing processes, 0 to parse everything in
+                      threads.
+    """
+    global _SIZES
+    shutdown()
+    default_threads, default_processes = _get_sizes()
+    _SIZES = (default_threads if threads is None else threads,
+              default_processes if processes is None else processes)
+
+
+def _get_executor(cpu):
+    global _THREADS, _PROCESSES
+    threads, processes = _get_sizes()
+    if cpu and processes:
+        if _PROCESSES is None:
+            _PROCESSES = concurrent.futures.ProcessPoolExecutor(processes)
+        return _PROCESSES
+    if _THREADS is None:
+        _THREADS = concurrent.futures.ThreadPoolExecutor(
+            threads, thread_name_prefix="parse")
+    return _THREADS
+
+
+async def run(func, *args, cpu=False):
+    """Run a parsing function in a pool and return its result.
+
+    :param func: A module-level function, so it can be sent to a process.
+    :param cpu: Whether the function holds the GIL, e.g. regular expression
+                or JSON parsing, and can run in a process.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_executor(cpu), functools.partial(func, *args))
+
+
+def shutdown():
+    global _THREADS, _PROCESSES
+    for executor in (_THREADS, _PROCESSES):
+        if executor is not None:
+            executor.shutdown(wait=False)
+    _THREADS = _PROCESSES = None
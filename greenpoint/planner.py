@@ -0,0 +1,201 @@
+import datetime
+import math
+
+import attr
+
+import daiquiri
+
+from greenpoint import instrument
+from greenpoint import market
+from greenpoint import tracing
+from greenpoint import utils
+
+
+LOG = daiquiri.getLogger(__name__)
+
+ONE_DAY = datetime.timedelta(days=1)
+
+# Date used to estimate the size of a full history download
+HISTORY_START = datetime.date(2000, 1, 1)
+
+# Number of sessions in a row without quotes before an instrument is
+# considered dead
+DEFAULT_DEAD_AFTER = 5
+
+
+def _supports_boursorama(inst):
+    return len(inst.isin) == 12
+
+
+def _supports_lesechos(inst):
+    return (inst.exchange_mic is not None or
+            inst.type == instrument.InstrumentType.FUND)
+
+
+def _supports_google(inst):
+    return inst.google_symbol is not None
+
+
+def _supports_yahoo(inst):
+    return inst.yahoo_symbol is not None
+
+
+def _requests_google(days):
+    # One request per page of 200 quotes, plus the empty one ending the list
+    return math.ceil(days * 5 / 7 / 200) + 1
+
+
+# Provider name: (whether it can quote an instrument,
+#                 estimated number of requests for a number of days)
+PROVIDERS = {
+    "boursorama": (_supports_boursorama, lambda days: 2),
+    "lesechos": (_supports_lesechos, lambda days: 1),
+    "google": (_supports_google, _requests_google),
+    "yahoo": (_supports_yahoo, lambda days: 1),
+}
+
+
+@attr.s(slots=True)
+class UpdatePlan(object):
+    """What to fetch to bring one instrument up to date."""
+
+    instrument = attr.ib()
+    reason = attr.ib()
+    providers = attr.ib(default=())
+    # Fetch history from that date, or all of it if None
+    start = attr.ib(default=None)
+    live = attr.ib(default=False)
+    history = attr.ib(default=False)
+    held = attr.ib(default=False)
+    # Date of the latest session that should be quoted
+    session = attr.ib(default=None)
+
+    @property
+    def skip(self):
+        return not self.history and not self.live
+
+    def estimate_requests(self, today):
+        requests = int(self.live)
+        if self.history:
+            days = (today - (self.start or HISTORY_START)).days + 1
+            requests += sum(PROVIDERS[provider][1](days)
+                            for provider in self.providers)
+        return requests
+
+
+def _expected_last_date(mkt, now):
+    """Return the date of the last quote that should be known at `now`."""
+    if mkt is None:
+        day = now.date() - ONE_DAY
+        while day.weekday() >= 5:
+            day -= ONE_DAY
+        return day
+    return mkt.last_close(now).astimezone(mkt.tzinfo).date()
+
+
+def plan_instrument(inst, last_date, held, now, force=False):
+    """Decide what to fetch for an instrument.
+
+    :param inst: The instrument.
+    :param last_date: Date of its latest stored quote, if any.
+    :param held: Whether the instrument is held or needed for FX rates.
+    :param now: The current aware datetime.
+    :param force: Refresh the instrument even if it is dead or not held.
+    :rtype: UpdatePlan
+    """
+    if not force:
+        # Held instruments are refreshed even if they were marked dead
+        if not inst.is_alive and not held:
+            return UpdatePlan(inst, "dead")
+        if not held:
+            return UpdatePlan(inst, "not held")
+
+    providers = tuple(name for name, (supports, _) in PROVIDERS.items()
+                      if supports(inst))
+    mkt = market.get_market(inst.exchange_mic)
+
+    session = _expected_last_date(mkt, now)
+    history = bool(providers) and (last_date is None or last_date < session)
+    live = _supports_yahoo(inst) and (
+        mkt is None or
+        inst.latest_quote_time is None or
+        mkt.is_open(now) or
+        inst.latest_quote_time < mkt.last_close(now))
+
+    if history:
+        reason = "no quotes" if last_date is None else "stale"
+    elif live:
+        reason = "live quote"
+    elif not providers:
+        reason = "no provider"
+    else:
+        reason = "up to date"
+
+    return UpdatePlan(
+        instrument=inst,
+        reason=reason,
+        providers=providers if history else (),
+        start=last_date + ONE_DAY if history and last_date else None,
+        live=live,
+        history=history,
+        held=held,
+        session=session,
+    )
+
+
+async def make_plan(name=None, now=None):
+    """Plan the update of all instruments, or of the one matching `name`.
+
+    An instrument named explicitly is refreshed even if it is dead or not
+    held.
+
+    :return: A list of `UpdatePlan`.
+    """
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    query = (
+        "SELECT i.*, q.last_date, "
+        "coalesce(p.held, false) OR (i.type = 'currency' AND "
+        "length(i.isin) = 6 AND substr(i.isin, 4) = i.currency) AS held "
+        "FROM instruments i "
+        "LEFT JOIN (SELECT instrument_isin, max(date) AS last_date "
+        "FROM quotes GROUP BY instrument_isin) q "
+        "ON q.instrument_isin = i.isin "
+        "LEFT JOIN (SELECT instrument_isin, bool_or(position != 0) AS held "
+        "FROM portfolios GROUP BY instrument_isin) p "
+        "ON p.instrument_isin = i.isin"
+    )
+    cur = await utils.get_db()
+    if name is None:
+        rows = await cur.fetch(query)
+    else:
+        rows = await cur.fetch(query + " WHERE i.name ILIKE $1",
+                               "%" + name + "%")
+
+    plans = []
+    for row in rows:
+        row = dict(row)
+        last_date = row.pop('last_date')
+        held = row.pop('held')
+        plans.append(plan_instrument(instrument.Instrument(**row),
+                                     last_date, held, now,
+                                     force=name is not None))
+    return plans
+
+
+def get_dead_after():
+    return utils.get_config().get('dead_after_empty_refreshes',
+                                  DEFAULT_DEAD_AFTER)
+
+
+async def execute_plan(plan, dead_after=DEFAULT_DEAD_AFTER):
+    """Fetch what an update plan asks for."""
+    inst = plan.instrument
+    with tracing.span("update", isin=inst.isin, reason=plan.reason):
+        if plan.history:
+            found = await inst.refresh_quotes(plan.start, None,
+                                              plan.providers)
+            await inst.record_refresh(bool(found), dead_after, plan.session,
+                                      plan.held)
+        if plan.live:
+            await inst.refresh_live_quote()
@@ -1,8 +1,14 @@
+import asyncio
+import calendar
 import datetime
 import enum
+import functools
 
 import attr
 
+from greenpoint import fx
+from greenpoint import metrics
+from greenpoint import tracing
 from greenpoint import utils
 
 
@@ -30,6 +36,7 @@ class Operation(object):
 
     @staticmethod
     async def drop_save_all(portfolio_name, operations):
+        operations = list(operations)
         pool = await utils.get_db()
         async with pool.acquire() as con:
             async with con.transaction():
@@ -38,49 +45,359 @@ class Operation(object):
                     "WHERE portfolio_name = $1",
                     portfolio_name,
                 )
-                await con.executemany(
-                    "INSERT INTO operations "
-                    "(portfolio_name, instrument_isin, type, date, "
-                    "quantity, price, fees, taxes, currency) "
-                    "VALUES "
-                    "($1, $2, $3, $4, $5, $6, $7, $8, $9) ",
-                    ((portfolio_name,
-                      op.instrument_isin,
-                      op.type.name.lower(),
-                      op.date,
-                      op.quantity,
-                      op.price,
-                      op.fees,
-                      op.taxes,
-                      op.currency)
-                     for op in operations))
-
-
-async def get_status_for_broker(name, loop=None):
-    pool = await utils.get_db(loop=loop)
+                await _insert_operations(con, portfolio_name, operations)
+                await _refresh_rollup(con, portfolio_name)
+                await utils.notify_change(con, "operations", portfolio_name)
+        metrics.ROWS_UPSERTED.inc(len(operations), table="operations")
+
+    @staticmethod
+    async def save_windows(portfolio_name, windows, prefetch=2):
+        """Replace the operations of a portfolio by windows of dates.
+
+        Each window replaces the stored operations between its dates in its
+        own transaction, while the next windows are being fetched. Once all
+        windows are saved, older operations are deleted.
+
+        :param windows: An async iterable of `(start, stop, operations)`,
+                        from the most recent dates to the oldest. `stop` is
+                        None for a window with no end date.
+        :param prefetch: Number of windows fetched ahead of the writes.
+        :return: The number of operations saved.
+        """
+        queue = asyncio.Queue(prefetch)
+
+        async def produce():
+            async for window in windows:
+                await queue.put(window)
+            await queue.put(None)
+
+        producer = asyncio.ensure_future(produce())
+        saved = 0
+        oldest = None
+        pool = await utils.get_db()
+        try:
+            while True:
+                get = asyncio.ensure_future(queue.get())
+                await asyncio.wait((get, producer),
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if not get.done() and producer.exception() is not None:
+                    # No window will come after that failure
+                    get.cancel()
+                    producer.result()
+                window = await get
+                if window is None:
+                    break
+                start, stop, operations = window
+                with tracing.span("save", "db", portfolio=portfolio_name,
+                                  start=start, operations=len(operations)):
+                    async with pool.acquire() as con:
+                        async with con.transaction():
+                            await con.execute(
+                                "DELETE FROM operations "
+                                "WHERE portfolio_name = $1 AND date >= $2 "
+                                "AND ($3::date IS NULL OR date <= $3)",
+                                portfolio_name, start, stop)
+                            await _insert_operations(con, portfolio_name,
+                                                     operations)
+                            await _refresh_rollup(con, portfolio_name,
+                                                  start, stop)
+                            await utils.notify_change(
+                                con, "operations", portfolio_name)
+                metrics.ROWS_UPSERTED.inc(len(operations), table="operations")
+                saved += len(operations)
+                oldest = start
+        finally:
+            producer.cancel()
+
+        async with pool.acquire() as con:
+            async with con.transaction():
+                if oldest is None:
+                    await con.execute(
+                        "DELETE FROM operations WHERE portfolio_name = $1",
+                        portfolio_name)
+                else:
+                    await con.execute(
+                        "DELETE FROM operations "
+                        "WHERE portfolio_name = $1 AND date < $2",
+                        portfolio_name, oldest)
+                await _refresh_rollup(con, portfolio_name, None, oldest)
+                await utils.notify_change(con, "operations", portfolio_name)
+        return saved
+
+
+async def _insert_operations(con, portfolio_name, operations):
+    await con.executemany(
+        "INSERT INTO operations "
+        "(portfolio_name, instrument_isin, type, date, "
+        "quantity, price, fees, taxes, currency) "
+        "VALUES "
+        "($1, $2, $3, $4, $5, $6, $7, $8, $9) ",
+        ((portfolio_name,
+          op.instrument_isin,
+          op.type.name.lower(),
+          op.date,
+          op.quantity,
+          op.price,
+          op.fees,
+          op.taxes,
+          op.currency)
+         for op in operations))
+
+
+async def _refresh_rollup(con, portfolio_name, start=None, stop=None):
+    """Recompute the rollup of the months of a portfolio between two dates.
+
+    :param start: A date of the first month, None for all months before.
+    :param stop: A date of the last month, None for all months after.
+    """
+    first = datetime.date.min if start is None else start.replace(day=1)
+    if stop is None:
+        last = datetime.date.max
+    else:
+        last = stop.replace(
+            day=calendar.monthrange(stop.year, stop.month)[1])
+    await con.execute(
+        "DELETE FROM operations_rollup WHERE portfolio_name = $1 "
+        "AND year * 100 + month BETWEEN $2 AND $3",
+        portfolio_name,
+        first.year * 100 + first.month, last.year * 100 + last.month)
+    await con.execute(
+        "INSERT INTO operations_rollup "
+        "(portfolio_name, instrument_isin, year, month, currency, "
+        "dividends, fees, taxes, operations) "
+        "SELECT portfolio_name, instrument_isin, "
+        "date_part('year', date)::integer, date_part('month', date)::integer, "
+        "currency, "
+        "sum(CASE WHEN type = 'dividend' THEN quantity * price ELSE 0 END), "
+        "sum(fees), sum(taxes), count(*) "
+        "FROM operations "
+        "WHERE portfolio_name = $1 AND date BETWEEN $2 AND $3 "
+        "GROUP BY 1, 2, 3, 4, 5",
+        portfolio_name, first, last)
+
+
+async def get_income(portfolio_name=None, year=None, monthly=False):
+    """Get the dividends, fees and taxes of operations by year.
+
+    They are read from the rollup kept up to date when operations are saved,
+    in the currency of the operations.
+
+    :param portfolio_name: Only get the income of this portfolio.
+    :param year: Only get the income of this year.
+    :param monthly: Whether to get the income by month rather than by year.
+    """
+    period = "year, month" if monthly else "year"
+    pool = await utils.get_db()
     return await pool.fetch(
-        "select * from portfolios "
+        "SELECT portfolio_name, " + period + ", instrument_isin, name, "
+        "operations_rollup.currency, "
+        "sum(dividends) AS dividends, sum(fees) AS fees, "
+        "sum(taxes) AS taxes, sum(operations) AS operations "
+        "FROM operations_rollup "
         "JOIN instruments ON instrument_isin = isin "
-        "where position != 0 and portfolio_name = $1;",
-        name)
+        "WHERE ($1::text IS NULL OR portfolio_name = $1) "
+        "AND ($2::integer IS NULL OR year = $2) "
+        "GROUP BY portfolio_name, " + period + ", instrument_isin, name, "
+        "operations_rollup.currency "
+        "ORDER BY portfolio_name, " + period + ", instrument_isin",
+        portfolio_name, year)
 
 
-async def get_status_for_all(loop=None):
-    pool = await utils.get_db(loop=loop)
-    return await pool.fetch(
-        "select *, "
-        "position * latest_quote as market_value, "
-        "(100 * position * latest_quote) / sum(position * latest_quote) over () as weight, "
-        "round(((latest_quote - ppu) * position)::numeric, 2) as potential_gain, "
-        "round((100 * (latest_quote - ppu) / ppu)::numeric, 2) as potential_gain_pct "
+# Columns computed from the aggregated positions, in the reporting currency
+STATUS_COLUMNS = (
+    ("weight", "100 * market_value / sum(market_value) over ()"),
+    ("potential_gain",
+     "round(((latest_quote * fx_rate - ppu) * position)::numeric, 2)"),
+    ("potential_gain_pct",
+     "round((100 * (latest_quote * fx_rate - ppu) / ppu)::numeric, 2)"),
+)
+
+# Filters on the positions, by attribute of `StatusQuery`
+_STATUS_FILTERS = (
+    ("portfolio_name", "portfolio_name = $%d::text"),
+)
+
+# Filters on the instruments, by attribute of `StatusQuery`
+_STATUS_INSTRUMENT_FILTERS = (
+    ("instrument_type", "type = $%d::instrument_type"),
+    ("currency", "currency = $%d::text"),
+    ("pea", "pea = $%d::boolean"),
+)
+
+
+@functools.lru_cache(maxsize=64)
+def _build_status_query(filters):
+    """Build the status query using a set of filters.
+
+    The query text only depends on the filters used, not on their values,
+    so that each variant is prepared once per connection and gets a plan
+    of its own, rather than one plan for all the filter combinations.
+
+    :param filters: Names of the filters used.
+    :return: The query and the names of its arguments, after the reporting
+             currency.
+    """
+    names = []
+    conditions = []
+    for name, condition in _STATUS_FILTERS:
+        if name in filters:
+            names.append(name)
+            conditions.append(condition % (len(names) + 1))
+    instrument_conditions = []
+    for name, condition in _STATUS_INSTRUMENT_FILTERS:
+        if name in filters:
+            names.append(name)
+            instrument_conditions.append(condition % (len(names) + 1))
+    if instrument_conditions:
+        conditions.append(
+            "instrument_isin in (select isin from instruments where " +
+            " and ".join(instrument_conditions) + ")")
+    return (
+        "with rates as ("
+        "  select base as currency, rate from fx_latest_rates "
+        "  where quote = $1::text "
+        "  union all "
+        "  select $1::text, 1.0 "
+        "), zeroed as ("
+        "  select portfolio_name, instrument_isin, max(date) as zeroed_at "
+        "  from portfolios_history "
+        "  where " + " and ".join(["position = 0"] + conditions) + " "
+        "  group by portfolio_name, instrument_isin "
+        # Period during which each rate is the latest known
+        "), trade_rates as ("
+        "  select base, rate, date as valid_from, "
+        "         lead(date) over (partition by base order by date) "
+        "           as valid_until "
+        "  from fx_rates "
+        "  where quote = $1::text "
+        # Trades of the current ownership partition, each one with the rate
+        # of its date. Trades of the day a position is closed are sorted
+        # before it, so they belong to the previous partition.
+        "), trades as ("
+        "  select portfolio_name, instrument_isin, quantity, "
+        "         greatest(0, quantity * price - fees - taxes) as spent, "
+        "         case when currency = $1::text then 1.0 else rate end "
+        "           as rate "
+        "  from operations "
+        "  left join zeroed using (portfolio_name, instrument_isin) "
+        "  left join trade_rates on base = currency "
+        "    and operations.date >= valid_from "
+        "    and (valid_until is null or operations.date < valid_until) "
+        "  where " + " and ".join(
+            ["type = 'trade'",
+             "(zeroed_at is null or operations.date > zeroed_at)"] +
+            conditions) + " "
+        # No cost if the rate of a purchase is unknown
+        "), costs as ("
+        "  select portfolio_name, instrument_isin, "
+        "         case when count(case when quantity > 0 then 1 end) "
+        "                   = count(case when quantity > 0 then rate end) "
+        "         then sum(spent * rate) "
+        "              / nullif(sum(greatest(0, quantity)), 0) "
+        "         end as converted_ppu "
+        "  from trades "
+        "  group by portfolio_name, instrument_isin "
+        ") "
+        "select *, " +
+        ", ".join("%s as %s" % (expression, name)
+                  for name, expression in STATUS_COLUMNS) + " "
         "from ("
-        "  select instrument_isin, "
-        "         sum(position) as position, "
-        "         sum(ppu * position) / sum(position) as ppu, "
-        "         max(date) as latest_trade "
-        "  from portfolios "
-        "  where position != 0 "
-        "  group by instrument_isin "
-        ") as aggregated "
-        "join instruments on aggregated.instrument_isin = isin"
-    )
+        "  select aggregated.*, instruments.*, "
+        "         quote_rates.rate as fx_rate, "
+        "         position * latest_quote * quote_rates.rate as market_value "
+        "  from ("
+        "    select instrument_isin, "
+        "           sum(position) as position, "
+        "           case when count(converted_ppu) = count(*) "
+        "           then sum(converted_ppu * position) / sum(position) "
+        "           end as ppu, "
+        "           max(date) as latest_trade "
+        "    from portfolios "
+        "    left join costs using (portfolio_name, instrument_isin) "
+        "    where " + " and ".join(["position != 0"] + conditions) + " "
+        "    group by instrument_isin "
+        "  ) as aggregated "
+        "  join instruments on aggregated.instrument_isin = isin "
+        "  left join rates as quote_rates "
+        "    on quote_rates.currency = instruments.currency"
+        ") as converted "
+        "order by instrument_isin"
+    ), tuple(names)
+
+
+@attr.s(frozen=True)
+class StatusQuery(object):
+    """Status of the current positions, aggregated by instrument.
+
+    Cost, market value and gains are expressed in the reporting currency:
+    each trade is converted with the FX rate of its date, market values
+    with the latest known rates. The weight of a position is its share of
+    the positions selected by the filters. Filters left to `None` are not
+    applied.
+    """
+
+    portfolio_name = attr.ib(default=None)
+    # `InstrumentType` value
+    instrument_type = attr.ib(default=None)
+    # Currency of the instruments
+    currency = attr.ib(default=None,
+                       converter=attr.converters.optional(str.upper))
+    pea = attr.ib(default=None)
+    reporting_currency = attr.ib(
+        default=None, converter=attr.converters.optional(str.upper))
+
+    @property
+    def filters(self):
+        return frozenset(
+            name for name, _ in _STATUS_FILTERS + _STATUS_INSTRUMENT_FILTERS
+            if getattr(self, name) is not None)
+
+    def build(self):
+        """Return the query and its arguments."""
+        query, names = _build_status_query(self.filters)
+        reporting_currency = self.reporting_currency
+        if reporting_currency is None:
+            reporting_currency = fx.get_reporting_currency()
+        return query, (reporting_currency,) + tuple(
+            getattr(self, name) for name in names)
+
+    async def fetch(self, con=None, loop=None):
+        """Run the query.
+
+        The statement is prepared once per connection, by the statement
+        cache of the connection, keyed by the query text and so by the
+        filters used. Statements from `Connection.prepare` would not do:
+        asyncpg invalidates them when the connection goes back to the pool
+        and parses them again on each call.
+
+        :param con: The connection to use, one of the pool by default.
+        """
+        query, args = self.build()
+        if con is None:
+            con = await utils.get_db(loop=loop)
+        return await con.fetch(query, *args)
+
+
+async def get_status(loop=None, **filters):
+    """Get the status of the current positions.
+
+    :param filters: Attributes of `StatusQuery`.
+    """
+    return await StatusQuery(**filters).fetch(loop=loop)
+
+
+async def get_status_for_broker(name, loop=None, currency=None):
+    """Get the status of a portfolio, see `StatusQuery`.
+
+    :param currency: The reporting currency, defaults to the configured one.
+    """
+    return await get_status(loop=loop, portfolio_name=name,
+                            reporting_currency=currency)
+
+
+async def get_status_for_all(loop=None, currency=None):
+    """Get the aggregated status of all portfolios, see `StatusQuery`.
+
+    :param currency: The reporting currency, defaults to the configured one.
+    """
+    return await get_status(loop=loop, reporting_currency=currency)
@@ -0,0 +1,159 @@
+import numpy
+
+from greenpoint import instrument
+from greenpoint import utils
+
+
+FREQUENCIES = ("week", "month")
+
+# Upper bound of points returned for a chart, whatever the history length
+MAX_POINTS = 2000
+# Fewest points downsampling can keep: the first, the last and one between
+MIN_POINTS = 3
+
+
+def _buckets(dates, freq):
+    if freq == "week":
+        # datetime64 weeks start on Thursday, align them on Monday instead
+        days = dates.astype("datetime64[D]").astype(numpy.int64)
+        return (days - (days + 3) % 7).astype("datetime64[D]")
+    if freq == "month":
+        return dates.astype("datetime64[M]").astype("datetime64[D]")
+    raise ValueError("Unknown frequency `%s'" % freq)
+
+
+def resample(quotes, freq):
+    """Aggregate daily quotes into OHLC bars.
+
+    Each bar is dated with the first day of its week or month, as
+    PostgreSQL's `date_trunc` does.
+
+    :param quotes: The quotes to resample.
+    :type quotes: `instrument.QuoteColumns`
+    :param freq: `week` or `month`.
+    """
+    if not len(quotes):
+        return quotes
+    buckets = _buckets(quotes.date, freq)
+    starts = numpy.concatenate(
+        ([0], numpy.flatnonzero(buckets[1:] != buckets[:-1]) + 1))
+    ends = numpy.append(starts[1:], len(buckets)) - 1
+    return instrument.QuoteColumns(
+        date=buckets[starts],
+        open=quotes.open[starts],
+        close=quotes.close[ends],
+        high=numpy.fmax.reduceat(quotes.high, starts),
+        low=numpy.fmin.reduceat(quotes.low, starts),
+        volume=numpy.add.reduceat(numpy.nan_to_num(quotes.volume), starts),
+    )
+
+
+async def resample_sql(isin, freq, start=None, stop=None):
+    """Aggregate daily quotes into OHLC bars in the database."""
+    if freq not in FREQUENCIES:
+        raise ValueError("Unknown frequency `%s'" % freq)
+    cur = await utils.get_db()
+    rows = await cur.fetch(
+        "SELECT date_trunc($2, date)::date AS date, "
+        "(array_agg(open ORDER BY date))[1]::float8 AS open, "
+        "(array_agg(close ORDER BY date DESC))[1]::float8 AS close, "
+        "max(high)::float8 AS high, "
+        "min(low)::float8 AS low, "
+        "sum(volume)::float8 AS volume "
+        "FROM quotes "
+        "WHERE instrument_isin = $1 "
+        "AND ($3::date IS NULL OR date >= $3) "
+        "AND ($4::date IS NULL OR date <= $4) "
+        "GROUP BY 1 ORDER BY 1",
+        isin, freq, start, stop)
+    return instrument.QuoteColumns.from_lists(
+        [row['date'] for row in rows],
+        **{k: [row[k] for row in rows]
+           for k in instrument.QuoteColumns.VALUES})
+
+
+def lttb(x, y, threshold):
+    """Select points with the Largest-Triangle-Three-Buckets algorithm.
+
+    :param x: The abscissa of the points, sorted.
+    :param y: The ordinate of the points.
+    :param threshold: The number of points to keep.
+    :return: The indices of the points to keep.
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return numpy.arange(length)
+
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    # The first and last points are always kept, the others are split in
+    # buckets of `every` points each
+    every = (length - 2) / (threshold - 2)
+    selected = numpy.empty(threshold, dtype=numpy.int64)
+    selected[0] = 0
+    selected[-1] = length - 1
+    a = 0
+    for i in range(threshold - 2):
+        begin = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, length)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = numpy.abs(
+            (x[a] - avg_x) * (y[begin:end] - y[a]) -
+            (x[a] - x[begin:end]) * (avg_y - y[a]))
+        a = begin + int(numpy.argmax(numpy.nan_to_num(areas, nan=-1)))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(quotes, points):
+    """Reduce quotes to at most `points` rows, keeping the shape of closes."""
+    if len(quotes) <= points:
+        return quotes
+    close = quotes.close
+    # Carry the last known close over gaps so they do not weigh in areas
+    known = numpy.where(numpy.isnan(close), 0, numpy.arange(len(close)))
+    close = close[numpy.maximum.accumulate(known)]
+    idx = lttb(quotes.date.astype(numpy.int64), close, points)
+    return instrument.QuoteColumns(
+        date=quotes.date[idx],
+        **{k: getattr(quotes, k)[idx]
+           for k in instrument.QuoteColumns.VALUES})
+
+
+async def get_chart(isin, start=None, stop=None, freq=None, points=None):
+    """Get quotes of an instrument ready to be charted.
+
+    Cached histories are resampled in memory; otherwise bars are computed
+    by the database so that only the aggregated rows are transferred.
+
+    :param freq: Optional `week` or `month` aggregation.
+    :param points: Maximum number of rows to return, between `MIN_POINTS`
+                   and `MAX_POINTS`.
+    """
+    if points is None:
+        points = MAX_POINTS
+    points = max(MIN_POINTS, min(points, MAX_POINTS))
+    quotes = instrument.QUOTES_CACHE.get(isin)
+    if quotes is not None:
+        quotes = quotes.slice(start, stop)
+        if freq is not None:
+            quotes = resample(quotes, freq)
+    elif freq is not None:
+        quotes = await resample_sql(isin, freq, start, stop)
+    else:
+        quotes = await instrument.Instrument.get_quotes_bulk(
+            [isin], start, stop)
+        quotes = quotes[isin]
+    return downsample(quotes, points)
+
+
+def to_primitive(quotes):
+    """Convert quotes columns to lists, with None for unknown values."""
+    result = {"date": numpy.datetime_as_string(quotes.date).tolist()}
+    for k in instrument.QuoteColumns.VALUES:
+        values = getattr(quotes, k)
+        result[k] = numpy.where(
+            numpy.isnan(values), None, values).tolist()
+    return result
@@ -0,0 +1,213 @@
+"""Volatility, correlations and risk contributions of the holdings.
+
+Daily returns of the current positions are computed from the closes of
+`Instrument.get_quotes_bulk`, aligned on the same dates. The covariance of
+a window of returns is kept as running sums per set of instruments and
+window length: when the window moves by a few days, the returns of the new
+days are added and the returns of the days out of the window removed,
+rather than going over the whole window again.
+
+Returns are in the currency of each instrument; holdings are weighted by
+their market value in the reporting currency.
+"""
+import attr
+
+import cachetools
+
+import numpy
+
+from greenpoint import instrument
+from greenpoint import portfolio
+
+
+DEFAULT_WINDOW = 250
+TRADING_DAYS_PER_YEAR = 252
+
+
+def align_returns(quotes, isins, window=DEFAULT_WINDOW):
+    """Compute the daily returns of instruments on the same dates.
+
+    A close missing on a date, e.g. on a holiday of the exchange, is the
+    previous one. Only dates where all instruments have a close are kept.
+
+    :param quotes: `QuoteColumns` indexed by ISIN.
+    :param isins: The instruments, in the order of the columns.
+    :param window: The number of returns to keep, the latest ones.
+    :return: The dates and a matrix of returns with a row per date.
+    """
+    closes = []
+    for isin in isins:
+        q = quotes[isin]
+        known = ~numpy.isnan(q.close)
+        closes.append((q.date[known], q.close[known]))
+    dates = numpy.unique(numpy.concatenate(
+        [d for d, _ in closes] or [numpy.array([], dtype="datetime64[D]")]))
+    prices = numpy.full((len(dates), len(isins)), numpy.nan)
+    for j, (d, close) in enumerate(closes):
+        prices[numpy.searchsorted(dates, d), j] = close
+    # Index of the last known close of each cell
+    rows = numpy.where(numpy.isnan(prices), 0,
+                       numpy.arange(len(dates))[:, numpy.newaxis])
+    numpy.maximum.accumulate(rows, axis=0, out=rows)
+    prices = prices[rows, numpy.arange(len(isins))]
+    complete = numpy.flatnonzero(~numpy.isnan(prices).any(axis=1))
+    start = complete[0] if len(complete) else len(dates)
+    prices = prices[start:]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        returns = prices[1:] / prices[:-1] - 1
+    return dates[start + 1:][-window:], returns[-window:]
+
+
+class Covariance(object):
+    """Covariance of a window of returns, from running sums."""
+
+    def __init__(self, dates, returns):
+        self.dates = dates
+        self.returns = returns
+        self.sum = returns.sum(axis=0)
+        self.products = returns.T @ returns
+        self._matrix = None
+
+    def update(self, dates, returns):
+        """Move the window to new dates.
+
+        Only possible when the new window starts within the current one and
+        the returns they share are unchanged.
+
+        :return: Whether the window was moved.
+        """
+        if not len(dates):
+            return False
+        removed = numpy.searchsorted(self.dates, dates[0])
+        shared = len(self.dates) - removed
+        # Past half the window, starting over costs less
+        if (removed >= len(self.dates) or removed > len(dates) // 2 or
+                shared > len(dates) or
+                not numpy.array_equal(self.dates[removed:], dates[:shared]) or
+                not numpy.array_equal(self.returns[removed:],
+                                      returns[:shared])):
+            return False
+        old, new = self.returns[:removed], returns[shared:]
+        if len(old) or len(new):
+            # Add the new days and remove the old ones in one product
+            self.sum += new.sum(axis=0) - old.sum(axis=0)
+            self.products += (numpy.concatenate((new, old)).T @
+                              numpy.concatenate((new, -old)))
+            self._matrix = None
+        self.dates = dates
+        self.returns = returns
+        return True
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            n = len(self.returns)
+            self._matrix = (
+                (self.products - numpy.outer(self.sum, self.sum) / n) /
+                (n - 1))
+        return self._matrix
+
+
+# Covariances by instruments and window length
+COVARIANCES = cachetools.LRUCache(maxsize=16)
+
+
+def get_covariance(dates, returns, isins, window=DEFAULT_WINDOW):
+    """Get the covariance matrix of returns, from the cache if possible."""
+    key = tuple(isins), window
+    cov = COVARIANCES.get(key)
+    if cov is None or not cov.update(dates, returns):
+        cov = COVARIANCES[key] = Covariance(dates, returns)
+    return cov.matrix
+
+
+@attr.s(slots=True, frozen=True)
+class Risk(object):
+    isins = attr.ib()
+    names = attr.ib()
+    # First and last dates of the returns
+    start = attr.ib()
+    stop = attr.ib()
+    weights = attr.ib()
+    covariance = attr.ib()
+
+    @property
+    def volatilities(self):
+        """Annualized volatility of each holding."""
+        return numpy.sqrt(numpy.diag(self.covariance) *
+                          TRADING_DAYS_PER_YEAR)
+
+    @property
+    def correlation(self):
+        std = numpy.sqrt(numpy.diag(self.covariance))
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return self.covariance / numpy.outer(std, std)
+
+    @property
+    def volatility(self):
+        """Annualized volatility of the portfolio."""
+        return float(numpy.sqrt(
+            self.weights @ self.covariance @ self.weights *
+            TRADING_DAYS_PER_YEAR))
+
+    @property
+    def contributions(self):
+        """Share of the portfolio variance due to each holding."""
+        marginal = self.covariance @ self.weights
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return self.weights * marginal / (self.weights @ marginal)
+
+    def to_primitive(self):
+        def _list(values):
+            values = values.astype(object)
+            values[numpy.isnan(values.astype(float))] = None
+            return values.tolist()
+
+        return {
+            "start": self.start,
+            "stop": self.stop,
+            "volatility": self.volatility,
+            "holdings": [
+                {"instrument_isin": isin, "name": name, "weight": weight,
+                 "volatility": volatility, "contribution": contribution}
+                for isin, name, weight, volatility, contribution in zip(
+                    self.isins, self.names, _list(self.weights),
+                    _list(self.volatilities), _list(self.contributions))
+            ],
+            "correlation": _list(self.correlation),
+        }
+
+
+async def get_risk(window=DEFAULT_WINDOW, currency=None):
+    """Compute the risk of the current positions of all portfolios.
+
+    Holdings without quotes or market value are left out.
+
+    :param window: Number of daily returns to use.
+    :param currency: The reporting currency, defaults to the configured one.
+    :rtype: Risk
+    """
+    status = [row for row in await portfolio.get_status(
+        reporting_currency=currency) if row['market_value']]
+    quotes = await instrument.Instrument.get_quotes_bulk(
+        [row['instrument_isin'] for row in status])
+    status = [row for row in status
+              if numpy.count_nonzero(
+                  ~numpy.isnan(quotes[row['instrument_isin']].close)) > 1]
+    isins = [row['instrument_isin'] for row in status]
+    dates, returns = align_returns(quotes, isins, window)
+    weights = numpy.array([float(row['market_value']) for row in status])
+    if len(weights):
+        weights /= weights.sum()
+    if len(dates) < 2:
+        covariance = numpy.full((len(isins), len(isins)), numpy.nan)
+    else:
+        covariance = get_covariance(dates, returns, isins, window)
+    return Risk(
+        isins=isins,
+        names=[row['name'] for row in status],
+        start=dates[0].item() if len(dates) else None,
+        stop=dates[-1].item() if len(dates) else None,
+        weights=weights,
+        covariance=covariance,
+    )
@@ -0,0 +1,441 @@
+"""SQLite storage for single-user deployments and tests.
+
+`utils.get_db` returns a pool of this module when the `database` URL of the
+configuration starts with `sqlite://`, e.g. `sqlite:///greenpoint.db` for a
+file relative to the current directory or `sqlite:////var/lib/greenpoint.db`
+for an absolute path. `sqlite://` alone is an in-memory database.
+
+The pool and its connections behave like their asyncpg counterparts for
+what greenpoint uses: queries are written for PostgreSQL and translated,
+notifications are delivered to the listeners of the same process on commit,
+and the schema of `data/sqlite.sql` is created on first use. Queries built
+on PostgreSQL-only functions, like `array_agg` or `date_trunc`, still need
+PostgreSQL.
+
+Each connection runs its queries in a thread of the pool. The database is
+in WAL mode so readers do not block the writer, and `executemany` writes all
+its rows in one transaction.
+"""
+import asyncio
+import concurrent.futures
+import datetime
+import decimal
+import functools
+import json
+import os
+import re
+import sqlite3
+
+from greenpoint import tracing
+
+
+SCHEMA = os.path.join(os.path.dirname(__file__), "data", "sqlite.sql")
+MEMORY = ":memory:"
+
+# Seconds to wait for the lock of another writer
+BUSY_TIMEOUT = 30
+
+sqlite3.register_adapter(datetime.date, datetime.date.isoformat)
+sqlite3.register_adapter(datetime.datetime, datetime.datetime.isoformat)
+sqlite3.register_adapter(decimal.Decimal, float)
+# Arrays are passed as JSON, see `_translate`
+sqlite3.register_adapter(list, json.dumps)
+sqlite3.register_adapter(tuple, json.dumps)
+
+sqlite3.register_converter(
+    "date", lambda value: datetime.date.fromisoformat(value.decode()))
+sqlite3.register_converter(
+    "timestamp", lambda value: datetime.datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("boolean", lambda value: value != b"0")
+
+
+_TRANSLATIONS = (
+    (re.compile(r"\$(\d+)"), r"?\1"),
+    (re.compile(r"::\w+(\[\])?"), ""),
+    (re.compile(r"\bILIKE\b", re.IGNORECASE), "LIKE"),
+    (re.compile(r"=\s*any\s*\((\?\d+)\)", re.IGNORECASE),
+     r"IN (SELECT value FROM json_each(\1))"),
+    # fx_rates is a plain view, always up to date
+    (re.compile(r"^\s*REFRESH MATERIALIZED VIEW\s+\w+\s*$", re.IGNORECASE),
+     "SELECT NULL"),
+)
+
+
+@functools.lru_cache(maxsize=1024)
+def _translate(query):
+    """Translate a PostgreSQL query for SQLite."""
+    for pattern, replacement in _TRANSLATIONS:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+# Dates computed by an expression, e.g. `max(date)`, have no declared type
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def _convert(value):
+    if isinstance(value, str) and _DATE_RE.match(value):
+        return datetime.date.fromisoformat(value)
+    return value
+
+
+class Record(object):
+    """A row accessible by index or column name, like an asyncpg record."""
+
+    __slots__ = ("_names", "_values")
+
+    def __init__(self, names, values):
+        self._names = names
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._names[key]]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return "<Record %s>" % " ".join(
+            "%s=%r" % item for item in self.items())
+
+    def get(self, key, default=None):  # noqa
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return iter(self._names)
+
+    def values(self):
+        return iter(self._values)
+
+    def items(self):
+        return ((name, self._values[i]) for name, i in self._names.items())
+
+
+def _records(cursor):
+    if cursor.description is None:
+        return []
+    names = {}
+    for i, column in enumerate(cursor.description):
+        # Like asyncpg, the first of duplicate columns wins
+        names.setdefault(column[0], i)
+    return [Record(names, tuple(_convert(value) for value in row))
+            for row in cursor.fetchall()]
+
+
+def _status(query, cursor):
+    verb = query.split(None, 1)[0].upper()
+    if verb == "INSERT":
+        return "INSERT 0 %d" % cursor.rowcount
+    if verb in ("UPDATE", "DELETE"):
+        return "%s %d" % (verb, cursor.rowcount)
+    return verb
+
+
+class _BoolOr(object):
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        if value is not None:
+            self.value = bool(self.value) or bool(value)
+
+    def finalize(self):
+        return self.value
+
+
+def _greatest(*values):
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def _least(*values):
+    values = [v for v in values if v is not None]
+    return min(values) if values else None
+
+
+_DATE_PARTS = {"year": slice(0, 4), "month": slice(5, 7), "day": slice(8, 10)}
+
+
+def _date_part(field, value):
+    # Dates are stored in ISO 8601
+    if value is None:
+        return None
+    return int(value[_DATE_PARTS[field.lower()]])
+
+
+class _Transaction(object):
+    __slots__ = ("connection", "savepoint", "notifications")
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def __aenter__(self):
+        con = self.connection
+        self.notifications = len(con._notifications)
+        con._depth += 1
+        self.savepoint = "greenpoint_%d" % con._depth
+        if con._depth == 1:
+            await con._run(con._con.execute, "BEGIN IMMEDIATE")
+        else:
+            await con._run(con._con.execute, "SAVEPOINT " + self.savepoint)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        con = self.connection
+        con._depth -= 1
+        if exc_type is None:
+            if con._depth == 0:
+                await con._run(con._con.execute, "COMMIT")
+                con._flush()
+            else:
+                await con._run(con._con.execute,
+                               "RELEASE " + self.savepoint)
+        else:
+            del con._notifications[self.notifications:]
+            if con._depth == 0:
+                await con._run(con._con.execute, "ROLLBACK")
+            else:
+                await con._run(con._con.execute,
+                               "ROLLBACK TO " + self.savepoint)
+                await con._run(con._con.execute,
+                               "RELEASE " + self.savepoint)
+
+
+class Connection(object):
+    """A connection of a `Pool`, used by one task at a time."""
+
+    def __init__(self, pool, con):
+        self._pool = pool
+        self._con = con
+        self._depth = 0
+        self._notifications = []
+        con.create_function("pg_notify", 2, self._notify)
+        con.create_function("greatest", -1, _greatest)
+        con.create_function("least", -1, _least)
+        con.create_function("date_part", 2, _date_part, deterministic=True)
+        con.create_aggregate("bool_or", 1, _BoolOr)
+
+    def _notify(self, channel, payload):
+        # Called from the thread running the query
+        self._notifications.append((channel, payload))
+
+    def _flush(self):
+        notifications, self._notifications = self._notifications, []
+        for channel, payload in notifications:
+            self._pool._dispatch(channel, payload)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._pool.executor, functools.partial(func, *args))
+
+    async def _query(self, func, query, *args):
+        with tracing.span("db", "db", query=query):
+            result = await self._run(func, _translate(query), *args)
+        if self._depth == 0:
+            self._flush()
+        return result
+
+    def _execute(self, query, args):
+        cursor = self._con.execute(query, args)
+        try:
+            return _status(query, cursor), _records(cursor)
+        finally:
+            cursor.close()
+
+    def _executemany(self, query, args):
+        if self._depth:
+            self._con.executemany(query, args)
+            return
+        # One transaction for all the rows rather than one per row
+        self._con.execute("BEGIN IMMEDIATE")
+        with self._con:
+            self._con.executemany(query, args)
+
+    async def execute(self, query, *args, timeout=None):
+        status, _ = await self._query(self._execute, query, args)
+        return status
+
+    async def executemany(self, command, args, *, timeout=None):
+        await self._query(self._executemany, command, args)
+
+    async def fetch(self, query, *args, timeout=None):
+        _, records = await self._query(self._execute, query, args)
+        return records
+
+    async def fetchrow(self, query, *args, timeout=None):
+        records = await self.fetch(query, *args)
+        return records[0] if records else None
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        row = await self.fetchrow(query, *args)
+        return None if row is None else row[column]
+
+    async def copy_records_to_table(self, table_name, *, records,
+                                    columns=None, timeout=None):
+        if columns is None:
+            raise ValueError("columns are required with SQLite")
+        await self.executemany(
+            "INSERT INTO %s (%s) VALUES (%s)" % (
+                table_name, ", ".join(columns),
+                ", ".join("$%d" % (i + 1) for i in range(len(columns)))),
+            records)
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def is_in_transaction(self):
+        return self._depth > 0
+
+    async def add_listener(self, channel, callback):
+        self._pool._listeners.setdefault(channel, []).append(
+            (self, callback))
+
+    async def remove_listener(self, channel, callback):
+        self._pool._listeners.get(channel, []).remove((self, callback))
+
+    async def executescript(self, script):
+        await self._run(self._con.executescript, script)
+
+
+class _PoolAcquireContext(object):
+    __slots__ = ("pool", "timeout", "connection")
+
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.connection = None
+
+    def __await__(self):
+        return self.pool._acquire(self.timeout).__await__()
+
+    async def __aenter__(self):
+        self.connection = await self.pool._acquire(self.timeout)
+        return self.connection
+
+    async def __aexit__(self, *exc_info):
+        await self.pool.release(self.connection)
+
+
+class Pool(object):
+    def __init__(self, path, max_size):
+        self.path = path
+        if path == MEMORY:
+            # Each connection would have its own in-memory database
+            max_size = 1
+        self.max_size = max_size
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_size, thread_name_prefix="sqlite")
+        self._semaphore = asyncio.Semaphore(max_size)
+        self._idle = []
+        self._size = 0
+        self._listeners = {}
+
+    def _connect(self):
+        con = sqlite3.connect(
+            self.path, timeout=BUSY_TIMEOUT,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None, check_same_thread=False)
+        if self.path != MEMORY:
+            con.execute("PRAGMA journal_mode = WAL")
+        # WAL is consistent without syncing on each commit
+        con.execute("PRAGMA synchronous = NORMAL")
+        con.execute("PRAGMA foreign_keys = ON")
+        return con
+
+    async def _acquire(self, timeout=None):
+        if timeout is None:
+            await self._semaphore.acquire()
+        else:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        if self._idle:
+            return self._idle.pop()
+        con = None
+        try:
+            con = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._connect)
+        finally:
+            if con is None:
+                self._semaphore.release()
+        self._size += 1
+        return Connection(self, con)
+
+    def acquire(self, *, timeout=None):
+        return _PoolAcquireContext(self, timeout)
+
+    async def release(self, connection, *, timeout=None):
+        if connection._depth:
+            await connection._run(connection._con.execute, "ROLLBACK")
+            connection._depth = 0
+            connection._notifications = []
+        for listeners in self._listeners.values():
+            listeners[:] = [(con, callback) for con, callback in listeners
+                            if con is not connection]
+        self._idle.append(connection)
+        self._semaphore.release()
+
+    def _dispatch(self, channel, payload):
+        for connection, callback in list(self._listeners.get(channel, ())):
+            asyncio.get_running_loop().call_soon(
+                callback, connection, os.getpid(), channel, payload)
+
+    async def execute(self, query, *args, timeout=None):
+        async with self.acquire() as con:
+            return await con.execute(query, *args)
+
+    async def executemany(self, command, args, *, timeout=None):
+        async with self.acquire() as con:
+            return await con.executemany(command, args)
+
+    async def fetch(self, query, *args, timeout=None):
+        async with self.acquire() as con:
+            return await con.fetch(query, *args)
+
+    async def fetchrow(self, query, *args, timeout=None):
+        async with self.acquire() as con:
+            return await con.fetchrow(query, *args)
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        async with self.acquire() as con:
+            return await con.fetchval(query, *args, column=column)
+
+    def get_size(self):
+        return self._size
+
+    def get_idle_size(self):
+        return len(self._idle)
+
+    def get_max_size(self):
+        return self.max_size
+
+    async def close(self):
+        for connection in self._idle:
+            await connection._run(connection._con.close)
+        self._idle = []
+        self._size = 0
+        self.executor.shutdown(wait=False)
+
+
+def parse_url(url):
+    """Return the path of the database of a `sqlite://` URL."""
+    path = url[len("sqlite://"):]
+    if path.startswith("/"):
+        path = path[1:]
+    return path or MEMORY
+
+
+async def create_pool(url, max_size):
+    """Create a pool on the database of `url`, with the schema created."""
+    pool = Pool(parse_url(url), max_size)
+    with open(SCHEMA) as f:
+        schema = f.read()
+    async with pool.acquire() as con:
+        await con.executescript(schema)
+    return pool
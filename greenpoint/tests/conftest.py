@@ -0,0 +1,12 @@
+import pytest
+
+from greenpoint import instrument
+from greenpoint import utils
+
+
+@pytest.fixture
+def database(monkeypatch, tmp_path):
+    """Use an empty SQLite database."""
+    url = "sqlite:///" + str(tmp_path / "greenpoint.db")
+    monkeypatch.setattr(utils, "get_config", lambda: {"database": url})
+    instrument.invalidate_quotes()
@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+import json
+
+from aiohttp import test_utils
+from aiohttp import web
+
+from greenpoint import alerts
+from greenpoint import instrument
+from greenpoint import portfolio
+from greenpoint import utils
+
+
+def _instrument(isin, name, quote):
+    return instrument.Instrument(
+        isin=isin, type=instrument.InstrumentType.STOCK, name=name,
+        symbol=None, currency="EUR", exchange_mic="XPAR",
+        pea=None, pea_pme=None, ttf=None, latest_quote=quote)
+
+
+FIGEAC = _instrument("FR0011665280", "Figeac Aero", 10.0)
+AIRBUS = _instrument("NL0000235190", "Airbus", 100.0)
+
+
+def run(coro):
+    async def _run():
+        try:
+            return await coro
+        finally:
+            await utils.close_db()
+    return asyncio.run(_run())
+
+
+async def _save(*instruments):
+    pool = await utils.get_db()
+    for inst in instruments:
+        await inst.save()
+        await pool.execute(
+            "UPDATE instruments SET latest_quote = $1 WHERE isin = $2",
+            inst.latest_quote, inst.isin)
+
+
+def test_threshold_index():
+    index = alerts.ThresholdIndex()
+    for rule_id, direction, value in ((1, "above", 10), (2, "above", 12),
+                                      (3, "below", 8), (4, "below", 10)):
+        index.add(alerts.Rule(rule_id, "X", "price", direction, value))
+    assert len(index) == 4
+    assert index.crossed(9, 11) == [1]
+    assert index.crossed(10, 12) == [2]
+    assert index.crossed(9, 20) == [1, 2]
+    assert index.crossed(11, 10) == [4]
+    assert index.crossed(10, 8) == [3]
+    assert index.crossed(10, 10) == []
+    assert index.crossed(None, 10) == []
+    index.remove(alerts.Rule(1, "X", "price", "above", 10))
+    assert index.crossed(9, 20) == [2]
+
+
+def test_engine(database, tmp_path):
+    path = tmp_path / "alerts.jsonl"
+
+    async def fire():
+        await _save(FIGEAC)
+        ids = [
+            await alerts.add_rule(FIGEAC.isin, "price", "above", 12.0),
+            await alerts.add_rule(FIGEAC.isin, "price", "below", 8.0),
+            await alerts.add_rule(FIGEAC.isin, "move", "above", 10.0),
+        ]
+        engine = alerts.AlertEngine([alerts.FileSink(str(path))])
+        await engine.load()
+        fired = []
+        for quote in (11.5, 12.5, 13.0, 7.0, 13.0):
+            fired.append([alert["id"]
+                          for alert in await engine.check(FIGEAC.isin,
+                                                          quote)])
+        # Fired rules are not loaded again
+        await engine.load()
+        return ids, fired, len(engine.rules), await alerts.list_rules()
+
+    ids, fired, pending, rules = run(fire())
+    assert fired == [[ids[2]], [ids[0]], [], [ids[1]], []]
+    assert pending == 0
+    assert all(rule["fired_at"] is not None for rule in rules)
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["id"] for line in lines] == [ids[2], ids[0], ids[1]]
+    assert lines[0]["threshold"] == 11.0
+    assert lines[0]["current"] == 11.5
+
+
+def test_weight(database):
+    def buy(inst, quantity):
+        return portfolio.Operation(
+            instrument_isin=inst.isin, type=portfolio.OperationType.TRADE,
+            date=datetime.date(2017, 1, 2), quantity=quantity,
+            price=inst.latest_quote, fees=0.0, taxes=0.0, currency="EUR")
+
+    async def fire():
+        await _save(FIGEAC, AIRBUS)
+        await portfolio.Operation.drop_save_all(
+            "pea", [buy(FIGEAC, 10.0), buy(AIRBUS, 1.0)])
+        rule_id = await alerts.add_rule(
+            FIGEAC.isin, "weight", "above", 60.0)
+        engine = alerts.AlertEngine([])
+        await engine.load()
+        # Weight goes from 50% to 55%, then 60%
+        first = await engine.check(FIGEAC.isin, 12.2222)
+        second = await engine.check(FIGEAC.isin, 15.0)
+        return rule_id, first, second
+
+    rule_id, first, second = run(fire())
+    assert first == []
+    assert [alert["id"] for alert in second] == [rule_id]
+    assert second[0]["current"] == 60.0
+
+
+def test_webhook():
+    received = []
+
+    async def handler(request):
+        received.append(await request.json())
+        return web.Response()
+
+    async def send():
+        app = web.Application()
+        app.router.add_post("/alerts", handler)
+        async with test_utils.TestServer(app) as server:
+            sink = alerts.WebhookSink(str(server.make_url("/alerts")))
+            await sink.send({"id": 1, "time": datetime.datetime(2017, 1, 2)})
+            # Errors are logged, not raised
+            await alerts.WebhookSink(
+                str(server.make_url("/missing"))).send({"id": 2})
+
+    asyncio.run(send())
+    assert received == [{"id": 1, "time": "2017-01-02T00:00:00"}]
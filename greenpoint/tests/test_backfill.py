@@ -0,0 +1,43 @@
+import datetime
+
+from greenpoint import backfill
+
+
+def test_build_calendar():
+    mics, days = backfill.build_calendar(datetime.date(2017, 12, 22),
+                                         datetime.date(2017, 12, 27))
+    calendar = {}
+    for mic, day in zip(mics, days):
+        calendar.setdefault(mic, []).append(day)
+    assert calendar["XPAR"] == [datetime.date(2017, 12, 22),
+                                datetime.date(2017, 12, 27)]
+    assert calendar["XNYS"] == [datetime.date(2017, 12, 22),
+                                datetime.date(2017, 12, 26),
+                                datetime.date(2017, 12, 27)]
+    assert calendar[backfill.UNKNOWN_MARKET] == [
+        datetime.date(2017, 12, 22),
+        datetime.date(2017, 12, 25),
+        datetime.date(2017, 12, 26),
+        datetime.date(2017, 12, 27),
+    ]
+
+
+def test_merge_gaps():
+    gaps = [
+        backfill.Gap("A", datetime.date(2017, 1, 2),
+                     datetime.date(2017, 1, 3), 2),
+        backfill.Gap("A", datetime.date(2017, 1, 6),
+                     datetime.date(2017, 1, 6), 1),
+        backfill.Gap("A", datetime.date(2017, 3, 1),
+                     datetime.date(2017, 3, 1), 1),
+        backfill.Gap("B", datetime.date(2017, 3, 2),
+                     datetime.date(2017, 3, 2), 1),
+    ]
+    assert backfill.merge_gaps(gaps) == [
+        backfill.Gap("A", datetime.date(2017, 1, 2),
+                     datetime.date(2017, 1, 6), 3),
+        backfill.Gap("A", datetime.date(2017, 3, 1),
+                     datetime.date(2017, 3, 1), 1),
+        backfill.Gap("B", datetime.date(2017, 3, 2),
+                     datetime.date(2017, 3, 2), 1),
+    ]
@@ -0,0 +1,98 @@
+import datetime
+
+import numpy
+
+import pytest
+
+from greenpoint import export
+
+
+# pyarrow is the optional `export` extra
+pyarrow = pytest.importorskip("pyarrow")
+
+
+def _quotes_table(rows):
+    return pyarrow.table({
+        "instrument_isin": pyarrow.array([r[0] for r in rows]),
+        "date": pyarrow.array([r[1] for r in rows], pyarrow.date32()),
+        "open": pyarrow.array([r[2] for r in rows], pyarrow.float64()),
+        "close": pyarrow.array([r[2] for r in rows], pyarrow.float64()),
+        "high": pyarrow.array([r[2] for r in rows], pyarrow.float64()),
+        "low": pyarrow.array([r[2] for r in rows], pyarrow.float64()),
+        "volume": pyarrow.array([None] * len(rows), pyarrow.float64()),
+    })
+
+
+ROWS = [
+    ("A", datetime.date(2016, 12, 30), 1.0),
+    ("A", datetime.date(2017, 1, 2), 2.0),
+    ("A", datetime.date(2017, 1, 3), 3.0),
+    ("B", datetime.date(2017, 1, 2), 4.0),
+]
+
+
+def test_split():
+    parts = list(export._split(_quotes_table(ROWS)))
+    assert [(key, len(part)) for key, part in parts] == [
+        (("A", 2016), 1), (("A", 2017), 2), (("B", 2017), 1)]
+    assert list(export._split(_quotes_table([]))) == []
+
+
+def _write_quotes(root, format):  # noqa
+    for (isin, year), part in export._split(_quotes_table(ROWS)):
+        export._write(
+            export.partition_path(root, "quotes", isin, year, format),
+            export._prepare("quotes", part), format)
+
+
+def test_load_quotes(tmp_path):
+    _write_quotes(str(tmp_path), "arrow")
+    quotes = export.load_quotes(str(tmp_path), "A")
+    assert quotes.date.tolist() == [datetime.date(2016, 12, 30),
+                                    datetime.date(2017, 1, 2),
+                                    datetime.date(2017, 1, 3)]
+    assert quotes.close.tolist() == [1.0, 2.0, 3.0]
+    assert numpy.isnan(quotes.volume).all()
+
+    quotes = export.load_quotes(str(tmp_path), "A",
+                                start=datetime.date(2017, 1, 3))
+    assert quotes.close.tolist() == [3.0]
+    # Values of a single year are read from the mapped file
+    assert not quotes.close.flags.owndata
+    assert not quotes.close.flags.writeable
+
+    assert len(export.load_quotes(str(tmp_path), "C")) == 0
+
+
+def test_load_quotes_parquet(tmp_path):
+    _write_quotes(str(tmp_path), "parquet")
+    quotes = export.load_quotes_bulk(str(tmp_path), ["A", "B"],
+                                     stop=datetime.date(2017, 1, 2))
+    assert quotes["A"].close.tolist() == [1.0, 2.0]
+    assert quotes["B"].close.tolist() == [4.0]
+
+
+def test_load_operations(tmp_path):
+    data = pyarrow.table({
+        "instrument_isin": ["A", "A"],
+        "date": pyarrow.array([datetime.date(2017, 1, 2),
+                               datetime.date(2017, 1, 3)],
+                              pyarrow.date32()),
+        "portfolio_name": ["pea", "pea"],
+        "type": ["trade", "trade"],
+        "quantity": [10.0, -5.0],
+        "price": [2.0, 3.0],
+        "fees": [1.0, 1.0],
+        "taxes": [0.0, 0.0],
+        "currency": ["EUR", "EUR"],
+    })
+    for (isin, year), part in export._split(data):
+        export._write(
+            export.partition_path(str(tmp_path), "operations", isin, year),
+            export._prepare("operations", part), "arrow")
+    loaded = export.load_operations(str(tmp_path))
+    assert loaded.column_names == [name for name, _
+                                   in export.TABLES["operations"]]
+    assert loaded.column("quantity").to_pylist() == [10.0, -5.0]
+    assert loaded.column("instrument_isin").to_pylist() == ["A", "A"]
+    assert len(export.load_operations(str(tmp_path / "empty"))) == 0
@@ -0,0 +1,61 @@
+import datetime
+
+import numpy
+
+from greenpoint import fx
+from greenpoint import instrument
+
+
+def _table():
+    return fx.RateTable.from_rows("EUR", [
+        {"base": "USD", "date": datetime.date(2017, 1, 2), "rate": 0.9},
+        {"base": "USD", "date": datetime.date(2017, 1, 4), "rate": 0.8},
+        {"base": "GBX", "date": datetime.date(2017, 1, 3), "rate": 0.012},
+    ])
+
+
+def test_convert_latest():
+    converted = _table().convert([10, 100, 1000, 5],
+                                 ["USD", "EUR", "GBX", "JPY"])
+    numpy.testing.assert_allclose(converted[:3], [8, 100, 12])
+    assert numpy.isnan(converted[3])
+
+
+def test_convert_as_of():
+    table = _table()
+    converted = table.convert(
+        [10, 10, 10, 10, 1000],
+        ["USD", "USD", "USD", "USD", "GBX"],
+        [datetime.date(2017, 1, 1),
+         datetime.date(2017, 1, 2),
+         datetime.date(2017, 1, 3),
+         datetime.date(2017, 1, 5),
+         datetime.date(2017, 1, 3)])
+    assert numpy.isnan(converted[0])
+    numpy.testing.assert_allclose(converted[1:], [9, 9, 8, 12])
+    assert table.latest("USD") == 0.8
+    assert table.latest("EUR") == 1.0
+    assert table.latest("JPY") is None
+
+
+def test_fx_pair():
+    inst = instrument.Instrument(
+        isin="USDEUR",
+        type=instrument.InstrumentType.CURRENCY,
+        name="USD/EUR",
+        symbol="USDEUR",
+        currency="EUR",
+        exchange_mic=None,
+        pea=False, pea_pme=False, ttf=False)
+    assert inst.fx_pair == ("USD", "EUR")
+    assert inst.yahoo_symbol == "USDEUR=X"
+    cash = instrument.Instrument(
+        isin="EUR",
+        type=instrument.InstrumentType.CURRENCY,
+        name="Euro",
+        symbol=None,
+        currency="EUR",
+        exchange_mic=None,
+        pea=None, pea_pme=None, ttf=None)
+    assert cash.fx_pair is None
+    assert cash.yahoo_symbol is None
@@ -0,0 +1,46 @@
+import subprocess
+import sys
+
+
+# Modules that starting the CLI must not load: commands import them
+HEAVY_MODULES = {
+    "aiohttp",
+    "asyncio",
+    "asyncpg",
+    "attr",
+    "lxml",
+    "numpy",
+    "requests",
+    "tabulate",
+    "yaml",
+}
+
+
+def import_times(module):
+    """Import a module in a new interpreter with `-X importtime`.
+
+    :return: The cumulative import time in µs of each loaded module.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        check=True, stderr=subprocess.PIPE, universal_newlines=True,
+    ).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_cli_import():
+    times = import_times("greenpoint.cli")
+    loaded = {name.split(".")[0] for name in times}
+    assert not loaded & HEAVY_MODULES
+
+
+def test_utils_import():
+    times = import_times("greenpoint.utils")
+    loaded = {name.split(".")[0] for name in times}
+    assert not loaded & (HEAVY_MODULES - {"yaml"})
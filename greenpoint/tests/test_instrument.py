@@ -1,9 +1,15 @@
 import asyncio
 import datetime
 
+import aiohttp
+
+import numpy
+
 import pytest
 
 from greenpoint import instrument
+from greenpoint import ticks
+from greenpoint.benchmarks import providers
 
 
 def test_quotes_from_lesechos():
@@ -148,9 +154,8 @@ def test_live_quote_from_yahoo():
         exchange_mic="XPAR",
         pea=None, pea_pme=None, ttf=None)
     quote = inst.fetch_live_quote_from_yahoo()
-    assert isinstance(quote, instrument.Quote)
-    # Close is current price
-    assert quote.low <= quote.close <= quote.high
+    assert isinstance(quote, ticks.Tick)
+    assert quote.low <= quote.price <= quote.high
     inst = instrument.Instrument(
         isin="FR0011665281",
         type=instrument.InstrumentType.STOCK,
@@ -229,3 +234,93 @@ def test_quotes_list():
     assert ql[:datetime.date(2015, 1, 1)] == []
     assert ql[:datetime.date(2016, 12, 13)] == [q1]
     assert ql[datetime.date(2016, 12, 13):] == [q2, q3, q4]
+
+
+def test_quote_columns_slice():
+    cols = instrument.QuoteColumns.from_lists(
+        [datetime.date(2016, 12, 12),
+         datetime.date(2016, 12, 18),
+         datetime.date(2016, 12, 19)],
+        close=[1.0, None, 3.0])
+    assert len(cols) == 3
+    assert cols.nbytes == 3 * 8 * 6
+    assert cols.slice() is cols
+    sliced = cols.slice(datetime.date(2016, 12, 13),
+                        datetime.date(2016, 12, 19))
+    assert list(sliced.date) == [numpy.datetime64("2016-12-18"),
+                                 numpy.datetime64("2016-12-19")]
+    assert numpy.isnan(sliced.close[0])
+    assert sliced.close[1] == 3.0
+    assert len(cols.slice(stop=datetime.date(2015, 1, 1))) == 0
+    assert len(instrument.QuoteColumns.empty()) == 0
+
+
+def test_invalidate_quotes():
+    cols = instrument.QuoteColumns.empty()
+    instrument.QUOTES_CACHE["FR0011665280"] = cols
+    instrument.QUOTES_CACHE["FR0011665281"] = cols
+    instrument.invalidate_quotes("FR0011665280")
+    assert "FR0011665280" not in instrument.QUOTES_CACHE
+    assert "FR0011665281" in instrument.QUOTES_CACHE
+    instrument.invalidate_quotes()
+    assert len(instrument.QUOTES_CACHE) == 0
+
+
+FIGEAC = dict(
+    isin="FR0011665280",
+    type=instrument.InstrumentType.STOCK,
+    name="Figeac Aero",
+    symbol="FGA",
+    currency="EUR",
+    exchange_mic="XPAR",
+    pea=None, pea_pme=None, ttf=None)
+
+
+def _fetch_offline(monkeypatch, provider, start=None, stop=None, **kwargs):
+    server = providers.ProviderServer(**kwargs)
+
+    async def fetch():
+        async with server, aiohttp.ClientSession() as session:
+            for name, url in server.urls().items():
+                monkeypatch.setattr(instrument.Instrument, name, url)
+            inst = instrument.Instrument(**FIGEAC)
+            return await instrument.Instrument.QUOTES_PROVIDERS[provider](
+                inst, session, start, stop)
+
+    return server, asyncio.run(fetch())
+
+
+@pytest.mark.parametrize("provider", ["boursorama", "lesechos",
+                                      "google", "yahoo"])
+def test_quotes_offline(monkeypatch, provider):
+    start = datetime.date.today() - datetime.timedelta(days=30)
+    stop = datetime.date.today() - datetime.timedelta(days=10)
+    server, quotes = _fetch_offline(monkeypatch, provider, start, stop,
+                                    history_days=300)
+    # Each provider knows the instrument by a different identifier
+    key = {
+        "google": "EPA:FGA",
+        "yahoo": "FGA.PA",
+    }.get(provider, FIGEAC["isin"])
+    expected = {
+        instrument.Quote(date=d, open=o, close=c, high=h, low=low,
+                         volume=v)
+        for d, o, c, h, low, v in server.quotes(key, start, stop)
+    }
+    assert len(expected) == 15
+    assert quotes == expected
+
+
+@pytest.mark.parametrize("provider", ["boursorama", "lesechos",
+                                      "google", "yahoo"])
+def test_quotes_offline_unknown(monkeypatch, provider):
+    server, quotes = _fetch_offline(
+        monkeypatch, provider,
+        unknown=(FIGEAC["isin"], "EPA:FGA", "FGA.PA"))
+    assert quotes == set()
+
+
+def test_quotes_offline_error(monkeypatch):
+    server, quotes = _fetch_offline(monkeypatch, "yahoo", error_rate=1)
+    assert quotes == set()
+    assert server.requests["/v8/finance/chart/FGA.PA"] == 1
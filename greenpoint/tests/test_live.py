@@ -0,0 +1,65 @@
+import asyncio
+import decimal
+import json
+
+from greenpoint import live
+
+
+STATUS = [
+    {"instrument_isin": "FR0011665280",
+     "position": decimal.Decimal(10),
+     "ppu": decimal.Decimal(15),
+     "fx_rate": decimal.Decimal(1),
+     "market_value": 200.0},
+    {"instrument_isin": "US0378331005",
+     "position": decimal.Decimal(2),
+     "ppu": decimal.Decimal(100),
+     "fx_rate": decimal.Decimal("0.5"),
+     "market_value": 300.0},
+]
+
+
+def test_update():
+    live_quotes = live.LiveQuotes()
+    live_quotes.set_status(STATUS)
+    assert live_quotes.total == 500.0
+
+    event = live_quotes.update("US0378331005", 400.0, "2017-12-20T17:35:00")
+    assert event["market_value"] == 400.0
+    assert event["portfolio_market_value"] == 600.0
+    assert event["potential_gain"] == 200.0
+    assert event["potential_gain_pct"] == 100.0
+    assert event["weight"] == 400.0 / 6
+
+    event = live_quotes.update("FR0000120578", 80.0, "2017-12-20T17:35:00")
+    assert event == {"isin": "FR0000120578",
+                     "latest_quote": 80.0,
+                     "latest_quote_time": "2017-12-20T17:35:00"}
+
+
+def test_on_notification():
+    live_quotes = live.LiveQuotes(queue_size=1)
+
+    async def load_status():
+        live_quotes.set_status(STATUS)
+
+    live_quotes.load_status = load_status
+    payload = json.dumps({"isin": "FR0011665280",
+                          "latest_quote": 21.0,
+                          "latest_quote_time": "2017-12-20T17:35:00"})
+
+    async def notify():
+        await live_quotes.on_notification(payload)
+        assert live_quotes.holdings is None
+        subscriber = live_quotes.subscribe()
+        await live_quotes.on_notification(payload)
+        event = subscriber.queue.get_nowait()
+        assert event["market_value"] == 210.0
+        assert event["portfolio_market_value"] == 510.0
+        await live_quotes.on_notification(payload)
+        await live_quotes.on_notification(payload)
+        assert subscriber.lagging
+        live_quotes.unsubscribe(subscriber)
+        assert not live_quotes.subscribers
+
+    asyncio.run(notify())
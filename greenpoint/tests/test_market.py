@@ -0,0 +1,58 @@
+import datetime
+
+from dateutil import tz
+
+from greenpoint import market
+
+
+UTC = tz.UTC
+
+
+def test_holidays():
+    xpar = market.get_market("XPAR")
+    assert not xpar.is_trading_day(datetime.date(2018, 3, 30))  # Good Friday
+    assert not xpar.is_trading_day(datetime.date(2018, 4, 2))
+    assert not xpar.is_trading_day(datetime.date(2017, 12, 23))  # Saturday
+    assert xpar.is_trading_day(datetime.date(2017, 12, 20))
+
+    xnys = market.get_market("XNYS")
+    assert not xnys.is_trading_day(datetime.date(2017, 11, 23))  # Thanksgiving
+    assert not xnys.is_trading_day(datetime.date(2021, 12, 24))  # Observed
+    assert not xnys.is_trading_day(datetime.date(2018, 1, 15))  # MLK day
+    assert xnys.is_trading_day(datetime.date(2018, 4, 2))
+
+    xlon = market.get_market("XLON")
+    assert not xlon.is_trading_day(datetime.date(2017, 8, 28))
+    assert not xlon.is_trading_day(datetime.date(2016, 12, 27))
+
+    assert market.get_market(None) is None
+    assert market.get_market("XXXX") is None
+
+
+def test_trading_days():
+    xpar = market.get_market("XPAR")
+    assert xpar.trading_days(datetime.date(2017, 12, 22),
+                             datetime.date(2017, 12, 27)) == [
+        datetime.date(2017, 12, 22), datetime.date(2017, 12, 27)]
+    assert xpar.previous_trading_day(
+        datetime.date(2017, 12, 27)) == datetime.date(2017, 12, 22)
+
+
+def test_sessions():
+    xpar = market.get_market("XPAR")
+    assert xpar.is_open(datetime.datetime(2017, 12, 20, 9, 0, tzinfo=UTC))
+    assert not xpar.is_open(datetime.datetime(2017, 12, 20, 7, 59,
+                                              tzinfo=UTC))
+    assert not xpar.is_open(datetime.datetime(2017, 12, 20, 16, 30,
+                                              tzinfo=UTC))
+    friday_night = datetime.datetime(2017, 12, 22, 20, 0, tzinfo=UTC)
+    assert xpar.next_open(friday_night) == datetime.datetime(
+        2017, 12, 27, 8, 0, tzinfo=UTC)
+    assert xpar.last_close(friday_night) == datetime.datetime(
+        2017, 12, 22, 16, 30, tzinfo=UTC)
+
+    xnys = market.get_market("XNYS")
+    # 15:00 UTC is 10:00 in New York
+    when = datetime.datetime(2017, 12, 20, 15, 0, tzinfo=UTC)
+    assert xnys.is_open(when)
+    assert xnys.next_open(when) == when
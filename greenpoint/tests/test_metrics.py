@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from greenpoint import instrument
+from greenpoint import metrics
+from greenpoint.benchmarks import providers
+
+
+def test_expose():
+    registry = metrics.Registry()
+    counter = registry.counter("test_total", "A counter.", ("kind",))
+    gauge = registry.gauge("test_gauge", "A gauge.")
+    histogram = registry.histogram("test_seconds", "A histogram.",
+                                   buckets=(0.1, 1))
+    counter.inc(kind='a"b')
+    counter.inc(2, kind='a"b')
+    gauge.set(4)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    assert registry.expose() == """# HELP test_gauge A gauge.
+# TYPE test_gauge gauge
+test_gauge 4.0
+# HELP test_seconds A histogram.
+# TYPE test_seconds histogram
+test_seconds_bucket{le="0.1"} 1.0
+test_seconds_bucket{le="1.0"} 2.0
+test_seconds_bucket{le="+Inf"} 3.0
+test_seconds_sum 5.55
+test_seconds_count 3.0
+# HELP test_total A counter.
+# TYPE test_total counter
+test_total{kind="a\\"b"} 3.0
+"""
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        registry.gauge("test_gauge", "Again.")
+
+
+def test_gauge_function():
+    gauge = metrics.Gauge("test", "A gauge.", ("state",))
+    gauge.set_function(lambda: {("idle",): 2})
+    assert list(gauge.samples()) == [("test", ("idle",), (), 2)]
+
+
+def test_timer_errors():
+    histogram = metrics.Histogram("test", "A histogram.", ("provider",))
+    errors = metrics.Counter("errors", "A counter.", ("provider",))
+    with histogram.time(errors=errors, provider="p"):
+        pass
+    with pytest.raises(KeyError):
+        with histogram.time(errors=errors, provider="p"):
+            raise KeyError
+    assert histogram.get(provider="p") == 2
+    assert errors.get(provider="p") == 1
+
+
+def test_provider_metrics(monkeypatch):
+    server = providers.ProviderServer(history_days=30)
+    inst = instrument.Instrument(
+        isin="FR0011665280",
+        type=instrument.InstrumentType.STOCK,
+        name="Figeac Aero",
+        symbol="FGA",
+        currency="EUR",
+        exchange_mic="XPAR",
+        pea=None, pea_pme=None, ttf=None)
+    requests = metrics.PROVIDER_REQUESTS.get(provider="lesechos")
+    received = metrics.PROVIDER_BYTES.get(provider="lesechos")
+    calls = metrics.PROVIDER_CALL_DURATION.get(provider="lesechos")
+
+    async def fetch():
+        async with server, instrument.client_session() as session:
+            for name, url in server.urls().items():
+                monkeypatch.setattr(instrument.Instrument, name, url)
+            return await asyncio.ensure_future(
+                inst._fetch_quotes("lesechos", session, None, None))
+
+    assert asyncio.run(fetch())
+    assert metrics.PROVIDER_REQUESTS.get(provider="lesechos") == requests + 1
+    assert metrics.PROVIDER_BYTES.get(provider="lesechos") > received
+    assert (metrics.PROVIDER_CALL_DURATION.get(provider="lesechos") ==
+            calls + 1)
@@ -0,0 +1,48 @@
+import asyncio
+import datetime
+import threading
+
+import pytest
+
+from greenpoint import instrument
+from greenpoint import parsing
+
+
+GOOGLE_PAGE = (
+    "<td class=\"lm\">Apr 21, 2017\n"
+    "<td class=\"rgt\">58.40\n"
+    "<td class=\"rgt\">59.90\n"
+    "<td class=\"rgt\">58.40\n"
+    "<td class=\"rgt\">59.90\n"
+    "<td class=\"rgt rm\">2,918\n"
+)
+
+
+@pytest.fixture
+def pools():
+    yield parsing.configure
+    parsing.configure(parsing.DEFAULT_THREADS, parsing.DEFAULT_PROCESSES)
+
+
+def test_run_in_thread(pools):
+    pools(threads=2, processes=0)
+    name = asyncio.run(parsing.run(lambda: threading.current_thread().name,
+                                   cpu=True))
+    assert name.startswith("parse")
+
+
+@pytest.mark.parametrize("processes", [0, 1])
+def test_parse_google_quotes(pools, processes):
+    pools(processes=processes)
+    quotes, has_results = asyncio.run(parsing.run(
+        instrument.parse_google_quotes, GOOGLE_PAGE, cpu=True))
+    assert has_results
+    assert quotes == {instrument.Quote(
+        date=datetime.date(2017, 4, 21), open=58.4, high=59.9, low=58.4,
+        close=59.9, volume=2918)}
+
+    quotes, has_results = asyncio.run(parsing.run(
+        instrument.parse_google_quotes, GOOGLE_PAGE,
+        datetime.date(2017, 4, 22), cpu=True))
+    assert has_results
+    assert quotes == set()
@@ -0,0 +1,120 @@
+import asyncio
+import datetime
+
+from dateutil import tz
+
+from greenpoint import instrument
+from greenpoint import planner
+from greenpoint import utils
+
+
+UTC = tz.UTC
+
+
+def _instrument(**kwargs):
+    values = dict(
+        isin="FR0011665280",
+        type=instrument.InstrumentType.STOCK,
+        name="Figeac Aero",
+        symbol="FGA",
+        currency="EUR",
+        exchange_mic="XPAR",
+        pea=None, pea_pme=None, ttf=None)
+    values.update(kwargs)
+    return instrument.Instrument(**values)
+
+
+# Wednesday, after the close in Paris
+NOW = datetime.datetime(2017, 12, 20, 18, 0, tzinfo=UTC)
+
+
+def test_plan_skip():
+    plan = planner.plan_instrument(_instrument(is_alive=False),
+                                   None, False, NOW)
+    assert plan.skip
+    assert plan.reason == "dead"
+    # Held instruments are never given up
+    plan = planner.plan_instrument(_instrument(is_alive=False),
+                                   None, True, NOW)
+    assert not plan.skip
+    assert plan.session == datetime.date(2017, 12, 20)
+    plan = planner.plan_instrument(_instrument(), None, False, NOW)
+    assert plan.skip
+    assert plan.reason == "not held"
+    assert plan.estimate_requests(NOW.date()) == 0
+    plan = planner.plan_instrument(_instrument(), None, False, NOW,
+                                   force=True)
+    assert not plan.skip
+
+
+def test_plan_history():
+    plan = planner.plan_instrument(_instrument(), None, True, NOW)
+    assert plan.history
+    assert plan.live
+    assert plan.start is None
+    assert plan.providers == ("boursorama", "lesechos", "google", "yahoo")
+    assert plan.reason == "no quotes"
+
+    plan = planner.plan_instrument(
+        _instrument(), datetime.date(2017, 12, 15), True, NOW)
+    assert plan.history
+    assert plan.start == datetime.date(2017, 12, 16)
+    assert plan.reason == "stale"
+    # 1 live + 2 boursorama + 1 lesechos + 2 google + 1 yahoo
+    assert plan.estimate_requests(NOW.date()) == 7
+
+
+def test_plan_up_to_date():
+    inst = _instrument(
+        latest_quote=1.0,
+        latest_quote_time=datetime.datetime(2017, 12, 20, 16, 35,
+                                            tzinfo=UTC))
+    plan = planner.plan_instrument(inst, datetime.date(2017, 12, 20),
+                                   True, NOW)
+    assert plan.skip
+    assert plan.reason == "up to date"
+
+    # The market is open: refresh the live quote only
+    now = datetime.datetime(2017, 12, 21, 10, 0, tzinfo=UTC)
+    plan = planner.plan_instrument(inst, datetime.date(2017, 12, 20),
+                                   True, now)
+    assert not plan.history
+    assert plan.live
+    assert plan.reason == "live quote"
+
+
+def test_plan_no_provider():
+    inst = _instrument(isin="EUR", type=instrument.InstrumentType.CURRENCY,
+                       exchange_mic=None, symbol=None)
+    plan = planner.plan_instrument(inst, None, True, NOW)
+    assert plan.skip
+    assert plan.reason == "no provider"
+
+
+def test_record_refresh_per_session(database):
+    monday = datetime.date(2017, 12, 18)
+    tuesday = datetime.date(2017, 12, 19)
+
+    async def refresh():
+        inst = _instrument()
+        await inst.save()
+        states = []
+        # Several update runs before the quotes of the session are out
+        for found, session, held in ((False, monday, False),
+                                     (False, monday, False),
+                                     (False, monday, False),
+                                     (False, tuesday, True),
+                                     (False, tuesday, False),
+                                     (True, tuesday, False)):
+            await inst.record_refresh(found, 2, session, held)
+            states.append((inst.is_alive, inst.empty_refreshes))
+        await utils.close_db()
+        return states
+
+    assert asyncio.run(refresh()) == [
+        (True, 1), (True, 1), (True, 1),
+        # Held: not marked dead
+        (True, 2),
+        (False, 2),
+        (True, 0),
+    ]
@@ -0,0 +1,262 @@
+import asyncio
+import datetime
+
+import pytest
+
+from greenpoint import instrument
+from greenpoint import portfolio
+from greenpoint import sqlite
+from greenpoint import utils
+
+
+ISIN = "FR0011665280"
+
+
+def op(date, quantity):
+    return portfolio.Operation(
+        instrument_isin=ISIN,
+        type=portfolio.OperationType.TRADE,
+        date=date, quantity=quantity, price=10.0,
+        fees=0.0, taxes=0.0, currency="EUR")
+
+
+async def windows(*windows):
+    for window in windows:
+        # Let the writes run while the next window is "fetched"
+        await asyncio.sleep(0)
+        yield window
+
+
+async def _save_windows(windows):
+    """Save windows over existing operations.
+
+    :return: The number of operations saved, or the error raised, and the
+             operations stored afterwards.
+    """
+    pool = await utils.get_db()
+    await instrument.Instrument(
+        isin=ISIN, type=instrument.InstrumentType.STOCK,
+        name="Figeac Aero", symbol="FGA", currency="EUR",
+        exchange_mic="XPAR", pea=None, pea_pme=None, ttf=None).save()
+    await portfolio.Operation.drop_save_all("pea", [
+        op(datetime.date(2015, 1, 2), 1.0),
+        op(datetime.date(2016, 6, 1), 2.0),
+        op(datetime.date(2017, 6, 1), 3.0),
+    ])
+    try:
+        result = await portfolio.Operation.save_windows("pea", windows)
+    except ValueError as e:
+        result = e
+    rows = await pool.fetch(
+        "SELECT date, quantity FROM operations "
+        "WHERE portfolio_name = $1 ORDER BY date", "pea")
+    await utils.close_db()
+    return result, [(row["date"], row["quantity"]) for row in rows]
+
+
+def test_save_windows(database):
+    saved, rows = asyncio.run(_save_windows(windows(
+        (datetime.date(2017, 1, 1), None,
+         [op(datetime.date(2017, 6, 1), 4.0),
+          op(datetime.date(2017, 7, 1), 5.0)]),
+        (datetime.date(2016, 1, 1), datetime.date(2016, 12, 31), []),
+    )))
+    assert saved == 2
+    # 2016 is now empty and 2015 is older than all windows
+    assert rows == [
+        (datetime.date(2017, 6, 1), 4.0),
+        (datetime.date(2017, 7, 1), 5.0),
+    ]
+
+
+def test_save_windows_error(database):
+    async def failing():
+        yield (datetime.date(2017, 1, 1), None,
+               [op(datetime.date(2017, 7, 1), 5.0)])
+        raise ValueError
+
+    error, rows = asyncio.run(_save_windows(failing()))
+    assert isinstance(error, ValueError)
+    # Windows fetched before the error are saved, older ones are kept
+    assert rows == [
+        (datetime.date(2015, 1, 2), 1.0),
+        (datetime.date(2016, 6, 1), 2.0),
+        (datetime.date(2017, 7, 1), 5.0),
+    ]
+
+
+def test_income_rollup(database):
+    def income(date, type_, quantity, price, fees, taxes):
+        return portfolio.Operation(
+            instrument_isin=ISIN, type=type_, date=date,
+            quantity=quantity, price=price, fees=fees, taxes=taxes,
+            currency="EUR")
+
+    trade = portfolio.OperationType.TRADE
+    dividend = portfolio.OperationType.DIVIDEND
+    tax = portfolio.OperationType.TAX
+
+    async def rollup():
+        await instrument.Instrument(
+            isin=ISIN, type=instrument.InstrumentType.STOCK,
+            name="Figeac Aero", symbol="FGA", currency="EUR",
+            exchange_mic="XPAR", pea=None, pea_pme=None, ttf=None).save()
+        await portfolio.Operation.drop_save_all("pea", [
+            income(datetime.date(2016, 3, 1), trade, 10.0, 20.0, 5.0, 1.0),
+            income(datetime.date(2016, 6, 10), dividend, 10.0, 0.5, 0.0,
+                   0.0),
+            income(datetime.date(2016, 6, 20), tax, 0.0, 0.0, 0.0, 0.75),
+            income(datetime.date(2017, 6, 10), dividend, 10.0, 0.6, 0.0,
+                   0.0),
+        ])
+        yearly = await portfolio.get_income("pea")
+        # Windows starting and ending in the middle of June 2016
+        await portfolio.Operation.save_windows("pea", windows(
+            (datetime.date(2016, 6, 15), None, [
+                income(datetime.date(2017, 6, 10), dividend, 10.0, 0.7,
+                       0.0, 0.0)]),
+            (datetime.date(2016, 1, 1), datetime.date(2016, 6, 14), [
+                income(datetime.date(2016, 3, 1), trade, 10.0, 20.0, 5.0,
+                       1.0),
+                income(datetime.date(2016, 6, 10), dividend, 10.0, 0.5,
+                       0.0, 0.0)]),
+        ))
+        monthly = await portfolio.get_income(year=2016, monthly=True)
+        await utils.close_db()
+        return yearly, monthly
+
+    yearly, monthly = asyncio.run(rollup())
+    assert [(row["year"], row["dividends"], row["fees"], row["taxes"],
+             row["operations"]) for row in yearly] == [
+        (2016, 5.0, 5.0, 1.75, 3),
+        (2017, 6.0, 0.0, 0.0, 1),
+    ]
+    # The tax of June 2016 is gone, the dividend before it stays
+    assert [(row["month"], row["dividends"], row["taxes"])
+            for row in monthly] == [(3, 0.0, 1.0), (6, 5.0, 0.0)]
+
+
+def test_status_filters(database):
+    etf = "FR0010315770"
+
+    def trade(isin, quantity, price):
+        return portfolio.Operation(
+            instrument_isin=isin, type=portfolio.OperationType.TRADE,
+            date=datetime.date(2017, 1, 2), quantity=quantity, price=price,
+            fees=0.0, taxes=0.0, currency="EUR")
+
+    async def status():
+        await instrument.Instrument(
+            isin=ISIN, type=instrument.InstrumentType.STOCK,
+            name="Figeac Aero", symbol="FGA", currency="EUR",
+            exchange_mic="XPAR", pea=True, pea_pme=None, ttf=None,
+            latest_quote=15.0).save()
+        await instrument.Instrument(
+            isin=etf, type=instrument.InstrumentType.ETF,
+            name="Lyxor MSCI World", symbol="WLD", currency="EUR",
+            exchange_mic="XPAR", pea=False, pea_pme=None, ttf=None,
+            latest_quote=30.0).save()
+        await portfolio.Operation.drop_save_all("pea", [
+            trade(ISIN, 10.0, 10.0)])
+        await portfolio.Operation.drop_save_all("cto", [
+            trade(ISIN, 10.0, 20.0), trade(etf, 5.0, 20.0)])
+        results = [
+            await portfolio.get_status(reporting_currency="EUR"),
+            await portfolio.get_status_for_broker("pea", currency="EUR"),
+            await portfolio.get_status(
+                instrument_type="etf", reporting_currency="EUR"),
+            await portfolio.get_status(
+                portfolio_name="cto", pea=True, currency="eur",
+                reporting_currency="EUR"),
+        ]
+        await utils.close_db()
+        return [[(row["instrument_isin"], row["position"], row["ppu"],
+                  row["market_value"], row["weight"]) for row in rows]
+                for rows in results]
+
+    everything, pea, etfs, cto_pea = asyncio.run(status())
+    assert everything == [
+        (etf, 5.0, 20.0, 150.0, pytest.approx(100 / 3)),
+        (ISIN, 20.0, 15.0, 300.0, pytest.approx(200 / 3)),
+    ]
+    assert pea == [(ISIN, 10.0, 10.0, 150.0, 100.0)]
+    assert etfs == [(etf, 5.0, 20.0, 150.0, 100.0)]
+    assert cto_pea == [(ISIN, 10.0, 20.0, 150.0, 100.0)]
+
+
+def test_status_query_text():
+    by_broker = portfolio.StatusQuery(portfolio_name="pea",
+                                      reporting_currency="EUR")
+    query, args = by_broker.build()
+    assert args == ("EUR", "pea")
+    # Same filters, same statement
+    assert portfolio.StatusQuery(
+        portfolio_name="cto", reporting_currency="EUR").build() == (
+            query, ("EUR", "cto"))
+    query, args = portfolio.StatusQuery(
+        pea=False, instrument_type="etf", reporting_currency="EUR").build()
+    assert args == ("EUR", "etf", False)
+    # instruments.type is an enum in PostgreSQL
+    assert "type = $2::instrument_type and pea = $3::boolean" in query
+    assert "type = ?2 and pea = ?3" in sqlite._translate(query)
+
+
+def test_status_cost_at_trade_rate(database):
+    usd = "US0378331005"
+    unknown = "US5949181045"
+
+    def trade(date, quantity, price, isin=usd):
+        return portfolio.Operation(
+            instrument_isin=isin, type=portfolio.OperationType.TRADE,
+            date=date, quantity=quantity, price=price,
+            fees=0.0, taxes=0.0, currency="USD")
+
+    async def status():
+        pool = await utils.get_db()
+        await instrument.Instrument(
+            isin="USDEUR", type=instrument.InstrumentType.CURRENCY,
+            name="USD/EUR", symbol="USDEUR", currency="EUR",
+            exchange_mic=None, pea=False, pea_pme=False, ttf=False).save()
+        await instrument.Instrument(
+            isin=usd, type=instrument.InstrumentType.STOCK,
+            name="Apple", symbol="AAPL", currency="USD",
+            exchange_mic="XNAS", pea=False, pea_pme=None, ttf=None,
+            latest_quote=12.0).save()
+        await instrument.Instrument(
+            isin=unknown, type=instrument.InstrumentType.STOCK,
+            name="Microsoft", symbol="MSFT", currency="USD",
+            exchange_mic="XNAS", pea=False, pea_pme=None, ttf=None,
+            latest_quote=12.0).save()
+        await pool.executemany(
+            "INSERT INTO quotes (instrument_isin, date, close) "
+            "VALUES ($1, $2, $3)",
+            [("USDEUR", datetime.date(2017, 1, 2), 0.9),
+             ("USDEUR", datetime.date(2017, 6, 1), 0.8)])
+        await portfolio.Operation.drop_save_all("cto", [
+            trade(datetime.date(2017, 1, 3), 10.0, 10.0),
+            trade(datetime.date(2017, 2, 1), -10.0, 11.0),
+            trade(datetime.date(2017, 3, 1), 5.0, 10.0),
+            trade(datetime.date(2017, 6, 2), 5.0, 12.0),
+            trade(datetime.date(2017, 6, 2), 5.0, 12.0, unknown),
+        ])
+        # Bought before the first known rate
+        await portfolio.Operation.drop_save_all("pea", [
+            trade(datetime.date(2016, 12, 1), 5.0, 10.0, unknown),
+            trade(datetime.date(2017, 6, 2), 5.0, 12.0, unknown),
+        ])
+        rows = await portfolio.get_status(reporting_currency="EUR")
+        await utils.close_db()
+        return rows
+
+    row, unknown_row = asyncio.run(status())
+    # Bought at 0.9 EUR then 0.8 EUR per USD, valued at 0.8 EUR per USD;
+    # the trades of the closed position are left out
+    assert row["position"] == 10.0
+    assert row["ppu"] == pytest.approx((5 * 10 * 0.9 + 5 * 12 * 0.8) / 10)
+    assert row["market_value"] == pytest.approx(10 * 12 * 0.8)
+    assert float(row["potential_gain"]) == pytest.approx(
+        10 * 12 * 0.8 - (5 * 10 * 0.9 + 5 * 12 * 0.8))
+    # An unknown rate gives an unknown cost, not a lower one
+    assert unknown_row["position"] == 15.0
+    assert unknown_row["ppu"] is None
+    assert unknown_row["market_value"] == pytest.approx(15 * 12 * 0.8)
@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+
+import numpy
+
+from greenpoint import instrument
+from greenpoint import resample
+
+
+def _quotes(days):
+    start = datetime.date(2017, 1, 2)  # Monday
+    dates = [start + datetime.timedelta(days=i) for i in range(days)]
+    values = numpy.arange(days, dtype=numpy.float64)
+    return instrument.QuoteColumns.from_lists(
+        dates, open=values, close=values + 0.5,
+        high=values + 1, low=values - 1, volume=numpy.ones(days))
+
+
+def test_resample_week():
+    bars = resample.resample(_quotes(10), "week")
+    assert list(bars.date) == [numpy.datetime64("2017-01-02"),
+                               numpy.datetime64("2017-01-09")]
+    assert list(bars.open) == [0, 7]
+    assert list(bars.close) == [6.5, 9.5]
+    assert list(bars.high) == [7, 10]
+    assert list(bars.low) == [-1, 6]
+    assert list(bars.volume) == [7, 3]
+
+
+def test_resample_month():
+    bars = resample.resample(_quotes(40), "month")
+    assert list(bars.date) == [numpy.datetime64("2017-01-01"),
+                               numpy.datetime64("2017-02-01")]
+    assert list(bars.close) == [29.5, 39.5]
+    assert len(resample.resample(instrument.QuoteColumns.empty(),
+                                 "month")) == 0
+
+
+def test_lttb():
+    x = numpy.arange(100)
+    y = numpy.zeros(100)
+    y[42] = 10
+    idx = resample.lttb(x, y, 10)
+    assert len(idx) == 10
+    assert idx[0] == 0
+    assert idx[-1] == 99
+    assert 42 in idx
+    assert list(numpy.sort(idx)) == list(idx)
+    assert len(resample.lttb(x, y, 200)) == 100
+
+
+def test_downsample():
+    quotes = _quotes(5000)
+    small = resample.downsample(quotes, 100)
+    assert len(small) == 100
+    assert small.date[0] == quotes.date[0]
+    assert small.date[-1] == quotes.date[-1]
+    assert resample.downsample(quotes, 6000) is quotes
+
+
+def test_get_chart_points(monkeypatch):
+    isin = "FR0011665280"
+    monkeypatch.setitem(instrument.QUOTES_CACHE, isin, _quotes(5000))
+    for points, expected in ((None, resample.MAX_POINTS),
+                             (10 ** 6, resample.MAX_POINTS),
+                             (100, 100),
+                             (2, resample.MIN_POINTS),
+                             (0, resample.MIN_POINTS),
+                             (-1, resample.MIN_POINTS)):
+        quotes = asyncio.run(resample.get_chart(isin, points=points))
+        assert len(quotes) == expected
+
+
+def test_to_primitive():
+    quotes = instrument.QuoteColumns.from_lists(
+        [datetime.date(2017, 1, 2)], close=[1.5])
+    assert resample.to_primitive(quotes) == {
+        "date": ["2017-01-02"],
+        "open": [None],
+        "close": [1.5],
+        "high": [None],
+        "low": [None],
+        "volume": [None],
+    }
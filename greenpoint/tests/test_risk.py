@@ -0,0 +1,115 @@
+import asyncio
+import datetime
+
+import numpy
+
+from greenpoint import instrument
+from greenpoint import portfolio
+from greenpoint import risk
+from greenpoint import utils
+
+
+def _quotes(start, closes):
+    start = numpy.datetime64(start, "D")
+    return instrument.QuoteColumns.from_lists(
+        start + numpy.arange(len(closes)), close=closes)
+
+
+def test_align_returns():
+    quotes = {
+        "A": _quotes("2017-01-02", [10.0, 11.0, numpy.nan, 12.1, 13.31]),
+        # Starts later, with a holiday
+        "B": instrument.QuoteColumns.from_lists(
+            numpy.array(["2017-01-03", "2017-01-04", "2017-01-06"],
+                        dtype="datetime64[D]"),
+            close=[100.0, 50.0, 100.0]),
+    }
+    dates, returns = risk.align_returns(quotes, ["A", "B"])
+    # Missing closes are the previous ones
+    assert list(dates) == list(numpy.arange(
+        "2017-01-04", "2017-01-07", dtype="datetime64[D]"))
+    numpy.testing.assert_allclose(returns, [
+        [0.0, -0.5],
+        [0.1, 0.0],
+        [0.1, 1.0],
+    ])
+    dates, returns = risk.align_returns(quotes, ["A", "B"], window=1)
+    assert list(dates) == [numpy.datetime64("2017-01-06")]
+
+
+def test_covariance_update():
+    rng = numpy.random.default_rng(42)
+    dates = numpy.datetime64("2017-01-02") + numpy.arange(300)
+    returns = rng.normal(0, 0.01, (300, 5))
+    cov = risk.Covariance(dates[:250], returns[:250])
+    numpy.testing.assert_allclose(
+        cov.matrix, numpy.cov(returns[:250], rowvar=False))
+    for day in range(1, 4):
+        assert cov.update(dates[day:250 + day], returns[day:250 + day])
+    numpy.testing.assert_allclose(
+        cov.matrix, numpy.cov(returns[3:253], rowvar=False))
+    # Changed returns are not merged
+    changed = returns[4:254].copy()
+    changed[0, 0] = 1
+    assert not cov.update(dates[4:254], changed)
+    assert not cov.update(dates[200:300], returns[200:300])
+
+
+def test_risk():
+    rng = numpy.random.default_rng(1)
+    returns = rng.normal(0, 0.01, (100, 3))
+    result = risk.Risk(
+        isins=["A", "B", "C"], names=["A", "B", "C"], start=None, stop=None,
+        weights=numpy.array([0.5, 0.3, 0.2]),
+        covariance=numpy.cov(returns, rowvar=False))
+    assert abs(result.contributions.sum() - 1) < 1e-12
+    numpy.testing.assert_allclose(
+        numpy.diag(result.correlation), numpy.ones(3))
+    portfolio_returns = returns @ result.weights
+    assert abs(result.volatility - numpy.std(portfolio_returns, ddof=1) *
+               numpy.sqrt(risk.TRADING_DAYS_PER_YEAR)) < 1e-12
+    primitive = result.to_primitive()
+    assert [h["instrument_isin"] for h in primitive["holdings"]] == [
+        "A", "B", "C"]
+    assert len(primitive["correlation"]) == 3
+
+
+def test_get_risk(database):
+    def buy(isin, price):
+        return portfolio.Operation(
+            instrument_isin=isin, type=portfolio.OperationType.TRADE,
+            date=datetime.date(2017, 1, 2), quantity=1.0, price=price,
+            fees=0.0, taxes=0.0, currency="EUR")
+
+    async def get_risk():
+        pool = await utils.get_db()
+        for isin, quote in (("FR0011665280", 10.0), ("NL0000235190", 30.0),
+                            ("FR0000120271", 20.0)):
+            await instrument.Instrument(
+                isin=isin, type=instrument.InstrumentType.STOCK, name=isin,
+                symbol=None, currency="EUR", exchange_mic="XPAR",
+                pea=None, pea_pme=None, ttf=None).save()
+            await pool.execute(
+                "UPDATE instruments SET latest_quote = $1 WHERE isin = $2",
+                quote, isin)
+        await portfolio.Operation.drop_save_all("pea", [
+            buy("FR0011665280", 10.0), buy("NL0000235190", 30.0),
+            buy("FR0000120271", 20.0)])
+        instrument.QUOTES_CACHE["FR0011665280"] = _quotes(
+            "2017-01-02", [10.0, 11.0, 10.0, 12.0])
+        instrument.QUOTES_CACHE["NL0000235190"] = _quotes(
+            "2017-01-02", [30.0, 31.0, 29.0, 30.0])
+        # No history
+        instrument.QUOTES_CACHE["FR0000120271"] = _quotes(
+            "2017-01-02", [])
+        first = await risk.get_risk()
+        second = await risk.get_risk()
+        await utils.close_db()
+        return first, second
+
+    first, second = asyncio.run(get_risk())
+    assert first.isins == ["FR0011665280", "NL0000235190"]
+    numpy.testing.assert_allclose(first.weights, [0.25, 0.75])
+    assert first.start == datetime.date(2017, 1, 3)
+    assert first.stop == datetime.date(2017, 1, 5)
+    numpy.testing.assert_allclose(second.covariance, first.covariance)
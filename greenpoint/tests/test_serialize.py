@@ -0,0 +1,71 @@
+import datetime
+import decimal
+import json
+
+import pytest
+
+from greenpoint import serialize
+
+
+ROWS = [
+    {"isin": "FR0011665280",
+     "position": decimal.Decimal("12.5"),
+     "date": datetime.date(2017, 12, 20),
+     "time": datetime.datetime(2017, 12, 20, 17, 35,
+                               tzinfo=datetime.timezone.utc),
+     "delay": datetime.timedelta(minutes=15),
+     "quote": None},
+    {"isin": "FR0000120578",
+     "position": decimal.Decimal("3"),
+     "date": datetime.date(2018, 1, 2),
+     "time": None,
+     "delay": datetime.timedelta(0),
+     "quote": decimal.Decimal("80.5")},
+]
+
+EXPECTED = [
+    {"isin": "FR0011665280",
+     "position": 12.5,
+     "date": "2017-12-20",
+     "time": "2017-12-20T17:35:00+00:00",
+     "delay": 900.0,
+     "quote": None},
+    {"isin": "FR0000120578",
+     "position": 3.0,
+     "date": "2018-01-02",
+     "time": None,
+     "delay": 0.0,
+     "quote": 80.5},
+]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(serialize, "orjson", None)
+    elif serialize.orjson is None:
+        pytest.skip("orjson is not installed")
+    serialize._compile_encoder.cache_clear()
+    yield
+    serialize._compile_encoder.cache_clear()
+
+
+def test_encode(backend):
+    encoder = serialize.compile_encoder(ROWS[0])
+    assert encoder is serialize.compile_encoder(ROWS[0])
+    assert json.loads(encoder.encode(ROWS)) == EXPECTED
+
+
+def test_iter_encode(backend):
+    encoder = serialize.compile_encoder(ROWS[0])
+    rows = ROWS * 5
+    chunks = list(encoder.iter_encode(rows, chunk_size=3))
+    assert len(chunks) == 6
+    assert json.loads(b"".join(chunks)) == EXPECTED * 5
+    assert json.loads(b"".join(encoder.iter_encode([]))) == []
+
+
+def test_dumps(backend):
+    assert json.loads(serialize.dumps(
+        {"a": [decimal.Decimal("1.5"), datetime.date(2017, 1, 1)]})) == {
+            "a": [1.5, "2017-01-01"]}
@@ -0,0 +1,148 @@
+import asyncio
+import datetime
+
+import pytest
+
+from greenpoint import instrument
+from greenpoint import portfolio
+from greenpoint import sqlite
+from greenpoint import utils
+from greenpoint.benchmarks import providers
+
+
+FIGEAC = dict(
+    isin="FR0011665280",
+    type=instrument.InstrumentType.STOCK,
+    name="Figeac Aero",
+    symbol="FGA",
+    currency="EUR",
+    exchange_mic="XPAR",
+    pea=True, pea_pme=None, ttf=False)
+
+
+def run(coro):
+    async def _run():
+        try:
+            return await coro
+        finally:
+            await utils.close_db()
+    return asyncio.run(_run())
+
+
+def test_translate():
+    assert sqlite._translate(
+        "SELECT * FROM quotes WHERE instrument_isin = any($1::text[]) "
+        "AND name ILIKE $2 AND close::float8 > $10") == (
+        "SELECT * FROM quotes WHERE instrument_isin IN "
+        "(SELECT value FROM json_each(?1)) "
+        "AND name LIKE ?2 AND close > ?10")
+
+
+def test_parse_url():
+    assert sqlite.parse_url("sqlite:///greenpoint.db") == "greenpoint.db"
+    assert sqlite.parse_url("sqlite:////var/gp.db") == "/var/gp.db"
+    assert sqlite.parse_url("sqlite://") == sqlite.MEMORY
+
+
+def test_save_load(database):
+    async def save_load():
+        await instrument.Instrument(**FIGEAC).save()
+        # Saving again keeps the stored instrument
+        await instrument.Instrument(**dict(FIGEAC, name="Other")).save()
+        return await instrument.Instrument.load(name="figeac")
+
+    inst = run(save_load())
+    assert inst == instrument.Instrument(**FIGEAC)
+    assert inst.pea is True
+    assert inst.is_alive is True
+
+
+def test_refresh_quotes(database, monkeypatch):
+    async def refresh():
+        async with providers.ProviderServer(history_days=30) as server:
+            for name, url in server.urls().items():
+                monkeypatch.setattr(instrument.Instrument, name, url)
+            inst = instrument.Instrument(**FIGEAC)
+            await inst.save()
+            found = await inst.refresh_quotes(providers=["yahoo"])
+            # Upserting the same quotes again is harmless
+            await inst.refresh_quotes(providers=["yahoo"])
+            pool = await utils.get_db()
+            count = await pool.fetchval(
+                "SELECT count(*) FROM quotes WHERE instrument_isin = $1",
+                inst.isin)
+            last = await pool.fetchval(
+                "SELECT max(date) FROM quotes WHERE instrument_isin = $1",
+                inst.isin)
+            ts, quote = await inst.refresh_live_quote()
+            stored = await pool.fetchrow(
+                "SELECT * FROM instruments WHERE isin = $1", inst.isin)
+            return found, count, last, ts, quote, stored
+
+    found, count, last, ts, quote, stored = run(refresh())
+    assert found == count > 0
+    assert isinstance(last, datetime.date)
+    assert stored["latest_quote"] == quote
+    assert stored["latest_quote_time"] == ts
+
+
+def test_drop_save_all(database):
+    def op(date, quantity, price):
+        return portfolio.Operation(
+            instrument_isin=FIGEAC["isin"],
+            type=portfolio.OperationType.TRADE,
+            date=date, quantity=quantity, price=price,
+            fees=1.0, taxes=0.0, currency="EUR")
+
+    notified = []
+
+    async def save():
+        pool = await utils.get_db()
+        async with pool.acquire() as con:
+            await con.add_listener(
+                utils.CHANGES_CHANNEL,
+                lambda *args: notified.append(args[-1]))
+            await instrument.Instrument(**FIGEAC).save()
+            await portfolio.Operation.drop_save_all("pea", [
+                op(datetime.date(2017, 1, 2), 10.0, 20.0),
+                op(datetime.date(2017, 2, 1), -10.0, 25.0),
+                op(datetime.date(2017, 3, 1), 5.0, 30.0),
+            ])
+            await asyncio.sleep(0)
+            history = await pool.fetch(
+                "SELECT * FROM portfolios_history "
+                "WHERE portfolio_name = $1", "pea")
+            status = await portfolio.get_status_for_broker("pea")
+            return history, status
+
+    history, status = run(save())
+    assert notified == ["operations:pea"]
+    assert [(row["date"], row["position"], row["ownership_partition"])
+            for row in history] == [
+        (datetime.date(2017, 3, 1), 5.0, 1),
+        (datetime.date(2017, 2, 1), 0.0, 1),
+        (datetime.date(2017, 1, 2), 10.0, 0),
+    ]
+    assert len(status) == 1
+    assert status[0]["position"] == 5.0
+    assert status[0]["ppu"] == 29.8
+    assert status[0]["name"] == FIGEAC["name"]
+
+
+def test_transaction_rollback(database):
+    async def rollback():
+        pool = await utils.get_db()
+        async with pool.acquire() as con:
+            with pytest.raises(ValueError):
+                async with con.transaction():
+                    await con.execute(
+                        "INSERT INTO instruments (isin, name, type, currency) "
+                        "VALUES ($1, $2, 'stock', 'EUR')",
+                        FIGEAC["isin"], FIGEAC["name"])
+                    async with con.transaction():
+                        await con.execute("DELETE FROM instruments")
+                    raise ValueError
+            return await con.fetchval("SELECT count(*) FROM instruments")
+
+    # Only the EUR instrument created with the schema is left
+    assert run(rollback()) == 1
@@ -0,0 +1,103 @@
+import asyncio
+import datetime
+
+from dateutil import tz
+
+from greenpoint import instrument
+from greenpoint import ticks
+from greenpoint import utils
+from greenpoint.benchmarks import providers
+
+
+FIGEAC = dict(
+    isin="FR0011665280",
+    type=instrument.InstrumentType.STOCK,
+    name="Figeac Aero",
+    symbol="FGA",
+    currency="EUR",
+    exchange_mic="XPAR",
+    pea=True, pea_pme=None, ttf=False)
+
+
+def run(coro):
+    async def _run():
+        try:
+            return await coro
+        finally:
+            await utils.close_db()
+    return asyncio.run(_run())
+
+
+def _tick(day, hour, price, **kwargs):
+    return ticks.Tick(
+        instrument_isin=FIGEAC["isin"],
+        time=datetime.datetime(2017, 12, day, hour, tzinfo=tz.UTC),
+        date=datetime.date(2017, 12, day),
+        price=price, **kwargs)
+
+
+def test_writer_batches(database):
+    async def write():
+        await instrument.Instrument(**FIGEAC).save()
+        writer = ticks.TickWriter(batch_size=3)
+        await writer.add(_tick(20, 9, 10.0))
+        await writer.add(_tick(20, 10, 11.0))
+        pending = await ticks.get_ticks(FIGEAC["isin"])
+        await writer.add(_tick(20, 11, 12.0))
+        # Adding the same tick again is harmless
+        await writer.add(_tick(20, 11, 12.0))
+        await writer.flush()
+        return pending, await ticks.get_ticks(FIGEAC["isin"])
+
+    pending, stored = run(write())
+    assert pending == []
+    assert [row["price"] for row in stored] == [10.0, 11.0, 12.0]
+
+
+def test_compact(database):
+    async def compact():
+        await instrument.Instrument(**FIGEAC).save()
+        await ticks.save([
+            _tick(18, 9, 10.0),
+            _tick(18, 12, 13.0),
+            _tick(18, 16, 11.0),
+            _tick(19, 9, 20.0),
+            _tick(19, 16, 21.0, open=19.0, high=25.0, low=18.0,
+                  volume=1000),
+            _tick(20, 9, 30.0),
+        ])
+        result = await ticks.compact(datetime.date(2017, 12, 20),
+                                     retention_days=1)
+        # Compacting again adds nothing
+        again = await ticks.compact(datetime.date(2017, 12, 20),
+                                    retention_days=1)
+        pool = await utils.get_db()
+        quotes = await pool.fetch(
+            "SELECT date, open, close, high, low, volume FROM quotes "
+            "ORDER BY date")
+        left = await ticks.get_ticks(FIGEAC["isin"],
+                                     datetime.date(2017, 12, 1))
+        return result, again, quotes, left
+
+    result, again, quotes, left = run(compact())
+    assert result == (2, 3)
+    assert again == (0, 0)
+    assert [tuple(row.values()) for row in quotes] == [
+        (datetime.date(2017, 12, 18), 10.0, 11.0, 13.0, 10.0, None),
+        (datetime.date(2017, 12, 19), 19.0, 21.0, 25.0, 18.0, 1000),
+    ]
+    assert [row["price"] for row in left] == [20.0, 21.0, 30.0]
+
+
+def test_refresh_live_quote_stores_tick(database, monkeypatch):
+    async def refresh():
+        async with providers.ProviderServer(history_days=5) as server:
+            monkeypatch.setattr(instrument.Instrument, "YAHOO_URL",
+                                server.urls()["YAHOO_URL"])
+            inst = instrument.Instrument(**FIGEAC)
+            await inst.save()
+            ts, quote = await inst.refresh_live_quote()
+            return ts, quote, await ticks.get_ticks(inst.isin)
+
+    ts, quote, stored = run(refresh())
+    assert [(row["time"], row["price"]) for row in stored] == [(ts, quote)]
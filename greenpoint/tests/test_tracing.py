@@ -0,0 +1,68 @@
+import asyncio
+import collections
+import json
+
+import pytest
+
+from greenpoint import tracing
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACER", None)
+    return tracing.start()
+
+
+def _spans(tracer):
+    return [e for e in tracer.events if e["ph"] == "X"]
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACER", None)
+    with tracing.span("noop"):
+        pass
+    tracing.record("noop", "test", 1.0)
+    assert not tracing.enabled()
+
+
+def test_span(tracer, tmpdir):
+    with tracing.span("outer", isin="FR0011665280"):
+        with pytest.raises(ValueError):
+            with tracing.span("inner", "parse"):
+                raise ValueError
+    inner, outer = _spans(tracer)
+    assert outer["name"] == "outer"
+    assert outer["args"] == {"isin": "FR0011665280"}
+    assert inner["cat"] == "parse"
+    assert inner["args"] == {"error": "ValueError"}
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+
+    path = str(tmpdir.join("trace.json"))
+    tracer.write(path)
+    with open(path) as f:
+        assert len(json.load(f)["traceEvents"]) == 3
+
+
+def test_tasks_lanes(tracer):
+    async def work():
+        with tracing.span("work"):
+            await asyncio.sleep(0)
+
+    async def run():
+        await asyncio.gather(work(), work())
+
+    asyncio.run(run())
+    spans = _spans(tracer)
+    assert [span["name"] for span in spans] == ["work", "work"]
+    assert spans[0]["tid"] != spans[1]["tid"]
+
+
+def test_log_query(tracer):
+    Record = collections.namedtuple("Record", ("query", "elapsed",
+                                               "exception"))
+    tracing.log_query(Record("SELECT 1", 0.5, None))
+    span, = _spans(tracer)
+    assert span["cat"] == "db"
+    assert span["args"] == {"query": "SELECT 1"}
+    assert span["dur"] == 500000
@@ -0,0 +1,79 @@
+import asyncio
+import datetime
+
+import numpy
+
+import pytest
+
+from greenpoint import utils
+
+
+@pytest.mark.parametrize("s,fmt,expected", [
+    ("02/01/2017", "%d/%m/%Y", datetime.date(2017, 1, 2)),
+    ("2/1/2017", "%d/%m/%Y", datetime.date(2017, 1, 2)),
+    ("20170102", "%Y%m%d", datetime.date(2017, 1, 2)),
+    ("Apr 21, 2017", "%b %d, %Y", datetime.date(2017, 4, 21)),
+    ("Apr 3, 2017", "%b %d, %Y", datetime.date(2017, 4, 3)),
+    ("2017-01-02", "%Y-%m-%d", datetime.date(2017, 1, 2)),
+])
+def test_strpdate(s, fmt, expected):
+    assert utils.strpdate(s, fmt) == expected
+
+
+@pytest.mark.parametrize("s,fmt", [
+    ("01-02-2017", "%d/%m/%Y"),
+    ("31/02/2017", "%d/%m/%Y"),
+    ("2017010", "%Y%m%d"),
+    ("Foo 21, 2017", "%b %d, %Y"),
+    ("+0170102", "%Y%m%d"),
+    ("02/01/-017", "%d/%m/%Y"),
+    ("+2/01/2017", "%d/%m/%Y"),
+    ("Apr 21, 17", "%b %d, %Y"),
+    ("Apr 021, 2017", "%b %d, %Y"),
+    ("Apr +1, 2017", "%b %d, %Y"),
+])
+def test_strpdate_invalid(s, fmt):
+    with pytest.raises(ValueError):
+        utils.strpdate(s, fmt)
+    with pytest.raises(ValueError):
+        utils.strpdates([s], fmt)
+
+
+def test_strpdates():
+    dates = utils.strpdates(["02/01/2017", "31/12/2020"], "%d/%m/%Y")
+    assert dates.dtype == numpy.dtype("datetime64[D]")
+    assert dates.tolist() == [datetime.date(2017, 1, 2),
+                              datetime.date(2020, 12, 31)]
+    # Not padded
+    assert utils.strpdates(["2/1/2017"], "%d/%m/%Y").tolist() == [
+        datetime.date(2017, 1, 2)]
+    assert utils.strpdates(["20170102"], "%Y%m%d").tolist() == [
+        datetime.date(2017, 1, 2)]
+    assert utils.strpdates(["Apr 21, 2017"], "%b %d, %Y").tolist() == [
+        datetime.date(2017, 4, 21)]
+    assert len(utils.strpdates([], "%Y%m%d")) == 0
+
+
+def test_get_db_retries_after_failure(database, monkeypatch):
+    create_pool = utils._create_pool
+    calls = []
+
+    async def _create_pool(dburl, max_size, loop):
+        calls.append(dburl)
+        if len(calls) == 1:
+            raise OSError("Connection refused")
+        return await create_pool(dburl, max_size, loop)
+
+    monkeypatch.setattr(utils, "_create_pool", _create_pool)
+
+    async def _run():
+        with pytest.raises(OSError):
+            await utils.get_db()
+        try:
+            pool = await utils.get_db()
+            assert await pool.fetchval("select 1") == 1
+        finally:
+            await utils.close_db()
+
+    asyncio.run(_run())
+    assert len(calls) == 2
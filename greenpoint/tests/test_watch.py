@@ -0,0 +1,112 @@
+import asyncio
+import datetime
+
+from dateutil import tz
+
+from greenpoint import instrument
+from greenpoint import market
+from greenpoint import utils
+from greenpoint import watch
+
+
+UTC = tz.UTC
+
+
+def _state(mic):
+    inst = instrument.Instrument(
+        isin="FR0011665280",
+        type=instrument.InstrumentType.STOCK,
+        name="Figeac Aero",
+        symbol="FGA",
+        currency="EUR",
+        exchange_mic=mic,
+        pea=None, pea_pme=None, ttf=None)
+    return watch.WatchedInstrument(
+        instrument=inst,
+        market=market.get_market(mic),
+        interval=datetime.timedelta(seconds=60),
+        next_time=None)
+
+
+def test_schedule_adapts_interval():
+    watcher = watch.QuoteWatcher(None, min_interval=60, max_interval=300)
+    state = _state("XPAR")
+    now = datetime.datetime(2017, 12, 20, 10, 0, tzinfo=UTC)
+    assert watcher.schedule(state, now, False) == (
+        now + datetime.timedelta(seconds=120))
+    watcher.schedule(state, now, False)
+    watcher.schedule(state, now, False)
+    assert watcher.schedule(state, now, False) == (
+        now + datetime.timedelta(seconds=300))
+    assert watcher.schedule(state, now, True) == (
+        now + datetime.timedelta(seconds=60))
+
+
+def test_schedule_market_hours():
+    watcher = watch.QuoteWatcher(None, min_interval=60, max_interval=3600)
+    state = _state("XPAR")
+    state.interval = datetime.timedelta(seconds=3600)
+    # Close to the end of the session: fetch the close once
+    now = datetime.datetime(2017, 12, 20, 16, 0, tzinfo=UTC)
+    assert watcher.schedule(state, now, False) == datetime.datetime(
+        2017, 12, 20, 16, 40, tzinfo=UTC)
+    # Market closed: wait for the next session
+    now = datetime.datetime(2017, 12, 20, 16, 40, tzinfo=UTC)
+    assert watcher.schedule(state, now, False) == datetime.datetime(
+        2017, 12, 21, 8, 0, tzinfo=UTC)
+    assert state.interval == datetime.timedelta(seconds=60)
+
+    state = _state(None)
+    assert watcher.schedule(state, now, True) == (
+        now + datetime.timedelta(seconds=3600))
+
+
+def test_failing_instrument_does_not_stop_others():
+    watcher = watch.QuoteWatcher(None, min_interval=60, max_interval=300)
+    now = watch.utcnow()
+    failing, working = _state(None), _state(None)
+    working.instrument.isin = "FR0000120271"
+
+    async def fail(session, writer):
+        raise KeyError("regularMarketPrice")
+
+    async def refresh(session, writer):
+        return now, 42.0
+
+    failing.instrument.refresh_live_quote = fail
+    working.instrument.refresh_live_quote = refresh
+    for state in (failing, working):
+        state.next_time = now
+    watcher.watched = {state.instrument.isin: state
+                       for state in (failing, working)}
+    watcher.next_reload = now + datetime.timedelta(hours=1)
+
+    asyncio.run(watcher.run_once())
+    assert working.last_quote == 42.0
+    assert failing.last_quote is None
+    # Both are scheduled again
+    assert failing.next_time > now
+    assert working.next_time > now
+
+
+def test_reload_alerts_on_change():
+    class Engine(object):
+        loads = 0
+
+        async def load(self):
+            self.loads += 1
+
+    engine = Engine()
+    watcher = watch.QuoteWatcher(None, alerts=engine)
+    watcher.next_reload = watch.utcnow() + datetime.timedelta(hours=1)
+
+    watcher.on_change(None, 0, utils.CHANGES_CHANNEL, "quotes:FR0011665280")
+    asyncio.run(watcher.run_once())
+    assert engine.loads == 0
+
+    watcher.on_change(None, 0, utils.CHANGES_CHANNEL, "alerts")
+    assert watcher.wakeup.is_set()
+    asyncio.run(watcher.run_once())
+    assert engine.loads == 1
+    asyncio.run(watcher.run_once())
+    assert engine.loads == 1
@@ -0,0 +1,281 @@
+import asyncio
+import datetime
+
+from aiohttp import test_utils
+
+import numpy
+
+from greenpoint import instrument
+from greenpoint import portfolio
+from greenpoint import resample
+from greenpoint import risk
+from greenpoint import utils
+from greenpoint import web
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.listeners = {}
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    async def remove_listener(self, channel, callback):
+        del self.listeners[channel]
+
+
+class FakePool(object):
+    def __init__(self):
+        self.connection = FakeConnection()
+
+    async def acquire(self):
+        return self.connection
+
+    async def release(self, connection):
+        pass
+
+
+def _patch_db(monkeypatch):
+    pool = FakePool()
+
+    async def get_db(loop=None, max_size=None):
+        return pool
+
+    async def close_db(loop=None):
+        pass
+
+    monkeypatch.setattr(utils, "get_db", get_db)
+    monkeypatch.setattr(utils, "close_db", close_db)
+    return pool
+
+
+def _request(monkeypatch, path):
+    _patch_db(monkeypatch)
+
+    async def request():
+        async with test_utils.TestClient(
+                test_utils.TestServer(web.make_app())) as client:
+            resp = await client.get(path)
+            if resp.content_type == "application/json":
+                body = await resp.json()
+            else:
+                body = await resp.text()
+            return resp, body
+
+    return asyncio.run(request())
+
+
+def test_quotes(monkeypatch):
+    async def get_chart(isin, start, stop, freq, points):
+        assert isin == "FR0011665280"
+        assert start == datetime.date(2017, 1, 1)
+        assert stop is None
+        assert freq == "week"
+        assert points == 10
+        return instrument.QuoteColumns.from_lists(
+            [datetime.date(2017, 1, 2)], close=[1.5])
+
+    monkeypatch.setattr(resample, "get_chart", get_chart)
+    resp, body = _request(
+        monkeypatch,
+        "/quotes/fr0011665280?start=2017-01-01&freq=week&points=10")
+    assert resp.status == 200
+    assert resp.headers["Access-Control-Allow-Origin"] == "*"
+    assert body["date"] == ["2017-01-02"]
+    assert body["close"] == [1.5]
+
+
+def test_quotes_invalid(monkeypatch):
+    resp, body = _request(monkeypatch, "/quotes/FR0011665280?freq=day")
+    assert resp.status == 400
+    assert resp.headers["Access-Control-Allow-Origin"] == "*"
+    resp, body = _request(monkeypatch, "/quotes/FR0011665280?points=x")
+    assert resp.status == 400
+
+
+def test_portfolio_cache(monkeypatch):
+    pool = _patch_db(monkeypatch)
+    calls = []
+
+    async def get_status(**filters):
+        calls.append(None)
+        return [{"instrument_isin": "FR0011665280", "position": i}
+                for i in range(100 + len(calls))]
+
+    monkeypatch.setattr(portfolio, "get_status", get_status)
+
+    async def requests():
+        async with test_utils.TestClient(
+                test_utils.TestServer(web.make_app())) as client:
+            resp = await client.get("/portfolio")
+            assert resp.status == 200
+            assert resp.headers["Content-Encoding"] == "gzip"
+            body = await resp.json()
+            assert len(body) == 101
+            etag = resp.headers["ETag"]
+
+            resp = await client.get("/portfolio",
+                                    headers={"If-None-Match": etag})
+            assert resp.status == 304
+            assert len(calls) == 1
+
+            notify = pool.connection.listeners[utils.CHANGES_CHANNEL]
+            notify(pool.connection, 0, utils.CHANGES_CHANNEL,
+                   "quotes:FR0011665280")
+            resp = await client.get("/portfolio")
+            assert len(calls) == 1
+
+            notify(pool.connection, 0, utils.CHANGES_CHANNEL,
+                   "operations:Fortuneo PEA")
+            resp = await client.get("/portfolio",
+                                    headers={"If-None-Match": etag})
+            assert resp.status == 200
+            assert len(calls) == 2
+
+    asyncio.run(requests())
+
+
+def test_portfolio_filters(monkeypatch):
+    calls = []
+
+    async def get_status(**filters):
+        calls.append(filters)
+        return []
+
+    monkeypatch.setattr(portfolio, "get_status", get_status)
+    resp, body = _request(monkeypatch, "/portfolio?type=etf&pea=true")
+    assert resp.status == 200
+    assert calls == [{"portfolio_name": None, "instrument_type": "etf",
+                      "currency": None, "pea": True}]
+    resp, body = _request(monkeypatch, "/portfolio?type=bond")
+    assert resp.status == 400
+    assert len(calls) == 1
+
+
+def test_portfolio_cache_changed_while_building(monkeypatch):
+    pool = _patch_db(monkeypatch)
+    calls = []
+
+    async def get_status(**filters):
+        calls.append(None)
+        if len(calls) == 1:
+            # The data changes while the response is built
+            notify = pool.connection.listeners[utils.CHANGES_CHANNEL]
+            notify(pool.connection, 0, utils.CHANGES_CHANNEL,
+                   "operations:Fortuneo PEA")
+        return [{"instrument_isin": "FR0011665280", "position": len(calls)}]
+
+    monkeypatch.setattr(portfolio, "get_status", get_status)
+
+    async def requests():
+        async with test_utils.TestClient(
+                test_utils.TestServer(web.make_app())) as client:
+            resp = await client.get("/portfolio")
+            assert (await resp.json())[0]["position"] == 1
+            resp = await client.get("/portfolio")
+            assert (await resp.json())[0]["position"] == 2
+            etag = resp.headers["ETag"]
+            resp = await client.get("/portfolio")
+            assert (await resp.json())[0]["position"] == 2
+            assert len(calls) == 2
+
+            for if_none_match in ('"other", ' + etag, "*"):
+                resp = await client.get(
+                    "/portfolio", headers={"If-None-Match": if_none_match})
+                assert resp.status == 304
+            resp = await client.get(
+                "/portfolio", headers={"If-None-Match": '"other"'})
+            assert resp.status == 200
+
+    asyncio.run(requests())
+
+
+def test_portfolio_stream(monkeypatch):
+    _patch_db(monkeypatch)
+    monkeypatch.setattr(web, "STREAM_MIN_ROWS", 10)
+
+    async def get_status(**filters):
+        return [{"instrument_isin": "FR0011665280", "position": i}
+                for i in range(100)]
+
+    monkeypatch.setattr(portfolio, "get_status", get_status)
+
+    async def requests():
+        async with test_utils.TestClient(
+                test_utils.TestServer(web.make_app())) as client:
+            resp = await client.get("/portfolio")
+            assert resp.status == 200
+            assert resp.headers["Transfer-Encoding"] == "chunked"
+            assert resp.headers["Access-Control-Allow-Origin"] == "*"
+            assert resp.headers["Content-Encoding"] == "gzip"
+            assert "ETag" not in resp.headers
+            assert len(await resp.json()) == 100
+
+            # The streamed body is cached
+            resp = await client.get("/portfolio")
+            assert resp.headers["Content-Encoding"] == "gzip"
+            etag = resp.headers["ETag"]
+            assert len(await resp.json()) == 100
+            resp = await client.get("/portfolio",
+                                    headers={"If-None-Match": etag})
+            assert resp.status == 304
+
+    asyncio.run(requests())
+
+
+def test_live_status(monkeypatch):
+    _patch_db(monkeypatch)
+    app = web.make_app()
+
+    async def get_status(**filters):
+        # Quote notifications must wait for the status to be set
+        assert app[web.LIVE_QUOTES].lock.locked()
+        return [{"instrument_isin": "FR0011665280", "position": 1,
+                 "market_value": 10.0, "ppu": 8.0, "fx_rate": 1.0}]
+
+    monkeypatch.setattr(portfolio, "get_status", get_status)
+
+    async def request():
+        async with test_utils.TestClient(
+                test_utils.TestServer(app)) as client:
+            resp = await client.get("/live")
+            line = await resp.content.readline()
+            resp.close()
+            return line
+
+    assert asyncio.run(request()) == b"event: status\n"
+    assert app[web.LIVE_QUOTES].total == 10.0
+
+
+def test_income(monkeypatch):
+    calls = []
+
+    async def get_income(portfolio_name=None, year=None, monthly=False):
+        calls.append((portfolio_name, year, monthly))
+        return [{"year": 2017, "dividends": 5.0}]
+
+    monkeypatch.setattr(portfolio, "get_income", get_income)
+    resp, body = _request(monkeypatch, "/income?portfolio=pea&year=2017")
+    assert resp.status == 200
+    assert body == [{"year": 2017, "dividends": 5.0}]
+    resp, body = _request(monkeypatch, "/income?monthly=1")
+    assert calls == [("pea", 2017, False), (None, None, True)]
+    resp, body = _request(monkeypatch, "/income?year=last")
+    assert resp.status == 400
+
+
+def test_risk(monkeypatch):
+    async def get_risk(window):
+        return risk.Risk(
+            isins=["FR0011665280"], names=["Figeac Aero"],
+            start=datetime.date(2017, 1, 3), stop=datetime.date(2017, 1, 5),
+            weights=numpy.ones(1), covariance=numpy.full((1, 1), numpy.nan))
+
+    monkeypatch.setattr(risk, "get_risk", get_risk)
+    resp, body = _request(monkeypatch, "/risk?window=10")
+    assert resp.status == 200
+    assert body["start"] == "2017-01-03"
+    assert body["holdings"][0]["volatility"] is None
+    assert body["correlation"] == [[None]]
+    resp, body = _request(monkeypatch, "/risk?window=all")
+    assert resp.status == 400
@@ -0,0 +1,154 @@
+"""Intraday quotes of instruments.
+
+Live quote refreshes append ticks to the `quote_ticks` table. Once a day is
+over, `compact` rolls its ticks into a daily bar of the `quotes` table and
+ticks older than the retention are pruned, so the table stays bounded.
+"""
+import datetime
+
+import attr
+
+import daiquiri
+
+from greenpoint import metrics
+from greenpoint import utils
+
+
+LOG = daiquiri.getLogger(__name__)
+
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_BATCH_SIZE = 500
+
+
+@attr.s(slots=True, frozen=True)
+class Tick(object):
+    instrument_isin = attr.ib()
+    time = attr.ib()
+    # Trading day, in the time zone of the exchange
+    date = attr.ib()
+    price = attr.ib()
+    # Values of the day so far, when the provider has them
+    open = attr.ib(default=None)  # noqa
+    high = attr.ib(default=None)
+    low = attr.ib(default=None)
+    volume = attr.ib(default=None)
+
+
+async def save(ticks):
+    """Store ticks, ignoring the ones already stored.
+
+    :param ticks: A list of `Tick`.
+    """
+    if not ticks:
+        return
+    pool = await utils.get_db()
+    await pool.executemany(
+        "INSERT INTO quote_ticks "
+        "(instrument_isin, time, date, price, open, high, low, volume) "
+        "VALUES ($1, $2, $3, $4, $5, $6, $7, $8) "
+        "ON CONFLICT (instrument_isin, time) DO NOTHING",
+        [attr.astuple(tick) for tick in ticks])
+    metrics.ROWS_UPSERTED.inc(len(ticks), table="quote_ticks")
+    await utils.notify_change(pool, "ticks")
+
+
+class TickWriter(object):
+    """Store ticks in batches rather than one by one.
+
+    Ticks are written once `batch_size` of them are pending, or when
+    `flush` is called.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = []
+
+    async def add(self, tick):
+        self.pending.append(tick)
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, []
+        await save(pending)
+
+
+async def get_ticks(isin, start=None):
+    """Get the ticks stored for an instrument.
+
+    :param isin: ISIN of the instrument.
+    :param start: Day to start at (included), the last day with ticks by
+                  default.
+    """
+    pool = await utils.get_db()
+    if start is None:
+        return await pool.fetch(
+            "SELECT time, price, volume FROM quote_ticks "
+            "WHERE instrument_isin = $1 AND date = ("
+            "SELECT max(date) FROM quote_ticks WHERE instrument_isin = $1) "
+            "ORDER BY time", isin)
+    return await pool.fetch(
+        "SELECT time, price, volume FROM quote_ticks "
+        "WHERE instrument_isin = $1 AND date >= $2 "
+        "ORDER BY time", isin, start)
+
+
+def get_retention_days():
+    return utils.get_config().get('tick_retention_days',
+                                  DEFAULT_RETENTION_DAYS)
+
+
+# The last tick of a day has the close, and the open, high, low and volume
+# of the day when the provider sent them; otherwise they are computed from
+# the ticks. Quotes already stored, e.g. by history providers, are kept.
+_COMPACT_QUERY = """
+INSERT INTO quotes (instrument_isin, date, open, close, high, low, volume)
+SELECT instrument_isin, date,
+       coalesce(open, first_price), price,
+       greatest(high, max_price), least(low, min_price), volume
+FROM (
+    SELECT *,
+           row_number() OVER (PARTITION BY instrument_isin, date
+                              ORDER BY time DESC) AS rn,
+           first_value(price) OVER (PARTITION BY instrument_isin, date
+                                    ORDER BY time) AS first_price,
+           max(price) OVER (PARTITION BY instrument_isin, date) AS max_price,
+           min(price) OVER (PARTITION BY instrument_isin, date) AS min_price
+    FROM quote_ticks
+    WHERE date < $1
+) AS days
+WHERE rn = 1
+ON CONFLICT (instrument_isin, date) DO NOTHING
+RETURNING instrument_isin
+"""
+
+
+async def compact(before=None, retention_days=None):
+    """Roll the ticks of past days into daily quotes and prune old ticks.
+
+    :param before: First day still in progress, today by default.
+    :param retention_days: Number of days of ticks to keep, from the
+                           configuration by default.
+    :return: The number of quotes added and of ticks deleted.
+    """
+    if before is None:
+        before = datetime.date.today()
+    if retention_days is None:
+        retention_days = get_retention_days()
+    pool = await utils.get_db()
+    async with pool.acquire() as con:
+        async with con.transaction():
+            isins = [row['instrument_isin']
+                     for row in await con.fetch(_COMPACT_QUERY, before)]
+            status = await con.execute(
+                "DELETE FROM quote_ticks WHERE date < $1",
+                before - datetime.timedelta(days=retention_days))
+            deleted = int(status.split()[-1])
+            for isin in sorted(set(isins)):
+                await utils.notify_change(con, "quotes", isin)
+            if deleted:
+                await utils.notify_change(con, "ticks")
+    metrics.ROWS_UPSERTED.inc(len(isins), table="quotes")
+    LOG.info("Added %d daily quotes from ticks, deleted %d ticks",
+             len(isins), deleted)
+    return len(isins), deleted
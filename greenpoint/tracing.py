@@ -0,0 +1,164 @@
+"""Record spans of a run in the Chrome trace event format.
+
+The trace can be opened with chrome://tracing or https://ui.perfetto.dev.
+Tracing is disabled until `start` is called, and spans cost nothing then.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+
+TRACER = None
+
+
+def _current_lane():
+    """Identify the task or thread running, to draw it on its own line."""
+    asyncio = sys.modules.get("asyncio")
+    if asyncio is not None:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            return id(task), task.get_name()
+    thread = threading.current_thread()
+    return thread.ident, thread.name
+
+
+class Tracer(object):
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self.lanes = {}
+
+    def now(self):
+        return time.perf_counter()
+
+    def _tid(self, lane):
+        key, name = lane
+        if key not in self.lanes:
+            self.lanes[key] = len(self.lanes) + 1
+            self.events.append({
+                "name": "thread_name", "ph": "M", "pid": self.pid,
+                "tid": self.lanes[key], "args": {"name": name},
+            })
+        return self.lanes[key]
+
+    def add(self, name, category, start, duration, attrs, lane=None):
+        """Add a complete event.
+
+        :param start: Start time, as returned by `now`.
+        :param duration: Duration in seconds.
+        """
+        self.events.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": duration * 1e6,
+            "pid": self.pid,
+            "tid": self._tid(lane or _current_lane()),
+            "args": attrs,
+        })
+
+    def to_dict(self):
+        return {"traceEvents": self.events, "displayTimeUnit": "ms"}
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, default=str)
+
+
+def start():
+    global TRACER
+    TRACER = Tracer()
+    return TRACER
+
+
+def enabled():
+    return TRACER is not None
+
+
+class span(object):  # noqa
+    """Record the execution of a `with` block.
+
+    :param name: Name of the span.
+    :param category: Category of the span, e.g. `provider` or `db`.
+    :param attrs: Attributes of the span, e.g. the instrument ISIN.
+    """
+
+    __slots__ = ("name", "category", "attrs", "started", "lane")
+
+    def __init__(self, name, category="greenpoint", **attrs):
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+
+    def __enter__(self):
+        if TRACER is not None:
+            self.lane = _current_lane()
+            self.started = TRACER.now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if TRACER is not None:
+            if exc_type is not None:
+                self.attrs["error"] = exc_type.__name__
+            TRACER.add(self.name, self.category, self.started,
+                       TRACER.now() - self.started, self.attrs, self.lane)
+
+
+def record(name, category, duration, lane=None, **attrs):
+    """Record a span that just ended after `duration` seconds."""
+    if TRACER is not None:
+        TRACER.add(name, category, TRACER.now() - duration, duration,
+                   attrs, lane)
+
+
+# Database queries are logged once done, outside of the task that ran them
+_DB_LANE = ("database", "database")
+
+
+def log_query(record_):
+    """Record an asyncpg query, to use with `add_query_logger`."""
+    attrs = {"query": record_.query}
+    if record_.exception is not None:
+        attrs["error"] = type(record_.exception).__name__
+    record("db", "db", record_.elapsed, _DB_LANE, **attrs)
+
+
+def trace_config():
+    """Return an aiohttp client trace config recording HTTP requests."""
+    import aiohttp
+
+    async def on_request_start(session, ctx, params):
+        ctx.lane = _current_lane()
+        ctx.started = TRACER.now()
+
+    async def on_request_end(session, ctx, params):
+        TRACER.add("http", "http", ctx.started, TRACER.now() - ctx.started,
+                   {"method": params.method, "url": str(params.url),
+                    "status": params.response.status}, ctx.lane)
+
+    async def on_request_exception(session, ctx, params):
+        TRACER.add("http", "http", ctx.started, TRACER.now() - ctx.started,
+                   {"method": params.method, "url": str(params.url),
+                    "error": type(params.exception).__name__}, ctx.lane)
+
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(on_request_start)
+    config.on_request_end.append(on_request_end)
+    config.on_request_exception.append(on_request_exception)
+    return config
+
+
+def requests_hook(provider):
+    """Return a `requests` response hook recording page fetches."""
+    def hook(response, *args, **kwargs):
+        record("http", "http", response.elapsed.total_seconds(),
+               provider=provider, method=response.request.method,
+               url=response.url, status=response.status_code)
+    return hook
@@ -1,15 +1,13 @@
-import asyncio
+import datetime
+import functools
 import itertools
 import weakref
 
-import asyncpg.pool
-
-from dateutil import tz
-
-import iso8601
-
 import yaml
 
+from greenpoint import metrics
+from greenpoint import tracing
+
 
 def grouper(iterable, n):
     it = iter(iterable)
@@ -22,26 +20,171 @@ def grouper(iterable, n):
 
 def get_config():
     with open("config.yaml") as f:
-        return yaml.load(f.read())
+        return yaml.safe_load(f.read())
 
 
 POOLS = weakref.WeakKeyDictionary()
 
+DEFAULT_POOL_SIZE = 50
+
+
+class _AcquireContext(object):
+    __slots__ = ("context",)
+
+    def __init__(self, context):
+        self.context = context
+
+    @staticmethod
+    async def _wait(acquire):
+        with metrics.DB_POOL_ACQUIRE_WAIT.time():
+            return await acquire
+
+    def __await__(self):
+        return self._wait(self.context).__await__()
+
+    async def __aenter__(self):
+        return await self._wait(self.context.__aenter__())
+
+    async def __aexit__(self, *exc_info):
+        return await self.context.__aexit__(*exc_info)
+
+
+class MeteredPool(object):
+    """A database pool measuring how long connections are waited for."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    def acquire(self, *, timeout=None):
+        return _AcquireContext(self.pool.acquire(timeout=timeout))
+
+    async def execute(self, query, *args, timeout=None):
+        async with self.acquire() as con:
+            return await con.execute(query, *args, timeout=timeout)
+
+    async def executemany(self, command, args, *, timeout=None):
+        async with self.acquire() as con:
+            return await con.executemany(command, args, timeout=timeout)
+
+    async def fetch(self, query, *args, timeout=None):
+        async with self.acquire() as con:
+            return await con.fetch(query, *args, timeout=timeout)
+
+    async def fetchrow(self, query, *args, timeout=None):
+        async with self.acquire() as con:
+            return await con.fetchrow(query, *args, timeout=timeout)
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        async with self.acquire() as con:
+            return await con.fetchval(query, *args, column=column,
+                                      timeout=timeout)
+
+
+def _pool_connections():
+    connections = {"in_use": 0, "idle": 0, "max": 0}
+    for task in list(POOLS.values()):
+        if not task.done() or task.cancelled() or task.exception():
+            continue
+        pool = task.result()
+        idle = pool.get_idle_size()
+        connections["in_use"] += pool.get_size() - idle
+        connections["idle"] += idle
+        connections["max"] += pool.get_max_size()
+    return {(state,): value for state, value in connections.items()}
+
+
+metrics.DB_POOL_CONNECTIONS.set_function(_pool_connections)
+
+
+async def _init_connection(connection):
+    if tracing.enabled():
+        connection.add_query_logger(tracing.log_query)
+
+
+async def _create_pool(dburl, max_size, loop):
+    if dburl.startswith("sqlite:"):
+        from greenpoint import sqlite
+
+        return MeteredPool(await sqlite.create_pool(dburl, max_size))
+
+    import asyncpg.pool
+
+    return MeteredPool(await asyncpg.pool.create_pool(
+        dburl, max_size=max_size, loop=loop, init=_init_connection))
+
+
+def _forget_failed_pool(loop, task):
+    # Let the next caller retry, e.g. once the database server is up
+    if ((task.cancelled() or task.exception() is not None) and
+            POOLS.get(loop) is task):
+        del POOLS[loop]
+
+
+async def get_db(loop=None, max_size=None):
+    """Get the database connection pool of the event loop.
+
+    The `database` of the configuration is a PostgreSQL URL, or a
+    `sqlite://` URL to use an embedded database, see `greenpoint.sqlite`.
+    The pool is created on first use and then shared by everything running
+    on the loop, including concurrent first callers. If creating it fails,
+    the next call tries again.
+
+    :param max_size: Size of the pool if it has to be created.
+    """
+    import asyncio
 
-async def get_db(loop=None):
-    global POOLS
     if loop is None:
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
     if loop not in POOLS:
-        dburl = get_config().get('database')
+        config = get_config()
+        dburl = config.get('database')
         if not dburl:
             raise RuntimeError("No `database` in configuration file")
-        POOLS[loop] = asyncpg.pool.create_pool(dburl, max_size=50, loop=loop)
-        await POOLS[loop]
-    return POOLS[loop]
+        if max_size is None:
+            max_size = config.get('database_pool_size', DEFAULT_POOL_SIZE)
+        task = loop.create_task(_create_pool(dburl, max_size, loop))
+        task.add_done_callback(functools.partial(_forget_failed_pool, loop))
+        POOLS[loop] = task
+    return await POOLS[loop]
+
+
+async def close_db(loop=None):
+    import asyncio
+
+    if loop is None:
+        loop = asyncio.get_running_loop()
+    pool = POOLS.pop(loop, None)
+    if pool is not None:
+        await (await pool).close()
 
 
-LOCAL_TIMEZONE = tz.gettz()
+# Channel notified when stored data changes, with payloads like `kind:key`
+CHANGES_CHANNEL = "greenpoint_changes"
+# Channel notified by a trigger when `instruments.latest_quote` changes
+LIVE_QUOTES_CHANNEL = "greenpoint_live_quotes"
+
+
+async def notify_change(con, kind, key=None):
+    """Notify listeners that some data changed.
+
+    Inside a transaction, the notification is only delivered on commit.
+
+    :param con: The connection or pool that made the change.
+    :param kind: The kind of data, e.g. `operations` or `quotes`.
+    :param key: What changed, e.g. an ISIN.
+    """
+    payload = kind if key is None else "%s:%s" % (kind, key)
+    await con.execute("SELECT pg_notify($1, $2)", CHANGES_CHANNEL, payload)
+
+
+@functools.lru_cache()
+def get_local_timezone():
+    from dateutil import tz
+
+    return tz.gettz()
 
 
 def parse_date(s):
@@ -52,4 +195,106 @@ def parse_date(s):
     :param s: The date to parse.
     :type s: str
     """
-    return iso8601.parse_date(s, LOCAL_TIMEZONE).date()
+    import iso8601
+
+    return iso8601.parse_date(s, get_local_timezone()).date()
+
+
+_MONTHS = {name: number for number, name in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+     "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
+
+
+def _parse_dmy(s):
+    if (len(s) != 10 or s[2] != "/" or s[5] != "/" or
+            not (s[:2] + s[3:5] + s[6:]).isdigit()):
+        raise ValueError(s)
+    return datetime.date(int(s[6:]), int(s[3:5]), int(s[:2]))
+
+
+def _parse_ymd(s):
+    if len(s) != 8 or not s.isdigit():
+        raise ValueError(s)
+    return datetime.date(int(s[:4]), int(s[4:6]), int(s[6:]))
+
+
+def _parse_bdy(s):
+    month, day, year = s.split(" ")
+    # Same widths as strptime: %d is at most 2 digits and %Y exactly 4
+    if (not day.endswith(",") or not 1 <= len(day) - 1 <= 2 or
+            not day[:-1].isdigit() or len(year) != 4 or not year.isdigit()):
+        raise ValueError(s)
+    return datetime.date(int(year), _MONTHS[month], int(day[:-1]))
+
+
+# Formats used by providers and brokers, parsed without `strptime`
+_FAST_FORMATS = {
+    "%d/%m/%Y": _parse_dmy,
+    "%Y%m%d": _parse_ymd,
+    "%b %d, %Y": _parse_bdy,
+}
+
+
+@functools.lru_cache(maxsize=8192)
+def strpdate(s, format):  # noqa
+    """Parse a date with a `strptime` format.
+
+    Dates come back many times in payloads, so results are cached.
+
+    :param s: The date to parse.
+    :param format: The `strptime` format of the date.
+    :return: A `datetime.date`.
+    """
+    parse = _FAST_FORMATS.get(format)
+    if parse is not None:
+        try:
+            return parse(s)
+        except (ValueError, KeyError):
+            # Not padded or otherwise unusual: let strptime decide
+            pass
+    return datetime.datetime.strptime(s, format).date()
+
+
+# Fixed-width formats: width, separators and where the characters of the
+# ISO 8601 date are, `None` being a dash
+_ISO_LAYOUTS = {
+    "%d/%m/%Y": (10, {2: "/", 5: "/"},
+                 (6, 7, 8, 9, None, 3, 4, None, 0, 1)),
+    "%Y%m%d": (8, {}, (0, 1, 2, 3, None, 4, 5, None, 6, 7)),
+}
+
+
+def strpdates(strings, format):  # noqa
+    """Parse a column of dates with a `strptime` format.
+
+    Fixed-width formats are converted to ISO 8601 and parsed by NumPy at
+    once; other formats go through `strpdate`.
+
+    :param strings: The dates to parse.
+    :param format: The `strptime` format of the dates.
+    :return: A NumPy array of `datetime64[D]`.
+    """
+    import numpy
+
+    strings = numpy.asarray(strings, dtype=str)
+    layout = _ISO_LAYOUTS.get(format)
+    if layout is not None and len(strings):
+        width, separators, positions = layout
+        if (strings.dtype.itemsize // 4 == width and
+                (numpy.char.str_len(strings) == width).all()):
+            chars = strings.view("U1").reshape(-1, width)
+            digits = [i for i in range(width) if i not in separators]
+            # NumPy accepts signs and short years that strptime rejects
+            if (all((chars[:, i] == c).all()
+                    for i, c in separators.items()) and
+                    numpy.char.isdigit(chars[:, digits]).all()):
+                dash = numpy.full(len(strings), "-")
+                iso = numpy.column_stack([
+                    dash if p is None else chars[:, p] for p in positions])
+                try:
+                    return iso.view("U10").ravel().astype("datetime64[D]")
+                except ValueError:
+                    # Let strpdate raise the same errors as strptime
+                    pass
+    return numpy.array([strpdate(s, format) for s in strings.tolist()],
+                       dtype="datetime64[D]")
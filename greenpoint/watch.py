@@ -0,0 +1,182 @@
+import asyncio
+import datetime
+
+import aiohttp
+
+import attr
+
+import daiquiri
+
+from dateutil import tz
+
+from greenpoint import alerts
+from greenpoint import instrument
+from greenpoint import market
+from greenpoint import ticks
+from greenpoint import utils
+
+
+LOG = daiquiri.getLogger(__name__)
+
+# Give the closing auction time to print before fetching the close
+CLOSE_DELAY = datetime.timedelta(minutes=10)
+
+
+def utcnow():
+    return datetime.datetime.now(tz.UTC)
+
+
+@attr.s
+class WatchedInstrument(object):
+    instrument = attr.ib()
+    market = attr.ib()
+    interval = attr.ib()
+    next_time = attr.ib()
+    last_quote = attr.ib(default=None)
+
+
+class QuoteWatcher(object):
+    """Refresh live quotes of instruments while their market is open.
+
+    The polling interval of each instrument is reset to `min_interval` when
+    its quote changes, and doubled up to `max_interval` when it does not.
+    Instruments of closed markets are not polled until the next session,
+    except once after the close to get the closing price. Instruments
+    without a known market are polled every `max_interval`.
+
+    Alert rules are reloaded as soon as a change is notified.
+    """
+
+    def __init__(self, session, min_interval=60, max_interval=900,
+                 concurrency=10, reload_interval=3600, alerts=None):
+        self.session = session
+        self.alerts = alerts
+        self.min_interval = datetime.timedelta(seconds=min_interval)
+        self.max_interval = datetime.timedelta(seconds=max_interval)
+        self.reload_interval = datetime.timedelta(seconds=reload_interval)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.watched = {}
+        self.next_reload = None
+        self.ticks = ticks.TickWriter()
+        self.alerts_changed = False
+        self.wakeup = asyncio.Event()
+
+    def on_change(self, connection, pid, channel, payload):
+        kind, _, _ = payload.partition(":")
+        if kind == "alerts" and self.alerts is not None:
+            self.alerts_changed = True
+            self.wakeup.set()
+
+    async def load(self, now):
+        """(Re)load the instruments to watch, keeping their schedule."""
+        watched = {}
+        for inst in await instrument.Instrument.list_instruments():
+            if not inst.is_alive or inst.yahoo_symbol is None:
+                continue
+            state = self.watched.get(inst.isin)
+            if state is None:
+                state = WatchedInstrument(
+                    instrument=inst,
+                    market=market.get_market(inst.exchange_mic),
+                    interval=self.min_interval,
+                    next_time=now,
+                    last_quote=inst.latest_quote)
+            else:
+                state.instrument = inst
+            watched[inst.isin] = state
+        LOG.info("Watching %d instruments", len(watched))
+        self.watched = watched
+        self.next_reload = now + self.reload_interval
+        if self.alerts is not None:
+            self.alerts_changed = False
+            await self.alerts.load()
+
+    def schedule(self, state, now, changed):
+        """Compute when to refresh an instrument next."""
+        if changed:
+            state.interval = self.min_interval
+        else:
+            state.interval = min(state.interval * 2, self.max_interval)
+
+        if state.market is None:
+            state.next_time = now + self.max_interval
+        elif state.market.is_open(now):
+            state.next_time = min(
+                now + state.interval,
+                state.market.session_end(now) + CLOSE_DELAY)
+        else:
+            state.interval = self.min_interval
+            state.next_time = state.market.next_open(now)
+        return state.next_time
+
+    async def refresh(self, state):
+        changed = False
+        try:
+            async with self.semaphore:
+                result = await state.instrument.refresh_live_quote(
+                    self.session, self.ticks)
+            changed = result is not None and result[1] != state.last_quote
+            if changed:
+                state.last_quote = result[1]
+                if self.alerts is not None:
+                    await self.alerts.check(
+                        state.instrument.isin, result[1], result[0])
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            LOG.warning("Unable to refresh %s", state.instrument,
+                        exc_info=True)
+        except Exception:  # noqa: B902
+            # A bug in a provider must not stop watching the other instruments
+            LOG.exception("Unable to refresh %s", state.instrument)
+        self.schedule(state, utcnow(), changed)
+
+    async def run_once(self):
+        """Refresh the instruments that are due.
+
+        :return: When the next refresh is due.
+        """
+        now = utcnow()
+        if self.next_reload is None or self.next_reload <= now:
+            await self.load(now)
+        elif self.alerts_changed:
+            self.alerts_changed = False
+            await self.alerts.load()
+        due = [state for state in self.watched.values()
+               if state.next_time <= now]
+        if due:
+            await asyncio.gather(*map(self.refresh, due))
+            # One batch of ticks per round of refreshes
+            try:
+                await self.ticks.flush()
+            except Exception:  # noqa: B902
+                # Losing a batch of ticks must not stop the watcher
+                LOG.exception("Unable to store ticks")
+        return min([self.next_reload] +
+                   [state.next_time for state in self.watched.values()])
+
+    async def run(self):
+        pool = await utils.get_db()
+        # Alert rules changed by other processes are notified on this
+        # connection
+        listener = await pool.acquire()
+        await listener.add_listener(utils.CHANGES_CHANNEL, self.on_change)
+        try:
+            while True:
+                next_time = await self.run_once()
+                delay = (next_time - utcnow()).total_seconds()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                self.wakeup.clear()
+        finally:
+            await listener.remove_listener(utils.CHANGES_CHANNEL,
+                                           self.on_change)
+            await pool.release(listener)
+
+
+async def watch(min_interval=60, max_interval=900, concurrency=10):
+    engine = alerts.AlertEngine(alerts.get_sinks())
+    async with instrument.client_session() as session:
+        await QuoteWatcher(session, min_interval, max_interval,
+                           concurrency, alerts=engine).run()
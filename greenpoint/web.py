@@ -1,64 +1,394 @@
 import asyncio
-import json
-import datetime
-import decimal
+import functools
+import gzip
+import hashlib
 
-import flask
+from aiohttp import web
 
-import flask_cors
+import attr
 
-import flask_restful
+import cachetools
 
+import daiquiri
+
+from greenpoint import fx
+from greenpoint import instrument
+from greenpoint import live
+from greenpoint import metrics
 from greenpoint import portfolio
+from greenpoint import resample
+from greenpoint import risk
+from greenpoint import serialize
+from greenpoint import ticks
+from greenpoint import utils
+
+
+LOG = daiquiri.getLogger(__name__)
+
+routes = web.RouteTableDef()
+
+
+@attr.s(slots=True, frozen=True)
+class CachedResponse(object):
+    body = attr.ib()
+    gzipped = attr.ib()
+    etag = attr.ib()
+    content_type = attr.ib()
+    tags = attr.ib()
+
+    # Smaller bodies are not worth compressing
+    GZIP_MIN_SIZE = 1024
+
+    @classmethod
+    def from_body(cls, body, content_type, tags):
+        return cls(
+            body=body,
+            gzipped=(gzip.compress(body)
+                     if len(body) >= cls.GZIP_MIN_SIZE else None),
+            etag='"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest(),
+            content_type=content_type,
+            tags=frozenset(tags),
+        )
+
+    def to_response(self, request):
+        headers = {
+            "ETag": self.etag,
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = {
+            etag.strip()
+            for etag in request.headers.get("If-None-Match", "").split(",")
+        }
+        if self.etag in if_none_match or "*" in if_none_match:
+            return web.Response(status=304, headers=headers)
+        if (self.gzipped is not None and
+           "gzip" in request.headers.get("Accept-Encoding", "")):
+            headers["Content-Encoding"] = "gzip"
+            body = self.gzipped
+        else:
+            body = self.body
+        return web.Response(body=body, headers=headers,
+                            content_type=self.content_type)
 
 
-app = flask.Flask(__name__)
-flask_cors.CORS(app)
+class ResponseCache(object):
+    """Encoded responses keyed by endpoint and parameters.
 
+    Entries are tagged with the kind of data they are built from and are
+    kept until a change of that data is notified.
+    """
+
+    def __init__(self, maxsize=256):
+        self.entries = cachetools.LRUCache(maxsize=maxsize)
+        # Bumped on each invalidation so that responses built while their
+        # data changed are not cached
+        self.generations = {}
+        self.cleared = 0
 
-class Portfolio(flask_restful.Resource):
     @staticmethod
-    def get():
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        f = portfolio.get_status_for_all(loop)
-        status = loop.run_until_complete(f)
-        return [dict(p) for p in status]
-
-
-api = flask_restful.Api(app)
-api.add_resource(Portfolio, '/portfolio')
-
-
-@app.route('/')
-def hello_world():
-    return 'Hello, World!'
-
-
-def _to_primitive(obj):
-    if isinstance(obj, (str, int, type(None), bool, float)):
-        return obj
-    if isinstance(obj, decimal.Decimal):
-        return float(obj)
-    if isinstance(obj, (datetime.datetime, datetime.date)):
-        return obj.isoformat()
-    if isinstance(obj, datetime.timedelta):
-        return obj.total_seconds()
-    if isinstance(obj, dict):
-        return {_to_primitive(k): _to_primitive(v)
-                for k, v in obj.items()}
-    if hasattr(obj, 'items'):
-        return _to_primitive(dict(obj.items()))
-    if hasattr(obj, '__iter__'):
-        return list(map(_to_primitive, obj))
-    return obj
-
-
-@api.representation('application/json')
-def output_json(data, code, headers=None):
-    resp = flask.make_response(json.dumps(_to_primitive(data)), code)
-    resp.headers.extend(headers or {})
-    return resp
+    def key(request):
+        return request.path, tuple(sorted(request.query.items()))
+
+    def get(self, request):
+        return self.entries.get(self.key(request))
+
+    def generation(self, tags):
+        """Return the current generation of a set of tags."""
+        return self.cleared, tuple(self.generations.get(tag, 0)
+                                   for tag in sorted(tags))
+
+    def set(self, request, body, content_type, tags,  # noqa
+            generation=None):
+        """Cache a response.
+
+        :param generation: The generation of the tags when the response
+                           started being built, see `generation`. The
+                           response is not cached if they changed since.
+        """
+        entry = CachedResponse.from_body(body, content_type, tags)
+        if generation is None or generation == self.generation(tags):
+            self.entries[self.key(request)] = entry
+        return entry
+
+    def invalidate(self, tag=None):
+        if tag is None:
+            self.cleared += 1
+            self.entries.clear()
+            return
+        self.generations[tag] = self.generations.get(tag, 0) + 1
+        for key, entry in list(self.entries.items()):
+            if tag in entry.tags:
+                self.entries.pop(key, None)
+
+
+RESPONSE_CACHE = web.AppKey("response_cache", ResponseCache)
+LIVE_QUOTES = web.AppKey("live_quotes", live.LiveQuotes)
+LISTENER = web.AppKey("listener", object)
+
+
+def cached(get_tags):
+    """Serve the handler responses from the application response cache.
+
+    :param get_tags: A function returning the tags of a request.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            cache = request.app[RESPONSE_CACHE]
+            entry = cache.get(request)
+            if entry is not None:
+                return entry.to_response(request)
+            tags = get_tags(request)
+            generation = cache.generation(tags)
+            result = await handler(request)
+            if isinstance(result, ChunkedBody):
+                # Sent without an ETag but cached like the others
+                response, body = await result.send(request)
+                cache.set(request, body, result.content_type, tags,
+                          generation)
+                return response
+            if result.status != 200:
+                return result
+            entry = cache.set(request, result.body, result.content_type,
+                              tags, generation)
+            return entry.to_response(request)
+        return wrapper
+    return decorator
+
+
+def on_change(app, payload):
+    """Invalidate cached data after a change notification."""
+    LOG.debug("Data changed: %s", payload)
+    kind, _, key = payload.partition(":")
+    cache = app[RESPONSE_CACHE]
+    if kind in ("operations", "fx"):
+        app[LIVE_QUOTES].invalidate()
+    if kind == "quotes":
+        instrument.invalidate_quotes(key)
+        cache.invalidate("quotes:" + key)
+    elif kind == "fx":
+        fx.RATE_TABLES.clear()
+        cache.invalidate(kind)
+    else:
+        cache.invalidate(kind)
+
+
+@attr.s(slots=True, frozen=True)
+class ChunkedBody(object):
+    """A body sent while it is being encoded, with chunked encoding.
+
+    The headers are sent before the body is known, so the response has no
+    `ETag`. The body is returned to be cached, and the next requests get
+    it with an `ETag` from the cache.
+    """
+
+    chunks = attr.ib()
+    content_type = attr.ib(default="application/json")
+
+    async def send(self, request):
+        response = web.StreamResponse(headers={
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        })
+        response.content_type = self.content_type
+        response.enable_chunked_encoding()
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            # Compressed on the fly, like the cached body would be
+            response.enable_compression(web.ContentCoding.gzip)
+        await response.prepare(request)
+        body = []
+        for chunk in self.chunks:
+            body.append(chunk)
+            await response.write(chunk)
+        await response.write_eof()
+        return response, b"".join(body)
+
+
+def output_json(data, status=200):
+    return web.Response(body=serialize.dumps(data), status=status,
+                        content_type="application/json")
+
+
+# Results with more rows than this are streamed
+STREAM_MIN_ROWS = 5000
+
+
+def output_records(records):
+    if not records:
+        return output_json([])
+    encoder = serialize.compile_encoder(records[0])
+    if len(records) < STREAM_MIN_ROWS:
+        return web.Response(body=encoder.encode(records),
+                            content_type="application/json")
+    return ChunkedBody(encoder.iter_encode(records))
+
+
+def _get_arg(request, name, type_):
+    value = request.query.get(name)
+    if value is None:
+        return
+    try:
+        return type_(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text="Invalid value for `%s'" % name)
+
+
+@routes.get('/')
+async def hello_world(request):
+    return web.Response(text='Hello, World!')
+
+
+@routes.get('/portfolio')
+@cached(lambda request: ("operations", "live_quote", "fx"))
+async def get_portfolio(request):
+    pea = request.query.get('pea')
+    instrument_type = _get_arg(request, 'type', instrument.InstrumentType)
+    status = await portfolio.get_status(
+        portfolio_name=request.query.get('portfolio'),
+        instrument_type=(None if instrument_type is None
+                         else instrument_type.value),
+        currency=request.query.get('currency'),
+        pea=None if pea is None else pea in ('1', 'true'))
+    return output_records(status)
+
+
+@routes.get('/income')
+@cached(lambda request: ("operations",))
+async def get_income(request):
+    income = await portfolio.get_income(
+        request.query.get('portfolio'),
+        _get_arg(request, 'year', int),
+        request.query.get('monthly') in ('1', 'true'))
+    return output_records(income)
+
+
+@routes.get('/risk')
+async def get_risk(request):
+    result = await risk.get_risk(
+        _get_arg(request, 'window', int) or risk.DEFAULT_WINDOW)
+    return output_json(result.to_primitive())
+
+
+@routes.get('/quotes/{isin}')
+@cached(lambda request: ("quotes:" + request.match_info['isin'].upper(),))
+async def get_quotes(request):
+    freq = request.query.get('freq')
+    if freq is not None and freq not in resample.FREQUENCIES:
+        raise web.HTTPBadRequest(text="Invalid value for `freq'")
+    quotes = await resample.get_chart(
+        request.match_info['isin'].upper(),
+        _get_arg(request, 'start', utils.parse_date),
+        _get_arg(request, 'stop', utils.parse_date),
+        freq,
+        _get_arg(request, 'points', int))
+    return output_json(resample.to_primitive(quotes))
+
+
+@routes.get('/ticks/{isin}')
+@cached(lambda request: ("ticks",))
+async def get_ticks(request):
+    records = await ticks.get_ticks(
+        request.match_info['isin'].upper(),
+        _get_arg(request, 'start', utils.parse_date))
+    return output_records(records)
+
+
+@routes.get('/metrics')
+async def get_metrics(request):
+    return web.Response(
+        text=metrics.REGISTRY.expose(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+# Seconds between two comments sent to keep idle event streams open
+KEEPALIVE_INTERVAL = 15
+
+
+@routes.get('/live')
+async def get_live(request):
+    """Stream the portfolio status, then its changes, as Server-Sent Events.
+
+    A `status` event carries the whole status, then each `quote` event
+    carries a new instrument quote and the revalued holding. Clients that
+    cannot keep up are disconnected, and get a fresh status on reconnect.
+    """
+    live_quotes = request.app[LIVE_QUOTES]
+    response = web.StreamResponse(headers={"Cache-Control": "no-cache"})
+    response.content_type = "text/event-stream"
+    await response.prepare(request)
+
+    subscriber = live_quotes.subscribe()
+    try:
+        # Quotes notified meanwhile are revalued on top of this status
+        async with live_quotes.lock:
+            status = await portfolio.get_status()
+            live_quotes.set_status(status)
+        encoder = serialize.compile_encoder(status[0]) if status else None
+        await response.write(
+            b"event: status\ndata: " +
+            (encoder.encode(status) if encoder else b"[]") + b"\n\n")
+        while not subscriber.lagging:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(),
+                                               KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                await response.write(b": keepalive\n\n")
+                continue
+            await response.write(
+                b"event: quote\ndata: " + serialize.dumps(event) + b"\n\n")
+    finally:
+        live_quotes.unsubscribe(subscriber)
+    return response
+
+
+async def add_cors_headers(request, response):
+    response.headers['Access-Control-Allow-Origin'] = '*'
+
+
+def make_app(pool_size=None):
+    """Build the Web application.
+
+    All requests handled by the application share one database pool, opened
+    when the application starts.
+
+    :param pool_size: Maximum number of database connections.
+    """
+    app = web.Application()
+    app.on_response_prepare.append(add_cors_headers)
+    app.add_routes(routes)
+    app[RESPONSE_CACHE] = ResponseCache()
+    app[LIVE_QUOTES] = live.LiveQuotes()
+
+    def listener(connection, pid, channel, payload):
+        on_change(app, payload)
+
+    def live_listener(connection, pid, channel, payload):
+        asyncio.ensure_future(app[LIVE_QUOTES].on_notification(payload))
+
+    async def open_db(app):
+        pool = await utils.get_db(max_size=pool_size)
+        # Changes made by other processes, e.g. `greenpoint instrument
+        # update`, are notified on this connection
+        app[LISTENER] = await pool.acquire()
+        await app[LISTENER].add_listener(utils.CHANGES_CHANNEL, listener)
+        await app[LISTENER].add_listener(utils.LIVE_QUOTES_CHANNEL,
+                                         live_listener)
+
+    async def close_db(app):
+        pool = await utils.get_db()
+        await app[LISTENER].remove_listener(
+            utils.CHANGES_CHANNEL, listener)
+        await app[LISTENER].remove_listener(
+            utils.LIVE_QUOTES_CHANNEL, live_listener)
+        await pool.release(app[LISTENER])
+        await utils.close_db()
+
+    app.on_startup.append(open_db)
+    app.on_cleanup.append(close_db)
+    return app
+
+
+def serve(host=None, port=5000, pool_size=None, reuse_port=False):
+    web.run_app(make_app(pool_size), host=host, port=port,
+                reuse_port=reuse_port)
@@ -1,11 +1,24 @@
 DROP FUNCTION portfolios_at;
+-- Created by older versions of the schema
+DROP FUNCTION IF EXISTS fx_rates_at;
+
+DROP VIEW fx_latest_rates;
+DROP MATERIALIZED VIEW fx_rates;
+
+DROP TRIGGER instruments_latest_quote_notify ON instruments;
+DROP FUNCTION notify_latest_quote;
 
 DROP VIEW portfolios;
 DROP VIEW portfolios_history;
 
+DROP TABLE operations_rollup;
 DROP TABLE operations;
+DROP TABLE quote_ticks;
+DROP TABLE alerts;
 DROP TABLE quotes;
 DROP TABLE instruments;
 
 DROP TYPE operation_type;
+DROP TYPE alert_kind;
+DROP TYPE alert_direction;
 DROP TYPE instrument_type;
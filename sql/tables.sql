@@ -11,6 +11,8 @@ CREATE TABLE IF NOT EXISTS instruments (
        exchange_mic text,
        currency text CHECK (upper(currency) = currency) NOT NULL,
        is_alive bool DEFAULT true NOT NULL,
+       empty_refreshes integer DEFAULT 0 NOT NULL,
+       empty_session date,
        latest_quote float,
        latest_quote_time timestamp with time zone
 );
@@ -29,6 +31,22 @@ CREATE TABLE IF NOT EXISTS quotes (
        UNIQUE (instrument_isin, date)
 );
 
+-- Intraday quotes from live refreshes, compacted into `quotes` once the
+-- day is over
+CREATE TABLE IF NOT EXISTS quote_ticks (
+       instrument_isin text REFERENCES instruments(isin) NOT NULL,
+       time timestamp with time zone NOT NULL,
+       date date NOT NULL,
+       price float NOT NULL,
+       open float,
+       high float,
+       low float,
+       volume bigint,
+       UNIQUE (instrument_isin, time)
+);
+
+CREATE INDEX IF NOT EXISTS quote_ticks_date_idx ON quote_ticks (date);
+
 CREATE TYPE operation_type AS ENUM ('trade', 'dividend', 'tax');
 
 CREATE TABLE IF NOT EXISTS operations (
@@ -43,6 +61,36 @@ CREATE TABLE IF NOT EXISTS operations (
        currency text NOT NULL
 );
 
+CREATE TYPE alert_kind AS ENUM ('price', 'move', 'weight');
+CREATE TYPE alert_direction AS ENUM ('above', 'below');
+
+-- Alert rules, fired once by `greenpoint instrument watch`
+CREATE TABLE IF NOT EXISTS alerts (
+       id serial PRIMARY KEY,
+       instrument_isin text REFERENCES instruments(isin) NOT NULL,
+       kind alert_kind NOT NULL,
+       direction alert_direction NOT NULL,
+       value float NOT NULL,
+       reference float,
+       created_at timestamp with time zone NOT NULL,
+       fired_at timestamp with time zone
+);
+
+-- Dividends, fees and taxes by month of the operations, kept up to date when
+-- operations are saved
+CREATE TABLE IF NOT EXISTS operations_rollup (
+       portfolio_name text NOT NULL,
+       instrument_isin text REFERENCES instruments(isin) NOT NULL,
+       year integer NOT NULL,
+       month integer NOT NULL,
+       currency text NOT NULL,
+       dividends numeric NOT NULL,
+       fees numeric NOT NULL,
+       taxes numeric NOT NULL,
+       operations integer NOT NULL,
+       UNIQUE (portfolio_name, year, month, instrument_isin, currency)
+);
+
 CREATE OR REPLACE VIEW portfolios_history AS
 select portfolio_name,
        instrument_isin,
@@ -99,3 +147,62 @@ CREATE OR REPLACE FUNCTION portfolios_at(_date date)
   where summary.position != 0
   $$
   LANGUAGE sql;
+
+
+-- FX pairs are `currency` instruments whose ISIN is the pair code, e.g.
+-- `USDEUR` is the price of one USD in EUR (the instrument currency).
+CREATE MATERIALIZED VIEW IF NOT EXISTS fx_rates AS
+with pairs as (
+    select left(isin, 3) as base, instruments.currency as quote, date, close as rate
+    from quotes
+    join instruments on instrument_isin = isin
+    where type = 'currency'
+          and length(isin) = 6
+          and right(isin, 3) = instruments.currency
+          and close is not null
+          and close != 0
+), both_ways as (
+    select base, quote, date, rate from pairs
+    union all
+    select quote, base, date, 1 / rate from pairs
+), with_pence as (
+    select base, quote, date, rate from both_ways
+    union all
+    -- GBX is a hundredth of GBP
+    select 'GBX', quote, date, rate / 100 from both_ways where base = 'GBP'
+    union all
+    select base, 'GBX', date, rate * 100 from both_ways where quote = 'GBP'
+)
+select distinct on (base, quote, date) base, quote, date, rate
+from with_pence
+order by base, quote, date;
+
+CREATE UNIQUE INDEX IF NOT EXISTS fx_rates_base_quote_date_idx
+       ON fx_rates (base, quote, date);
+
+
+CREATE OR REPLACE VIEW fx_latest_rates AS
+select distinct on (base, quote) *
+from fx_rates
+order by base, quote, date desc;
+
+
+CREATE OR REPLACE FUNCTION notify_latest_quote() RETURNS trigger AS
+  $$
+  BEGIN
+    PERFORM pg_notify('greenpoint_live_quotes', json_build_object(
+      'isin', NEW.isin,
+      'latest_quote', NEW.latest_quote,
+      'latest_quote_time', NEW.latest_quote_time
+    )::text);
+    RETURN NEW;
+  END;
+  $$
+  LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS instruments_latest_quote_notify ON instruments;
+CREATE TRIGGER instruments_latest_quote_notify
+       AFTER UPDATE OF latest_quote ON instruments
+       FOR EACH ROW
+       WHEN (OLD.latest_quote IS DISTINCT FROM NEW.latest_quote)
+       EXECUTE PROCEDURE notify_latest_quote();